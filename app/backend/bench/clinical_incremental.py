@@ -0,0 +1,100 @@
+"""Simulates a long session: pages are added one at a time and the history is filled after each.
+
+Compares the full fill (resends every note) with the incremental one (only the
+new notes + the stored sections). Between fills the response is "saved" in
+clinical_sessions the way the editor does it, fill_sources included.
+
+The simulated model takes TTFT + input tokens * PREFILL_S + output tokens / speed;
+in incremental mode it answers only the sections that change.
+
+Usage: python -m bench.clinical_incremental [--pages 12]
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+
+import httpx
+
+from bench.clinical_parallel import filled
+from bench.fakes import FakeAnthropic, FakeSupabase, estimate_input_tokens
+from core.clients import get_anthropic, get_supabase
+from core.clinical_schema import SECTIONS
+from main import app
+
+TTFT_S = 0.8
+PREFILL_S = 0.0002
+TOKENS_PER_S = 80
+PAGE_TEXT = "Paciente refiere ansiedad en el trabajo, duerme mal y discute con su pareja. " * 25
+CHANGED = ["motivo_consulta", "historia_problema", "plan"]
+
+
+def fake_reply(kwargs: dict) -> str:
+    content = kwargs["messages"][-1]["content"]
+    match = re.search(r"Completa SOLO estas secciones: ([^.\n]+)\.", content)
+    if match:
+        keys = match.group(1).split(", ")
+    elif "NOTAS NUEVAS:" in content:
+        keys = CHANGED
+    else:
+        keys = [s.key for s in SECTIONS]
+    return json.dumps(filled(keys), ensure_ascii=False)
+
+
+def fake_latency(kwargs: dict, text: str) -> float:
+    return TTFT_S + estimate_input_tokens(kwargs) * PREFILL_S + (len(text) / 4) / TOKENS_PER_S
+
+
+class CountingClient:
+    def __init__(self, client):
+        self.client = client
+        self.input_tokens = 0
+        self.messages = self
+
+    async def create(self, **kwargs):
+        self.input_tokens += estimate_input_tokens(kwargs)
+        return await self.client.messages.create(**kwargs)
+
+
+async def run(pages: int, incremental: bool) -> list[dict]:
+    sb = FakeSupabase({"clinical_sessions": [{"id": "s", "fill_sources": {}}], "session_uploads": []})
+    client = CountingClient(FakeAnthropic(fake_latency, fake_reply))
+    app.dependency_overrides.update({get_supabase: lambda: sb, get_anthropic: lambda: client})
+
+    rows = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as http:
+        for page in range(1, pages + 1):
+            sb.tables["session_uploads"].append({
+                "id": f"u{page}", "session_id": "s", "file_name": f"p{page}.jpg",
+                "ocr_text": f"Página {page}. {PAGE_TEXT}", "is_processed": True,
+            })
+            before = client.input_tokens
+            start = time.perf_counter()
+            resp = await http.post("/clinical/fill", json={"session_id": "s", "incremental": incremental})
+            elapsed = time.perf_counter() - start
+            resp.raise_for_status()
+            # Save, as the editor does
+            sb.tables["clinical_sessions"][0].update(resp.json())
+            rows.append({"pages": page, "fill_s": round(elapsed, 2), "input_tokens": client.input_tokens - before})
+    app.dependency_overrides.clear()
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=12)
+    args = parser.parse_args()
+
+    full, incremental = await run(args.pages, False), await run(args.pages, True)
+    for a, b in zip(full, incremental):
+        print(json.dumps({
+            "pages": a["pages"],
+            "full": {k: a[k] for k in ("fill_s", "input_tokens")},
+            "incremental": {k: b[k] for k in ("fill_s", "input_tokens")},
+        }))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""Compares /clinical/fill in single vs parallel mode: latency and parity of the result.
+
+Without --live it uses a simulated model (latency = TTFT + output tokens / speed).
+With --live it calls the real API on the text of --notes.
+
+--corrupt P breaks each simulated section with probability P (half of them
+repairable locally, half not) and prints /clinical/stats at the end: wasted
+full generations and per-section retries per fill.
+
+Usage:
+  python -m bench.clinical_parallel [--runs 3] [--corrupt 0.2]
+  python -m bench.clinical_parallel --live --notes notes.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+import httpx
+
+from bench.fakes import FakeAnthropic, FakeSupabase
+from core.clients import get_anthropic, get_supabase
+from core.clinical_schema import SECTIONS, empty_template
+from main import app
+
+TTFT_S = 0.8
+TOKENS_PER_S = 80
+SAMPLE_NOTES = (
+    "Paciente refiere ansiedad laboral desde hace 6 meses, empeora los lunes. "
+    "Duerme mal. Impacto 7/10. Sin ideación suicida. Vive con su pareja. "
+    "Tarea: registro de pensamientos. Próxima sesión 2026-03-10 a las 17:00. Pagó por transferencia."
+)
+
+
+def filled(keys: list[str]) -> dict:
+    data = empty_template(tuple(keys))
+    for key, value in data.items():
+        if isinstance(value, list):
+            data[key] = [f"objetivo {i} según las notas de la sesión" for i in range(3)]
+        else:
+            for field in value:
+                value[field] = f"{key}.{field}: información extraída de las notas de la sesión"
+    return data
+
+
+def fake_reply(kwargs: dict, corrupt: float = 0.0, rnd: random.Random = random.Random(0)) -> str:
+    content = kwargs["messages"][-1]["content"]
+    match = re.search(r"Completa SOLO estas secciones: ([^.\n]+)\.", content)
+    keys = match.group(1).split(", ") if match else [s.key for s in SECTIONS]
+    data = filled(keys)
+    for key in keys:
+        if rnd.random() >= corrupt:
+            continue
+        if rnd.random() < 0.5:
+            # Repairable: a list section sent as text, numbers/lists as strings
+            value = data[key]
+            data[key] = "\n".join(value) if isinstance(value, list) else {
+                **value, **{f: "7/10" for f in value if f.endswith("_score")}, **{f: "a, b" for f in ("areas", "acciones") if f in value}
+            }
+        else:
+            data[key] = 42
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def fake_latency(kwargs: dict, text: str) -> float:
+    return TTFT_S + (len(text) / 4) / TOKENS_PER_S
+
+
+def leaves(data: dict) -> dict:
+    out = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            out.update({f"{key}.{k}": v for k, v in value.items()})
+        else:
+            out[key] = value
+    return out
+
+
+def parity(a: dict, b: dict) -> dict:
+    """Field-level agreement between two fills."""
+    la, lb = leaves(a), leaves(b)
+    keys = set(la) | set(lb)
+    both_filled = [k for k in keys if la.get(k) not in (None, [], "") and lb.get(k) not in (None, [], "")]
+    only_one = [k for k in keys if (la.get(k) in (None, [], "")) != (lb.get(k) in (None, [], ""))]
+    return {
+        "fields": len(keys),
+        "identical": sum(1 for k in keys if la.get(k) == lb.get(k)),
+        "filled_in_both": len(both_filled),
+        "filled_in_only_one": len(only_one),
+        "missing_sections": sorted(set(a) ^ set(b)),
+    }
+
+
+async def fill(http: httpx.AsyncClient, mode: str) -> tuple[float, dict]:
+    start = time.perf_counter()
+    resp = await http.post("/clinical/fill", json={"session_id": "s", "mode": mode})
+    resp.raise_for_status()
+    return time.perf_counter() - start, resp.json()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--notes")
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    args = parser.parse_args()
+
+    notes = open(args.notes, encoding="utf-8").read() if args.notes else SAMPLE_NOTES
+    sb = FakeSupabase({"session_uploads": [
+        {"id": "u1", "session_id": "s", "file_name": "nota.jpg", "ocr_text": notes, "is_processed": True},
+    ]})
+    if args.live:
+        import anthropic
+        client = anthropic.AsyncAnthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+    else:
+        client = FakeAnthropic(fake_latency, lambda kwargs: fake_reply(kwargs, args.corrupt))
+    app.dependency_overrides.update({get_supabase: lambda: sb, get_anthropic: lambda: client})
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as http:
+        for run in range(args.runs):
+            single_s, single = await fill(http, "single")
+            parallel_s, parallel = await fill(http, "parallel")
+            print(json.dumps({
+                "run": run,
+                "single_s": round(single_s, 2),
+                "parallel_s": round(parallel_s, 2),
+                "speedup": round(single_s / parallel_s, 2),
+                "parity": parity(single, parallel),
+            }, ensure_ascii=False))
+        print(json.dumps({"stats": (await http.get("/clinical/stats")).json()}))
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""Sending clinical histories: one SMTP connection per email vs the pool + /email/clinical-history/batch.
+
+Uses a local aiosmtpd server (pip install aiosmtpd) that simulates the cost of
+the handshake (STARTTLS + login on a real provider) with --handshake-ms on EHLO.
+Addresses @rechazado.invalid are refused to check the per-item status, and
+after the first batch it waits for the server to close the idle connections
+to check reconnecting.
+
+Usage: python -m bench.email_batch [--emails 50] [--pool 4] [--handshake-ms 150]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import aiosmtplib
+import httpx
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from bench.email_render import PATIENT, synthetic_session
+from bench.fakes import FakeSupabase
+from core.clients import get_smtp, get_supabase
+from core.smtp_pool import SMTPPool
+from endpoints import email as email_endpoint
+from endpoints.email import build_message
+from main import app
+
+HOST = "127.0.0.1"
+PORT = 8025
+IDLE_TIMEOUT_S = 2
+
+
+class Sink:
+    """aiosmtpd handler: counts connections, logins and delivered messages."""
+
+    def __init__(self, handshake_s: float):
+        self.handshake_s = handshake_s
+        self.connections = 0
+        self.logins = 0
+        self.delivered = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        await asyncio.sleep(self.handshake_s)
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith("@rechazado.invalid"):
+            return "550 5.1.1 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered += 1
+        return "250 Message accepted for delivery"
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        self.logins += 1
+        return AuthResult(success=True)
+
+
+def fixtures(n: int) -> tuple[dict, list[dict]]:
+    sessions = []
+    for i in range(n):
+        session = synthetic_session(400, seed=i)
+        session.update(id=f"s{i}", patient_id=f"p{i}", session_number=i + 1)
+        sessions.append(session)
+    patients = [{**PATIENT, "id": f"p{i}"} for i in range(n)]
+    items = [
+        {
+            "session_id": s["id"],
+            "patient_email": f"paciente{i}@rechazado.invalid" if i % 10 == 9 else f"paciente{i}@example.com",
+            "patient_name": PATIENT["full_name"],
+        }
+        for i, s in enumerate(sessions)
+    ]
+    return {"clinical_sessions": sessions, "patients": patients}, items
+
+
+async def per_email(tables: dict, items: list[dict], concurrency: int) -> float:
+    """The old path: aiosmtplib.send (connect, EHLO, login, send, QUIT) per email."""
+    sessions = {s["id"]: s for s in tables["clinical_sessions"]}
+    patients = {p["id"]: p for p in tables["patients"]}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(item: dict):
+        session = sessions[item["session_id"]]
+        async with semaphore:
+            try:
+                await aiosmtplib.send(
+                    build_message(session, patients[session["patient_id"]], item["patient_email"]),
+                    hostname=HOST, port=PORT, username="bench", password="bench", start_tls=False,
+                )
+            except aiosmtplib.SMTPRecipientsRefused:
+                pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(item) for item in items))
+    return time.perf_counter() - start
+
+
+async def batch(items: list[dict]) -> tuple[float, dict]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as http:
+        start = time.perf_counter()
+        res = await http.post("/email/clinical-history/batch", json={"items": items})
+        res.raise_for_status()
+        return time.perf_counter() - start, res.json()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=50)
+    parser.add_argument("--pool", type=int, default=4)
+    parser.add_argument("--handshake-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    email_endpoint.SMTP_FROM = "consultorio@example.com"
+    sink = Sink(args.handshake_ms / 1000)
+    controller = Controller(
+        sink, hostname=HOST, port=PORT,
+        authenticator=sink.authenticate, auth_require_tls=False, timeout=IDLE_TIMEOUT_S,
+    )
+    controller.start()
+    tables, items = fixtures(args.emails)
+    pool = SMTPPool(HOST, PORT, "bench", "bench", start_tls=False, size=args.pool, check_after_s=1)
+    sb = FakeSupabase(tables, 0.01)
+    app.dependency_overrides.update({get_supabase: lambda: sb, get_smtp: lambda: pool})
+
+    try:
+        elapsed = await per_email(tables, items, args.pool)
+        report = {"per_email": {"s": round(elapsed, 2), "connections": sink.connections, "logins": sink.logins, "delivered": sink.delivered}}
+
+        for phase in ("batch", "batch_after_idle"):
+            if phase == "batch_after_idle":
+                # The server drops idle connections; the pool must notice and reconnect
+                await asyncio.sleep(IDLE_TIMEOUT_S + 1)
+            sink.connections = sink.logins = sink.delivered = 0
+            elapsed, body = await batch(items)
+            report[phase] = {
+                "s": round(elapsed, 2),
+                "connections": sink.connections,
+                "logins": sink.logins,
+                "delivered": sink.delivered,
+                "sent": body["sent"],
+                "failed": body["failed"],
+                "first_error": next((r["detail"] for r in body["results"] if r["status"] == "error"), None),
+            }
+        report["pool"] = pool.stats()
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    finally:
+        await pool.close()
+        controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""Throughput of rendering the clinical history email (HTML + plain text).
+
+Usage:
+  python -m bench.email_render                   # fields of 20, 400 and 4000 chars (HTML of ~6, 32 and 275 KB)
+  python -m bench.email_render --seconds 2 --jsonb-strings
+"""
+import argparse
+import json
+import random
+import time
+
+from core.clinical_schema import SECTIONS, empty_template
+from core.email_render import clinical_history_email
+
+WORDS = "ansiedad sueño trabajo familia pareja duelo rumiación límites <tarea> & autocuidado respiración".split()
+
+
+def synthetic_session(field_chars: int, jsonb_strings: bool = False, seed: int = 0) -> dict:
+    """A clinical_sessions row with every field filled with ~field_chars of text."""
+    rnd = random.Random(seed)
+
+    def text() -> str:
+        words, size = [], 0
+        while size < field_chars:
+            words.append(rnd.choice(WORDS))
+            size += len(words[-1]) + 1
+        return " ".join(words)
+
+    session = {"session_number": 12, "session_date": "2026-10-18", "session_time": "10:00:00", "modality": "presencial", "status": "completed"}
+    for section in SECTIONS:
+        if section.is_list:
+            session[section.key] = [text() for _ in range(5)]
+            continue
+        data = empty_template((section.key,))[section.key]
+        for f in section.fields:
+            data[f.key] = rnd.randint(0, 10) if f.kind == "number" else [text() for _ in range(3)] if f.is_list else text()
+        session[section.key] = json.dumps(data, ensure_ascii=False) if jsonb_strings else data
+    return session
+
+
+PATIENT = {
+    "full_name": "Ana María Pérez", "preferred_name": "Ana", "pronouns": "ella", "document_id": "1020304050",
+    "age": 29, "phone": "+57 300 000 0000", "email": "ana@example.com", "city": "Bogotá",
+    "occupation": "Diseñadora", "education": "Universitaria", "referral_source": "Instagram",
+}
+
+
+def measure(fn, session: dict, seconds: float) -> dict:
+    fn(session, PATIENT)  # warm-up
+    n, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < seconds:
+        fn(session, PATIENT)
+        n += 1
+    return {"renders_per_s": round(n / elapsed), "us_per_render": round(elapsed / n * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--jsonb-strings", action="store_true", help="columnas JSONB como texto JSON")
+    args = parser.parse_args()
+
+    for field_chars in (20, 400, 4000):
+        session = synthetic_session(field_chars, args.jsonb_strings)
+        text, html = clinical_history_email.render(session, PATIENT)
+        print(json.dumps({
+            "field_chars": field_chars,
+            "html_bytes": len(html.encode()),
+            "text_bytes": len(text.encode()),
+            "html": measure(clinical_history_email.html, session, args.seconds),
+            "text": measure(clinical_history_email.text, session, args.seconds),
+            "html+text": measure(clinical_history_email.render, session, args.seconds),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""In-memory stand-ins for Anthropic and Supabase used by the benchmarks."""
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+
+from postgrest.exceptions import APIError
+
+
+def estimate_input_tokens(kwargs: dict) -> int:
+    """~4 chars per text token, ~1600 tokens per image block."""
+    tokens = 0
+    system = kwargs.get("system") or []
+    blocks = [{"type": "text", "text": system}] if isinstance(system, str) else list(system)
+    for message in kwargs["messages"]:
+        content = message["content"]
+        blocks.extend([{"type": "text", "text": content}] if isinstance(content, str) else content)
+    for block in blocks:
+        tokens += 1600 if block["type"] == "image" else len(block.get("text", "")) // 4
+    return tokens
+
+
+class FakeMessages:
+    """`latency` is seconds, or a callable (kwargs, reply_text) -> seconds."""
+
+    def __init__(self, latency, reply):
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        text = self.reply(kwargs) if callable(self.reply) else self.reply
+        await asyncio.sleep(self.delay(kwargs, text))
+        return self.build(kwargs, text)
+
+    def delay(self, kwargs: dict, text: str) -> float:
+        return self.latency(kwargs, text) if callable(self.latency) else self.latency
+
+    def stream(self, **kwargs):
+        return FakeStream(self, kwargs)
+
+    @staticmethod
+    def build(kwargs: dict, text: str):
+        # With a forced tool, a JSON reply comes back as the tool's input
+        tool = (kwargs.get("tool_choice") or {}).get("name")
+        try:
+            data = json.loads(text) if tool else None
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, dict):
+            block = SimpleNamespace(type="tool_use", id="toolu_fake", name=tool, input=data)
+        else:
+            block = SimpleNamespace(type="text", text=text)
+        return SimpleNamespace(
+            content=[block],
+            usage=SimpleNamespace(input_tokens=estimate_input_tokens(kwargs), output_tokens=len(text) // 4),
+            stop_reason="tool_use" if block.type == "tool_use" else "end_turn",
+        )
+
+
+class FakeStream:
+    def __init__(self, messages: "FakeMessages", kwargs: dict):
+        self.messages = messages
+        self.kwargs = kwargs
+        self.final = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def chunks(self):
+        self.messages.calls += 1
+        text = self.messages.reply(self.kwargs) if callable(self.messages.reply) else self.messages.reply
+        chunks = [text[i:i + 16] for i in range(0, len(text), 16)] or [""]
+        for chunk in chunks:
+            await asyncio.sleep(self.messages.delay(self.kwargs, text) / len(chunks))
+            yield chunk
+        self.final = self.messages.build(self.kwargs, text)
+
+    @property
+    async def text_stream(self):
+        async for chunk in self.chunks():
+            yield chunk
+
+    async def __aiter__(self):
+        # Raw events: input_json_delta when a tool is forced, text_delta otherwise
+        tool = "tool_choice" in self.kwargs
+        async for chunk in self.chunks():
+            delta = (
+                SimpleNamespace(type="input_json_delta", partial_json=chunk) if tool
+                else SimpleNamespace(type="text_delta", text=chunk)
+            )
+            yield SimpleNamespace(type="content_block_delta", index=0, delta=delta)
+
+    async def get_final_message(self):
+        return self.final
+
+
+class FakeAnthropic:
+    def __init__(self, latency=0.5, reply="{}"):
+        self.messages = FakeMessages(latency, reply)
+
+
+# Tables whose primary key isn't `id` (upsert conflict target)
+PRIMARY_KEYS = {
+    "summary_cache": ("patient_id", "next_session_date"),
+    "session_rollups": ("patient_id", "level", "idx"),
+    "ocr_cache": ("key",),
+}
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.payload = None
+        self.op = "select"
+        self.is_single = False
+        self.limit_n = None
+        self.order_key = None
+        self.columns = None
+
+    def select(self, *columns):
+        columns = ",".join(columns).strip()
+        if columns and columns != "*":
+            self.columns = [c.strip() for c in columns.split(",")]
+        return self
+
+    def project(self, row: dict) -> dict:
+        """PostgREST-style projection: `col`, `alias:col`, `alias:col->>key`."""
+        if self.columns is None:
+            return row
+        out = {}
+        for column in self.columns:
+            alias, _, path = column.rpartition(":")
+            col, *keys = re.split(r"->>?", path)
+            value = row.get(col)
+            for key in keys:
+                value = value.get(key) if isinstance(value, dict) else None
+            out[alias or (keys[-1] if keys else col)] = value
+        return out
+
+    def eq(self, key, value):
+        self.filters.append(lambda r: r.get(key) == value)
+        return self
+
+    def neq(self, key, value):
+        self.filters.append(lambda r: r.get(key) != value)
+        return self
+
+    def gte(self, key, value):
+        self.filters.append(lambda r: r.get(key) is not None and r.get(key) >= value)
+        return self
+
+    def lt(self, key, value):
+        self.filters.append(lambda r: r.get(key) is not None and r.get(key) < value)
+        return self
+
+    def in_(self, key, values):
+        self.filters.append(lambda r: r.get(key) in values)
+        return self
+
+    def order(self, key, desc=False):
+        self.order_key = (key, desc)
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def single(self):
+        self.is_single = True
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = "update", payload
+        return self
+
+    def upsert(self, payload, **kwargs):
+        self.op, self.payload = "upsert", payload
+        return self
+
+    async def execute(self):
+        await asyncio.sleep(self.db.latency)
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.op == "upsert":
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            pk = PRIMARY_KEYS.get(self.table, ("id",))
+            by_pk = {tuple(r.get(k) for k in pk): r for r in rows}
+            for item in payload:
+                existing = by_pk.get(tuple(item.get(k) for k in pk))
+                if existing is not None:
+                    existing.update(item)
+                else:
+                    rows.append(dict(item))
+            return SimpleNamespace(data=payload)
+        matched = [r for r in rows if all(f(r) for f in self.filters)]
+        if self.op == "update":
+            for r in matched:
+                r.update(self.payload)
+            return SimpleNamespace(data=matched)
+        if self.order_key:
+            key, desc = self.order_key
+            matched.sort(key=lambda r: r.get(key) or "", reverse=desc)
+        if self.limit_n is not None:
+            matched = matched[: self.limit_n]
+        matched = [self.project(r) for r in matched]
+        if self.is_single:
+            return SimpleNamespace(data=matched[0] if matched else None)
+        return SimpleNamespace(data=matched)
+
+
+class FakeRPC:
+    def __init__(self, db: "FakeSupabase", name: str, params: dict):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    async def execute(self):
+        await asyncio.sleep(self.db.latency)
+        fn = self.db.functions.get(self.name)
+        if fn is None:
+            raise APIError({"code": "PGRST202", "message": f"Could not find the function public.{self.name}"})
+        return SimpleNamespace(data=fn(self.db.tables, **self.params))
+
+
+def save_ocr_texts(tables: dict, p_ids: list[str], p_texts: list[str]) -> list[str]:
+    """Python stand-in for the save_ocr_texts SQL function."""
+    by_id = {r["id"]: r for r in tables.get("session_uploads", [])}
+    updated = []
+    for upload_id, text in zip(p_ids, p_texts):
+        if upload_id in by_id:
+            by_id[upload_id].update(ocr_text=text, is_processed=True)
+            updated.append(upload_id)
+    return updated
+
+
+class FakeSupabase:
+    """`functions` maps RPC names to python stand-ins: fn(tables, **params) -> data.
+    save_ocr_texts is always available."""
+
+    def __init__(self, tables: dict | None = None, latency: float = 0.01, functions: dict | None = None):
+        self.tables = tables or {}
+        self.latency = latency
+        self.functions = {"save_ocr_texts": save_ocr_texts, **(functions or {})}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict | None = None) -> FakeRPC:
+        return FakeRPC(self, name, params or {})
@@ -0,0 +1,79 @@
+"""Checks that N simultaneous calls to /clinical/fill are not serialized.
+
+Fails if the N take more than MAX_RATIO times what a single one takes per wave
+of MODEL_MAX_CONCURRENCY model calls (the scheduler lets no more through at
+once), if /health takes more than MAX_HEALTH_S while they run, or if any of
+them doesn't answer 200.
+
+Usage: python -m bench.fill_concurrency [N] [llm_latency_s]
+"""
+import asyncio
+import json
+import math
+import sys
+import time
+
+import httpx
+
+from bench.clinical_parallel import fake_reply
+from bench.fakes import FakeAnthropic, FakeSupabase
+from core.clients import get_anthropic, get_supabase
+from core.model_scheduler import model_scheduler
+from main import app
+
+# N concurrent fills should take about as long as one, not N times as long
+# (per wave of model calls the scheduler lets through at once)
+MAX_RATIO = 1.5
+# /health must not wait behind the model calls
+MAX_HEALTH_S = 0.2
+
+
+async def run(n: int, latency: float) -> dict:
+    sb = FakeSupabase({
+        "session_uploads": [
+            {"id": f"u{i}", "session_id": f"s{i}", "file_name": "nota.jpg", "ocr_text": "texto", "is_processed": True}
+            for i in range(n)
+        ],
+    })
+    app.dependency_overrides[get_supabase] = lambda: sb
+    client = FakeAnthropic(latency, fake_reply)
+    app.dependency_overrides[get_anthropic] = lambda: client
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        start = time.perf_counter()
+        await http.post("/clinical/fill", json={"session_id": "s0"})
+        single = time.perf_counter() - start
+        calls_per_fill = client.messages.calls
+
+        start = time.perf_counter()
+        fills = [http.post("/clinical/fill", json={"session_id": f"s{i}"}) for i in range(n)]
+        tasks = [asyncio.create_task(f) for f in fills]
+        await asyncio.sleep(latency / 10)
+        health_start = time.perf_counter()
+        await http.get("/health")
+        health = time.perf_counter() - health_start
+        responses = await asyncio.gather(*tasks)
+        concurrent = time.perf_counter() - start
+
+    app.dependency_overrides.clear()
+    waves = math.ceil(n * calls_per_fill / model_scheduler.max_concurrency)
+    result = {
+        "n": n,
+        "single_s": round(single, 3),
+        "concurrent_s": round(concurrent, 3),
+        "ratio": round(concurrent / single, 2),
+        "model_call_waves": waves,
+        "health_during_fill_s": round(health, 3),
+        "statuses": sorted({r.status_code for r in responses}),
+    }
+    assert result["statuses"] == [200], f"respuestas: {result['statuses']}"
+    assert concurrent / single <= MAX_RATIO * waves, f"{n} fills took {result['ratio']}x as long as one (max {MAX_RATIO * waves}x)"
+    assert health <= MAX_HEALTH_S, f"/health took {health:.3f}s during the fills (max {MAX_HEALTH_S}s)"
+    return result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    print(json.dumps(asyncio.run(run(n, latency))))
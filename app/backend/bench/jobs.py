@@ -0,0 +1,129 @@
+"""Job queue: /clinical/fill/jobs with a simulated model that sometimes answers 529.
+
+Measures how long the 202 takes against how long the job takes, how many
+attempts were needed, and that jobs interrupted by a restart are resumed.
+
+Usage: python -m bench.jobs [--jobs 20] [--overloaded 0.3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import anthropic
+import httpx
+
+import core.jobs as jobs_module
+from bench.clinical_parallel import fake_reply
+from bench.fakes import FakeAnthropic, FakeSupabase
+from core.clients import Clients, get_anthropic, get_supabase
+from core.jobs import JobStore, job_queue
+from main import app
+
+
+class Overloaded:
+    """Wraps a fake client so a share of calls fail like an overloaded API (529)."""
+
+    def __init__(self, client, rate: float, seed: int = 0):
+        self.client = client
+        self.messages = self
+        self.rate = rate
+        self.rnd = random.Random(seed)
+        self.failures = 0
+
+    async def create(self, **kwargs):
+        if self.rnd.random() < self.rate:
+            self.failures += 1
+            response = httpx.Response(529, request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+            raise anthropic.InternalServerError("Overloaded", response=response, body=None)
+        return await self.client.messages.create(**kwargs)
+
+
+async def wait_result(http: httpx.AsyncClient, job_id: str) -> tuple[int, dict]:
+    while True:
+        res = await http.get(f"/jobs/{job_id}/result")
+        if res.status_code != 202:
+            return res.status_code, res.json()
+        await asyncio.sleep(0.05)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--overloaded", type=float, default=0.3)
+    args = parser.parse_args()
+
+    tables = {"session_uploads": [
+        {"id": f"u{i}", "session_id": f"s{i}", "file_name": "nota.jpg", "ocr_text": f"Notas de la sesión {i}", "is_processed": True}
+        for i in range(args.jobs)
+    ]}
+    sb = FakeSupabase(tables, 0.01)
+    client = Overloaded(FakeAnthropic(lambda kwargs, text: 0.5, fake_reply), args.overloaded)
+    clients = Clients()
+    clients.supabase, clients.anthropic = sb, client
+    app.dependency_overrides.update({get_supabase: lambda: sb, get_anthropic: lambda: client})
+
+    jobs_module.JOBS_BACKOFF_S = 0.2
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    job_queue.store = JobStore(path)
+    await job_queue.start(clients)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as http:
+        # 1. Retries: submit everything, then wait for the results
+        start = time.perf_counter()
+        submit_ms, ids = [], []
+        for i in range(args.jobs):
+            t = time.perf_counter()
+            res = await http.post("/clinical/fill/jobs", json={"session_id": f"s{i}", "incremental": False})
+            submit_ms.append((time.perf_counter() - t) * 1000)
+            assert res.status_code == 202, res.text
+            ids.append(res.json()["job_id"])
+        # A double-click while the first one is pending joins it
+        duplicate = (await http.post("/clinical/fill/jobs", json={"session_id": "s0", "incremental": False})).json()
+
+        outcomes = await asyncio.gather(*(wait_result(http, job_id) for job_id in ids))
+        statuses = [(await http.get(f"/jobs/{job_id}")).json() for job_id in ids]
+        print(json.dumps({
+            "phase": "retries",
+            "jobs": args.jobs,
+            "submit_ms_p50": round(statistics.median(submit_ms), 1),
+            "all_done_s": round(time.perf_counter() - start, 2),
+            "succeeded": sum(1 for code, _ in outcomes if code == 200),
+            "failed": sum(1 for code, _ in outcomes if code != 200),
+            "overloaded_responses": client.failures,
+            "attempts": {n: sum(1 for s in statuses if s["attempts"] == n) for n in sorted({s["attempts"] for s in statuses})},
+            "duplicate_submit_reused_job": duplicate["job_id"] == ids[0],
+        }))
+
+        # 2. Restart: stop while jobs are running, start again on the same file
+        client.rate = 0.0
+        client.client = FakeAnthropic(lambda kwargs, text: 2.0, fake_reply)
+        ids = [
+            (await http.post("/clinical/fill/jobs", json={"session_id": f"s{i}", "mode": "parallel", "incremental": False})).json()["job_id"]
+            for i in range(args.jobs)
+        ]
+        await asyncio.sleep(0.5)
+        await job_queue.stop(drain_s=0)
+        left = [(await http.get(f"/jobs/{job_id}")).json()["status"] for job_id in ids]
+        start = time.perf_counter()
+        await job_queue.start(clients)
+        outcomes = await asyncio.gather(*(wait_result(http, job_id) for job_id in ids))
+        print(json.dumps({
+            "phase": "restart",
+            "queued_at_restart": left.count("queued"),
+            "succeeded_after_restart": sum(1 for code, _ in outcomes if code == 200),
+            "resume_to_done_s": round(time.perf_counter() - start, 2),
+        }))
+        print(json.dumps({"stats": (await http.get("/jobs/stats")).json()}))
+
+    await job_queue.stop()
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,316 @@
+"""Offline load test: the real backend (uvicorn, lifespan, real clients)
+against bench.standins instead of Anthropic, Supabase, Storage and SMTP.
+
+Each endpoint is driven at increasing concurrency (--requests requests per
+level, each on different data so there are no cache or single-flight hits)
+and reported per level: throughput (req/s), p50/p95/p99 latency, time to
+first byte on the streams, errors and the backend process's peak RSS
+(/proc, Linux). Peak RSS is reset before each level, so it starts from what
+the previous endpoints kept.
+
+The output is JSON with the git commit, to save and compare:
+
+    python -m bench.load --out bench-base.json
+    ... changes ...
+    python -m bench.load --compare bench-base.json
+
+Usage: python -m bench.load [--endpoints ocr fill summary email] [--concurrency 1 4 16 32]
+     [--requests 32] [--ttft-ms 300] [--tokens-per-s 400] [--db-ms 5] [--out FILE] [--compare FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+import httpx
+
+from bench.standins import HOST
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass(frozen=True)
+class Target:
+    path: str
+    body: Callable[[int, int], dict]
+    ok: Callable[[dict | list], bool]
+    stream: bool = False
+
+
+def _ocr_ok(body: dict) -> bool:
+    return not any(r["error"] for r in body["results"])
+
+
+def _done(lines: list[dict]) -> dict:
+    return lines[-1] if lines and lines[-1].get("type") == "done" else {}
+
+
+def _pages(i: int, pages: int) -> list[str]:
+    return [f"u{i}-{k}" for k in range(pages)]
+
+
+TARGETS = {
+    "ocr": Target("/ocr/extract", lambda i, pages: {"session_id": f"s{i}", "upload_ids": _pages(i, pages)}, _ocr_ok),
+    "ocr_stream": Target(
+        "/ocr/extract/stream",
+        lambda i, pages: {"session_id": f"s{i}", "upload_ids": _pages(i, pages), "stream_tokens": True},
+        lambda lines: _done(lines).get("failed") == 0,
+        stream=True,
+    ),
+    "fill": Target("/clinical/fill", lambda i, pages: {"session_id": f"s{i}", "incremental": False}, lambda body: bool(body)),
+    "fill_stream": Target(
+        "/clinical/fill/stream",
+        lambda i, pages: {"session_id": f"s{i}", "incremental": False},
+        lambda lines: _done(lines).get("complete") is True,
+        stream=True,
+    ),
+    "summary": Target("/summary/sessions", lambda i, pages: {"patient_id": f"p{i}", "refresh": True}, lambda body: bool(body.get("summary"))),
+    "email": Target(
+        "/email/clinical-history",
+        lambda i, pages: {"session_id": f"s{i}", "patient_email": f"paciente{i}@example.com", "patient_name": "Ana María Pérez"},
+        lambda body: True,
+    ),
+}
+
+
+def git_commit() -> dict:
+    def git(*args) -> str:
+        return subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "--short", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--", "."))}
+
+
+def rss_mb(pid: int) -> dict:
+    """Current and peak resident set size of `pid`, from /proc (None elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {"rss_mb": None, "peak_rss_mb": None}
+    kb = lambda name: int(fields[name].split()[0]) if name in fields else None
+    mb = lambda v: round(v / 1024, 1) if v is not None else None
+    return {"rss_mb": mb(kb("VmRSS")), "peak_rss_mb": mb(kb("VmHWM"))}
+
+
+def reset_peak_rss(pid: int):
+    # "5" resets VmHWM to the current RSS (Linux >= 4.0)
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def percentile(sorted_ms: list[float], q: float) -> float | None:
+    if not sorted_ms:
+        return None
+    # Nearest rank
+    index = max(0, min(len(sorted_ms) - 1, round(q / 100 * len(sorted_ms) + 0.5) - 1))
+    return round(sorted_ms[index], 1)
+
+
+async def call(http: httpx.AsyncClient, target: Target, i: int, pages: int) -> tuple[bool, float, float | None]:
+    """(ok, latency_ms, first_byte_ms) of one request."""
+    start = time.perf_counter()
+    body = target.body(i, pages)
+    try:
+        if not target.stream:
+            res = await http.post(target.path, json=body)
+            elapsed = (time.perf_counter() - start) * 1000
+            return res.status_code == 200 and target.ok(res.json()), elapsed, None
+        first, lines = None, []
+        async with http.stream("POST", target.path, json=body) as res:
+            async for line in res.aiter_lines():
+                if first is None:
+                    first = (time.perf_counter() - start) * 1000
+                if line:
+                    lines.append(json.loads(line))
+        elapsed = (time.perf_counter() - start) * 1000
+        return res.status_code == 200 and target.ok(lines), elapsed, first
+    except (httpx.HTTPError, ValueError, KeyError):
+        return False, (time.perf_counter() - start) * 1000, None
+
+
+async def run_level(http: httpx.AsyncClient, target: Target, concurrency: int, indices: list[int], pages: int, pid: int) -> dict:
+    """Closed loop: `concurrency` workers send the requests back to back."""
+    pending = iter(indices)
+    results = []
+
+    async def worker():
+        for i in pending:
+            results.append(await call(http, target, i, pages))
+
+    reset_peak_rss(pid)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(ms for ok, ms, _ in results if ok)
+    first_bytes = sorted(ms for ok, _, ms in results if ok and ms is not None)
+    row = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(1 for ok, _, _ in results if not ok),
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "mean_ms": round(statistics.fmean(latencies), 1) if latencies else None,
+        **{f"p{q}_ms": percentile(latencies, q) for q in (50, 95, 99)},
+        "max_ms": round(latencies[-1], 1) if latencies else None,
+    }
+    if target.stream:
+        row["ttfb_p50_ms"] = percentile(first_bytes, 50)
+        row["ttfb_p95_ms"] = percentile(first_bytes, 95)
+    return {**row, **rss_mb(pid)}
+
+
+def start(args: list[str], env: dict | None = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=BACKEND_DIR, env=env)
+
+
+async def wait_ready(url: str, proc: subprocess.Popen, timeout_s: float = 60):
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {proc.returncode}")
+            try:
+                if (await http.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not answer within {timeout_s}s")
+
+
+def backend_env(args, jobs_db: str) -> dict:
+    standins = f"http://{HOST}:{args.standins_port}"
+    return {
+        **os.environ,
+        "ANTHROPIC_API_KEY": "bench",
+        "ANTHROPIC_BASE_URL": standins,
+        "SUPABASE_URL": standins,
+        # Any JWT-shaped string passes supabase-py's check
+        "SUPABASE_SERVICE_ROLE_KEY": "bench.bench.bench",
+        "SMTP_HOST": HOST,
+        "SMTP_PORT": str(args.smtp_port),
+        "SMTP_USER": "bench",
+        "SMTP_PASSWORD": "bench",
+        "SMTP_START_TLS": "0",
+        "SMTP_FROM": "consultorio@example.com",
+        "OCR_CACHE_SUPABASE": "0",
+        "SUMMARY_CACHE_SUPABASE": "0",
+        "JOBS_DB": jobs_db,
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    }
+
+
+def compare(report: dict, base: dict):
+    """Print throughput and p95 changes against a previous report."""
+    rows = {(r["endpoint"], r["concurrency"]): r for r in base["results"]}
+    print(f"\nvs {base['git']['commit']} ({base['date']})", file=sys.stderr)
+    print(f"{'endpoint':<12} {'conc':>4} {'req/s':>16} {'p95 ms':>20} {'peak MB':>16}", file=sys.stderr)
+
+    def delta(old, new) -> str:
+        if old is None or new is None:
+            return f"{new}"
+        change = f"{(new - old) / old * 100:+.0f}%" if old else ""
+        return f"{old:g}->{new:g} {change}"
+
+    for row in report["results"]:
+        old = rows.get((row["endpoint"], row["concurrency"]))
+        if old is None:
+            continue
+        print(
+            f"{row['endpoint']:<12} {row['concurrency']:>4} {delta(old['throughput_rps'], row['throughput_rps']):>16} "
+            f"{delta(old['p95_ms'], row['p95_ms']):>20} {delta(old['peak_rss_mb'], row['peak_rss_mb']):>16}",
+            file=sys.stderr,
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoints", nargs="+", choices=list(TARGETS), default=["ocr", "fill", "fill_stream", "summary", "email"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="requests per endpoint before measuring")
+    parser.add_argument("--pages", type=int, default=2, help="pages per OCR request")
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-s", type=float, default=400)
+    parser.add_argument("--db-ms", type=float, default=5)
+    parser.add_argument("--smtp-handshake-ms", type=float, default=50)
+    parser.add_argument("--port", type=int, default=8200, help="backend port")
+    parser.add_argument("--standins-port", type=int, default=8100)
+    parser.add_argument("--smtp-port", type=int, default=8125)
+    parser.add_argument("--out", help="save the JSON report to this file")
+    parser.add_argument("--compare", help="previous report to compare with")
+    args = parser.parse_args()
+
+    per_endpoint = args.warmup + args.requests * len(args.concurrency)
+    standins = start([
+        "-m", "bench.standins",
+        "--port", str(args.standins_port), "--smtp-port", str(args.smtp_port),
+        "--fixtures", str(per_endpoint * len(args.endpoints)), "--pages", str(args.pages),
+        "--ttft-ms", str(args.ttft_ms), "--tokens-per-s", str(args.tokens_per_s),
+        "--db-ms", str(args.db_ms), "--smtp-handshake-ms", str(args.smtp_handshake_ms),
+    ])
+    backend = None
+    try:
+        await wait_ready(f"http://{HOST}:{args.standins_port}/health", standins)
+        jobs_db = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+        started = time.perf_counter()
+        backend = start(
+            ["-m", "uvicorn", "main:app", "--host", HOST, "--port", str(args.port), "--log-level", "warning"],
+            backend_env(args, jobs_db),
+        )
+        base_url = f"http://{HOST}:{args.port}"
+        await wait_ready(f"{base_url}/health", backend)
+        report = {
+            "git": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "settings": {k: getattr(args, k) for k in ("requests", "warmup", "pages", "ttft_ms", "tokens_per_s", "db_ms", "smtp_handshake_ms")},
+            "startup_s": round(time.perf_counter() - started, 2),
+            "idle": rss_mb(backend.pid),
+            "results": [],
+        }
+
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as http:
+            for n, name in enumerate(args.endpoints):
+                target = TARGETS[name]
+                indices = iter(range(n * per_endpoint, (n + 1) * per_endpoint))
+                warmup = [next(indices) for _ in range(args.warmup)]
+                for i in warmup:
+                    await call(http, target, i, args.pages)
+                for concurrency in args.concurrency:
+                    batch = [next(indices) for _ in range(args.requests)]
+                    row = await run_level(http, target, concurrency, batch, args.pages, backend.pid)
+                    report["results"].append({"endpoint": name, **row})
+                    print(json.dumps(report["results"][-1]), file=sys.stderr)
+            report["standins"] = (await http.get(f"http://{HOST}:{args.standins_port}/stats")).json()
+    finally:
+        for proc in (backend, standins):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
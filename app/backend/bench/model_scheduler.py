@@ -0,0 +1,180 @@
+"""A large OCR batch and summaries at once against an API with a requests-per-minute limit.
+
+The simulated model answers 429 with retry-after when its bucket of --rpm
+requests per minute runs out (like the real API). It compares:
+- uncoordinated: each call retries on its own twice honouring the
+  retry-after (what the SDK did), with no global limit or priorities.
+- scheduler_no_rpm: core.model_scheduler without MODEL_RPM (the default
+  setting): it only reacts to the 429s, pausing everything for the
+  retry-after and lowering the concurrency, with the (interactive) summaries
+  ahead of the (bulk) OCR.
+- scheduler: also with MODEL_RPM=--rpm, so it never triggers a 429.
+
+It measures how long the summaries arriving in the middle of the OCR take and
+how many fail, how long the OCR takes, how many pages fail and how many 429s
+there were.
+
+Usage: python -m bench.model_scheduler [--rpm 60] [--pages 70] [--summaries 4]
+"""
+import argparse
+import asyncio
+import json
+import math
+import statistics
+import time
+
+import anthropic
+import httpx
+
+from bench.fakes import FakeAnthropic, FakeSupabase
+from bench.ocr_batch import page_image
+from bench.summary_fetch import summary_context, synthetic_history
+from bench.summary_history import fake_reply as summary_reply
+from core.clients import get_anthropic, get_http, get_supabase
+from core.model_scheduler import TokenBucket, model_scheduler
+from endpoints import ocr as ocr_endpoint
+from main import app
+
+MODEL_LATENCY_S = 1.0
+OCR_TEXT = "Paciente refiere ansiedad en el trabajo y dificultades para dormir. " * 5
+
+
+class RateLimited:
+    """Fake API with a per-minute request bucket: 429 + retry-after when it's empty."""
+
+    def __init__(self, client, rpm: int):
+        self.client = client
+        self.messages = self
+        self.bucket = TokenBucket(rpm)
+        self.rejected = 0
+
+    async def create(self, **kwargs):
+        wait = self.bucket.wait(1)
+        if wait > 0:
+            self.rejected += 1
+            response = httpx.Response(
+                429, headers={"retry-after": str(math.ceil(wait))},
+                request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"),
+            )
+            raise anthropic.RateLimitError("rate_limit_error", response=response, body=None)
+        self.bucket.take(1)
+        return await self.client.messages.create(**kwargs)
+
+
+class SDKRetries:
+    """What each call did before: up to 2 retries of its own on 429, after retry-after."""
+
+    def __init__(self, client):
+        self.client = client
+        self.messages = self
+
+    async def create(self, **kwargs):
+        for attempt in range(3):
+            try:
+                return await self.client.messages.create(**kwargs)
+            except anthropic.RateLimitError as e:
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(float(e.response.headers["retry-after"]))
+
+
+def reply(kwargs: dict) -> str:
+    content = kwargs["messages"][0]["content"]
+    if isinstance(content, list):
+        return OCR_TEXT
+    return summary_reply(kwargs)
+
+
+def tables(run: str, pages: int, summaries: int) -> dict:
+    history = synthetic_history(8)
+    sessions = [{**row, "id": f"{row['id']}-{k}", "patient_id": f"p{k}"} for k in range(summaries) for row in history["clinical_sessions"]]
+    patients = [{**history["patients"][0], "id": f"p{k}"} for k in range(summaries)]
+    uploads = [{"id": f"{run}-u{i}", "session_id": f"{run}-s{i % 2}", "file_url": f"http://img/{run}-u{i}"} for i in range(pages)]
+    return {"clinical_sessions": sessions, "patients": patients, "session_uploads": uploads}
+
+
+def configure(rpm: int | None, max_concurrency: int, max_retries: int):
+    model_scheduler.requests = TokenBucket(rpm) if rpm else None
+    model_scheduler.max_concurrency = max_concurrency
+    model_scheduler.limit = float(max_concurrency)
+    model_scheduler.max_retries = max_retries
+    model_scheduler.paused_until = 0.0
+    model_scheduler.counts = dict.fromkeys(model_scheduler.counts, 0)
+
+
+async def run(mode: str, args, image: bytes) -> dict:
+    limited = RateLimited(FakeAnthropic(MODEL_LATENCY_S, reply), args.rpm)
+    if mode == "scheduler":
+        configure(args.rpm, 16, 3)
+        client = limited
+    elif mode == "scheduler_no_rpm":
+        configure(None, 16, 3)
+        client = limited
+    else:
+        configure(None, 10_000, 0)
+        client = SDKRetries(limited)
+    sb = FakeSupabase(tables(mode, args.pages, args.summaries), 0.005, {"summary_context": summary_context})
+
+    def serve(request: httpx.Request) -> httpx.Response:
+        # Bytes after the JPEG end marker change the hash, not the image
+        return httpx.Response(200, content=image + request.url.path.encode(), headers={"content-type": "image/jpeg"})
+
+    image_http = httpx.AsyncClient(transport=httpx.MockTransport(serve))
+    app.dependency_overrides.update({get_supabase: lambda: sb, get_anthropic: lambda: client, get_http: lambda: image_http})
+    # An unhandled model error becomes a 500, as under uvicorn
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as http:
+        async def ocr(session: str, ids: list[str]) -> tuple[float, list[dict]]:
+            start = time.perf_counter()
+            res = await http.post("/ocr/extract", json={"session_id": session, "upload_ids": ids})
+            return time.perf_counter() - start, res.json()["results"]
+
+        async def summary(k: int) -> tuple[float, int]:
+            await asyncio.sleep(args.summary_delay_s)
+            start = time.perf_counter()
+            res = await http.post("/summary/sessions", json={"patient_id": f"p{k}", "refresh": True})
+            return time.perf_counter() - start, res.status_code
+
+        ids = [u["id"] for u in sb.tables["session_uploads"]]
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            ocr(f"{mode}-s0", ids[0::2]), ocr(f"{mode}-s1", ids[1::2]),
+            *(summary(k) for k in range(args.summaries)),
+        )
+        elapsed = time.perf_counter() - start
+    app.dependency_overrides.clear()
+    await image_http.aclose()
+
+    ocr_results, summaries = results[:2], results[2:]
+    ok = [s for s, status in summaries if status == 200]
+    return {
+        "mode": mode,
+        "total_s": round(elapsed, 2),
+        "ocr_s": round(max(s for s, _ in ocr_results), 2),
+        "ocr_pages_failed": sum(1 for _, pages in ocr_results for r in pages if r["error"]),
+        "summaries_ok": len(ok),
+        "summaries_failed": len(summaries) - len(ok),
+        "summary_p50_s": round(statistics.median(ok), 2) if ok else None,
+        "summary_max_s": round(max(ok), 2) if ok else None,
+        "api_429": limited.rejected,
+        "scheduler": model_scheduler.stats() if mode != "uncoordinated" else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--pages", type=int, default=70)
+    parser.add_argument("--summaries", type=int, default=4)
+    parser.add_argument("--summary-delay-s", type=float, default=2.0, help="the summaries arrive with the OCR under way")
+    parser.add_argument("--ocr-concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    ocr_endpoint.OCR_CONCURRENCY = args.ocr_concurrency
+    image = page_image(0)
+    for mode in ("uncoordinated", "scheduler_no_rpm", "scheduler"):
+        print(json.dumps(await run(mode, args, image)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
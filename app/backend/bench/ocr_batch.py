@@ -0,0 +1,124 @@
+"""Compares /ocr/extract page by page vs in batches (batched=true).
+
+Without --live it uses a simulated model whose latency is TTFT + output tokens / speed,
+so it reflects the cost of generating the text of several pages in one response.
+
+Usage:
+  python -m bench.ocr_batch [--pages 4 6 8 10]
+  python -m bench.ocr_batch --live --pages 4        # real API (ANTHROPIC_API_KEY)
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import re
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+from bench.fakes import FakeAnthropic, FakeSupabase
+from core.clients import get_anthropic, get_http, get_supabase
+from main import app
+
+PAGE_TEXT = "Paciente refiere ansiedad en el trabajo y dificultades para dormir. " * 20
+TTFT_S = 0.8
+TOKENS_PER_S = 80
+
+
+def page_image(seed: int) -> bytes:
+    img = Image.new("RGB", (1568, 1176), (240, 236, 226))
+    draw = ImageDraw.Draw(img)
+    for y in range(80, 1100, 60):
+        draw.line([(60, y + seed % 7), (1500, y)], fill=(20 + seed % 50, 20, 60), width=4)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def fake_reply(kwargs: dict) -> str:
+    content = kwargs["messages"][0]["content"]
+    images = sum(1 for block in content if block["type"] == "image")
+    if images == 1:
+        return PAGE_TEXT
+    return "\n".join(f"=== PÁGINA {n} ===\n{PAGE_TEXT}" for n in range(1, images + 1))
+
+
+def fake_latency(kwargs: dict, text: str) -> float:
+    return TTFT_S + (len(text) / 4) / TOKENS_PER_S
+
+
+class CountingClient:
+    """Wraps an Anthropic client to add up token usage across calls."""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = self.input_tokens = self.output_tokens = 0
+        self.messages = self
+
+    async def create(self, **kwargs):
+        message = await self.client.messages.create(**kwargs)
+        self.calls += 1
+        self.input_tokens += message.usage.input_tokens
+        self.output_tokens += message.usage.output_tokens
+        return message
+
+
+async def run(pages: int, batched: bool, live: bool, run_id: int) -> dict:
+    images = {f"p{run_id}-{i}": page_image(run_id * 100 + i) for i in range(pages)}
+    sb = FakeSupabase({"session_uploads": [
+        {"id": upload_id, "session_id": "s", "file_url": f"http://img/{upload_id}"} for upload_id in images
+    ]})
+
+    def serve(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=images[request.url.path.strip("/")], headers={"content-type": "image/jpeg"})
+
+    if live:
+        import anthropic
+        inner = anthropic.AsyncAnthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+    else:
+        inner = FakeAnthropic(fake_latency, fake_reply)
+    client = CountingClient(inner)
+
+    image_http = httpx.AsyncClient(transport=httpx.MockTransport(serve))
+    app.dependency_overrides.update({
+        get_supabase: lambda: sb,
+        get_anthropic: lambda: client,
+        get_http: lambda: image_http,
+    })
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as http:
+        start = time.perf_counter()
+        resp = await http.post("/ocr/extract", json={"session_id": "s", "upload_ids": list(images), "batched": batched})
+        elapsed = time.perf_counter() - start
+    app.dependency_overrides.clear()
+
+    results = resp.json()["results"]
+    return {
+        "pages": pages,
+        "mode": "batched" if batched else "per_page",
+        "wall_s": round(elapsed, 2),
+        "calls": client.calls,
+        "input_tokens": client.input_tokens,
+        "output_tokens": client.output_tokens,
+        "failed": sum(1 for r in results if r["error"]),
+        "empty": sum(1 for r in results if not re.sub(r"\s", "", r["ocr_text"])),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[4, 6, 8, 10])
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    run_id = int(time.time())
+    for pages in args.pages:
+        for batched in (False, True):
+            run_id += 1
+            print(json.dumps(await run(pages, batched, args.live, run_id)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
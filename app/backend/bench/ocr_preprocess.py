@@ -0,0 +1,108 @@
+"""Compares sending the raw vs the preprocessed image to Claude Vision.
+
+Usage:
+  python -m bench.ocr_preprocess                  # synthetic 4032x3024 image
+  python -m bench.ocr_preprocess --image photo.jpg
+  python -m bench.ocr_preprocess --image photo.jpg --live   # calls the real API (ANTHROPIC_API_KEY)
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import time
+
+from PIL import Image, ImageDraw
+
+from core.image_prep import image_tokens, preprocess_image
+
+
+def synthetic_photo(width: int = 4032, height: int = 3024) -> bytes:
+    """A noisy 'phone photo' of a handwritten page."""
+    img = Image.new("RGB", (width, height), (236, 232, 220))
+    draw = ImageDraw.Draw(img)
+    rnd = random.Random(0)
+    for y in range(200, height - 200, 90):
+        x = 250
+        while x < width - 400:
+            w = rnd.randint(60, 260)
+            draw.line([(x, y + rnd.randint(-6, 6)), (x + w, y + rnd.randint(-6, 6))], fill=(30, 30, 60), width=5)
+            x += w + rnd.randint(30, 70)
+    noise = Image.effect_noise((width, height), 24).convert("RGB")
+    img = Image.blend(img, noise, 0.12)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def measure(data: bytes, content_type: str) -> dict:
+    start = time.perf_counter()
+    processed, media_type = preprocess_image(data, content_type)
+    elapsed = time.perf_counter() - start
+
+    def describe(blob: bytes) -> dict:
+        w, h = Image.open(io.BytesIO(blob)).size
+        return {
+            "bytes": len(blob),
+            "base64_bytes": len(base64.standard_b64encode(blob)),
+            "size": [w, h],
+            "estimated_input_tokens": image_tokens(blob),
+        }
+
+    return {
+        "raw": describe(data),
+        "preprocessed": {**describe(processed), "media_type": media_type},
+        "preprocess_ms": round(elapsed * 1000, 1),
+    }
+
+
+async def live(data: bytes, content_type: str) -> dict:
+    import anthropic
+    from endpoints.ocr import OCR_MODEL, OCR_PROMPT
+
+    client = anthropic.AsyncAnthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+    processed, media_type = preprocess_image(data, content_type)
+    results = {}
+    for name, blob, mt in (("raw", data, content_type), ("preprocessed", processed, media_type)):
+        start = time.perf_counter()
+        message = await client.messages.create(
+            model=OCR_MODEL,
+            max_tokens=4096,
+            messages=[{"role": "user", "content": [
+                {"type": "image", "source": {"type": "base64", "media_type": mt, "data": base64.standard_b64encode(blob).decode()}},
+                {"type": "text", "text": OCR_PROMPT},
+            ]}],
+        )
+        results[name] = {
+            "latency_s": round(time.perf_counter() - start, 2),
+            "input_tokens": message.usage.input_tokens,
+            "output_tokens": message.usage.output_tokens,
+            "text_chars": len(message.content[0].text),
+        }
+    await client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image")
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+        content_type = "image/png" if args.image.lower().endswith(".png") else "image/jpeg"
+    else:
+        data, content_type = synthetic_photo(), "image/jpeg"
+
+    report = measure(data, content_type)
+    if args.live:
+        report["live"] = asyncio.run(live(data, content_type))
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Fires N identical simultaneous calls (double clicks, frontend retries) and
+counts how many model generations are actually paid for.
+
+Usage: python -m bench.single_flight [N] [llm_latency_s]
+"""
+import asyncio
+import json
+import sys
+
+import httpx
+
+from bench.clinical_parallel import fake_reply
+from bench.fakes import FakeAnthropic, FakeSupabase
+from core.clients import get_anthropic, get_supabase
+from main import app
+
+
+async def burst(http: httpx.AsyncClient, n: int, url: str, body: dict) -> list[str]:
+    responses = await asyncio.gather(*(http.post(url, json=body) for _ in range(n)))
+    return [r.text for r in responses]
+
+
+async def run(n: int, latency: float) -> dict:
+    sb = FakeSupabase({
+        "patients": [{"id": "p", "full_name": "Paciente Prueba", "age": 30}],
+        "clinical_sessions": [
+            {"id": "s", "patient_id": "p", "status": "completed", "session_date": "2026-10-01",
+             "objetivos": ["dormir mejor"], "plan": {"plan_semana": "registro", "tarea": "diario"}, "fill_sources": {}},
+        ],
+        "session_uploads": [
+            {"id": "u", "session_id": "s", "file_name": "nota.jpg", "ocr_text": "texto", "is_processed": True},
+        ],
+    })
+    client = FakeAnthropic(latency, fake_reply)
+    app.dependency_overrides.update({get_supabase: lambda: sb, get_anthropic: lambda: client})
+
+    report = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as http:
+        for url, body in (
+            ("/clinical/fill", {"session_id": "s", "incremental": False}),
+            ("/clinical/fill/stream", {"session_id": "s", "incremental": False}),
+            ("/summary/sessions", {"patient_id": "p"}),
+        ):
+            before = client.messages.calls
+            texts = await burst(http, n, url, body)
+            report[url] = {
+                "requests": n,
+                "model_calls": client.messages.calls - before,
+                "identical_responses": len(set(texts)) == 1,
+            }
+        report["single_flight"] = (await http.get("/usage")).json()["single_flight"]
+    app.dependency_overrides.clear()
+    return report
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    print(json.dumps(asyncio.run(run(n, latency)), indent=2))
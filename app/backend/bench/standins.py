@@ -0,0 +1,286 @@
+"""Local servers standing in for Anthropic, Supabase and SMTP for bench.load.
+
+A single HTTP process serves:
+- GET /v1/models: the model list (the backend asks for it when warming up connections).
+- POST /v1/messages: a simulated Messages API (JSON, or SSE with stream=true). It
+  takes --ttft-ms to the first token and generates at --tokens-per-s; the answer
+  depends on the call (clinical history tool, OCR pages, summary or roll-up).
+- /rest/v1/{table} and /rest/v1/rpc/{function}: the subset of PostgREST the
+  backend uses (select, eq/neq/gt/gte/lt/lte/in/is filters, order, limit,
+  single object, upsert, update) over in-memory tables, with --db-ms of latency.
+- GET /images/{name}: JPEG photos of pages; each name gives different bytes so
+  the OCR cache doesn't hit across requests.
+
+It also starts an aiosmtpd SMTP server (pip install aiosmtpd) on --smtp-port.
+
+The data: for each i < --fixtures there is a patient p{i} with --history past
+sessions, the session s{i} and its pages u{i}-{k}.
+
+Usage: python -m bench.standins [--port 8100] [--smtp-port 8125] [--fixtures 200]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import zlib
+
+import uvicorn
+from aiosmtpd.controller import Controller
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from bench import clinical_parallel, ocr_batch, summary_history
+from bench.email_batch import Sink
+from bench.email_render import PATIENT, synthetic_session
+from bench.fakes import FakeQuery, FakeSupabase, estimate_input_tokens
+from bench.summary_fetch import summary_context, synthetic_history
+
+HOST = "127.0.0.1"
+# Characters per SSE delta (~16 tokens)
+CHUNK_CHARS = 64
+BASE_PAGES = 4
+
+
+def fixtures(n: int, pages: int, history: int, base_url: str) -> dict:
+    patients, sessions, uploads = [], [], []
+    past = synthetic_history(history)["clinical_sessions"]
+    for i in range(n):
+        patients.append({**PATIENT, "id": f"p{i}", "updated_at": "2026-01-01T00:00:00+00:00"})
+        for k, row in enumerate(past):
+            sessions.append({**row, "id": f"h{i}-{k}", "patient_id": f"p{i}"})
+        session = synthetic_session(400, seed=i)
+        session.update(id=f"s{i}", patient_id=f"p{i}", session_number=history + 1, updated_at="2026-10-18T10:00:00+00:00")
+        sessions.append(session)
+        for k in range(pages):
+            uploads.append({
+                "id": f"u{i}-{k}", "session_id": f"s{i}", "file_name": f"pagina{k + 1}.jpg",
+                "file_url": f"{base_url}/images/u{i}-{k}.jpg",
+                "ocr_text": ocr_batch.PAGE_TEXT, "is_processed": True,
+            })
+    return {"patients": patients, "clinical_sessions": sessions, "session_uploads": uploads}
+
+
+def reply(body: dict) -> str:
+    if body.get("tool_choice"):
+        return clinical_parallel.fake_reply(body)
+    content = body["messages"][0]["content"]
+    if isinstance(content, list) and any(block["type"] == "image" for block in content):
+        return ocr_batch.fake_reply(body)
+    return summary_history.fake_reply(body)
+
+
+def sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+class FakeMessagesAPI:
+    def __init__(self, ttft_s: float, tokens_per_s: float):
+        self.ttft_s = ttft_s
+        self.tokens_per_s = tokens_per_s
+        self.calls = 0
+
+    def message(self, body: dict, text: str) -> dict:
+        tool = (body.get("tool_choice") or {}).get("name")
+        block = {"type": "tool_use", "id": "toolu_bench", "name": tool, "input": json.loads(text)} if tool else {"type": "text", "text": text}
+        return {
+            "id": "msg_bench", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [block], "stop_reason": "tool_use" if tool else "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": estimate_input_tokens(body), "output_tokens": len(text) // 4},
+        }
+
+    async def create(self, request: Request) -> Response:
+        body = await request.json()
+        self.calls += 1
+        text = reply(body)
+        if body.get("stream"):
+            return StreamingResponse(self.events(body, text), media_type="text/event-stream")
+        await asyncio.sleep(self.ttft_s + len(text) / 4 / self.tokens_per_s)
+        return JSONResponse(self.message(body, text))
+
+    async def models(self, request: Request) -> Response:
+        return JSONResponse({"data": [{"type": "model", "id": "claude-sonnet-4-6"}], "has_more": False})
+
+    async def events(self, body: dict, text: str):
+        message = self.message(body, text)
+        block = message["content"][0]
+        tool = block["type"] == "tool_use"
+        yield sse("message_start", {"type": "message_start", "message": {
+            **message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 1},
+        }})
+        await asyncio.sleep(self.ttft_s)
+        start = {**block, "input": {}} if tool else {**block, "text": ""}
+        yield sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": start})
+        for i in range(0, len(text), CHUNK_CHARS):
+            chunk = text[i:i + CHUNK_CHARS]
+            await asyncio.sleep(len(chunk) / 4 / self.tokens_per_s)
+            delta = {"type": "input_json_delta", "partial_json": chunk} if tool else {"type": "text_delta", "text": chunk}
+            yield sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta})
+        yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield sse("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": message["usage"]["output_tokens"]},
+        })
+        yield sse("message_stop", {"type": "message_stop"})
+
+
+def _text(value) -> str:
+    """A stored value as it appears in a PostgREST filter."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _filter(op: str, arg: str):
+    if op == "in":
+        values = {v.strip().strip('"') for v in arg.strip("()").split(",")}
+        return lambda value: _text(value) in values
+    # postgrest-py sends python booleans as True/False; Postgres reads both cases
+    if arg in ("True", "False", "NULL", "Null"):
+        arg = arg.lower()
+    if op == "is":
+        return lambda value: _text(value) == arg
+    compare = {
+        "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+        "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+        "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+    }[op]
+    return lambda value: value is not None and compare(_text(value), arg)
+
+
+class FakePostgREST:
+    """HTTP front for bench.fakes.FakeSupabase, speaking what postgrest-py sends."""
+
+    RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+    def __init__(self, tables: dict, latency: float):
+        self.db = FakeSupabase(tables, latency, {"summary_context": summary_context})
+        self.requests = 0
+
+    def query(self, request: Request) -> FakeQuery:
+        query = self.db.table(request.path_params["table"])
+        params = request.query_params
+        query.select(params.get("select", "*"))
+        for key, value in params.multi_items():
+            if key in self.RESERVED:
+                continue
+            op, _, arg = value.partition(".")
+            match = _filter(op, arg)
+            query.filters.append(lambda row, key=key, match=match: match(row.get(key)))
+        if "order" in params:
+            key, _, direction = params["order"].split(",")[0].partition(".")
+            query.order(key, desc=direction.startswith("desc"))
+        if "limit" in params:
+            query.limit(int(params["limit"]))
+        return query
+
+    async def table(self, request: Request) -> Response:
+        self.requests += 1
+        query = self.query(request)
+        if request.method == "POST":
+            prefer = request.headers.get("prefer", "")
+            payload = await request.json()
+            if "merge-duplicates" in prefer:
+                query.upsert(payload)
+            else:
+                rows = self.db.tables.setdefault(query.table, [])
+                rows.extend(payload if isinstance(payload, list) else [payload])
+                await asyncio.sleep(self.db.latency)
+                return JSONResponse(payload if isinstance(payload, list) else [payload], status_code=201)
+        elif request.method == "PATCH":
+            query.update(await request.json())
+        result = (await query.execute()).data
+        if request.method != "GET":
+            return JSONResponse(result if isinstance(result, list) else [result], status_code=201 if request.method == "POST" else 200)
+        if "vnd.pgrst.object" in request.headers.get("accept", ""):
+            if len(result) != 1:
+                return JSONResponse({
+                    "code": "PGRST116", "details": f"The result contains {len(result)} rows", "hint": None,
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                }, status_code=406)
+            return JSONResponse(result[0])
+        return JSONResponse(result)
+
+    async def rpc(self, request: Request) -> Response:
+        self.requests += 1
+        params = await request.json() if await request.body() else {}
+        rpc = self.db.rpc(request.path_params["name"], params)
+        try:
+            return JSONResponse((await rpc.execute()).data)
+        except Exception as e:
+            return JSONResponse(e.args[0] if e.args and isinstance(e.args[0], dict) else {"message": str(e)}, status_code=404)
+
+
+class ImageServer:
+    def __init__(self):
+        self.pages = [ocr_batch.page_image(seed) for seed in range(BASE_PAGES)]
+        self.served = 0
+
+    async def image(self, request: Request) -> Response:
+        self.served += 1
+        name = request.path_params["name"]
+        # Bytes after the JPEG end marker are ignored by decoders but change the hash
+        data = self.pages[zlib.crc32(name.encode()) % BASE_PAGES] + name.encode()
+        return Response(data, media_type="image/jpeg")
+
+
+def build_app(args) -> Starlette:
+    base_url = f"http://{HOST}:{args.port}"
+    messages = FakeMessagesAPI(args.ttft_ms / 1000, args.tokens_per_s)
+    postgrest = FakePostgREST(fixtures(args.fixtures, args.pages, args.history, base_url), args.db_ms / 1000)
+    images = ImageServer()
+
+    async def health(request: Request) -> Response:
+        return JSONResponse({"status": "ok"})
+
+    async def stats(request: Request) -> Response:
+        return JSONResponse({"model_calls": messages.calls, "db_requests": postgrest.requests, "images_served": images.served})
+
+    return Starlette(routes=[
+        Route("/health", health),
+        Route("/stats", stats),
+        Route("/v1/messages", messages.create, methods=["POST"]),
+        Route("/v1/models", messages.models),
+        Route("/rest/v1/rpc/{name}", postgrest.rpc, methods=["POST"]),
+        Route("/rest/v1/{table}", postgrest.table, methods=["GET", "POST", "PATCH"]),
+        Route("/images/{name}", images.image),
+    ])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--smtp-port", type=int, default=8125)
+    parser.add_argument("--fixtures", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=2, help="pages per session")
+    parser.add_argument("--history", type=int, default=12, help="past sessions per patient")
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-s", type=float, default=400)
+    parser.add_argument("--db-ms", type=float, default=5)
+    parser.add_argument("--smtp-handshake-ms", type=float, default=50)
+    return parser.parse_args(argv)
+
+
+async def main():
+    args = parse_args()
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    app = build_app(args)
+    sink = Sink(args.smtp_handshake_ms / 1000)
+    controller = Controller(
+        sink, hostname=HOST, port=args.smtp_port,
+        authenticator=sink.authenticate, auth_require_tls=False,
+    )
+    controller.start()
+    server = uvicorn.Server(uvicorn.Config(app, host=HOST, port=args.port, log_level="warning", access_log=False))
+    try:
+        await server.serve()
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
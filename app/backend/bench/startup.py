@@ -0,0 +1,178 @@
+"""Backend cold start: what the first request of the morning pays for.
+
+With the bench.standins servers (local Anthropic, PostgREST, images and SMTP,
+with --ttft-ms 0 so the model doesn't hide the startup) it measures, in fresh
+processes:
+- import: time of `import main` and which SDKs end up loaded; fails if any of
+  DEFERRED is loaded at startup (they are imported with their client or on use).
+- first request: from launching uvicorn to the first 200 from /health, and the
+  latency of the first real request to each endpoint right after (and of the
+  second, already warm), with each STARTUP_WARMUP (off, clients, connections).
+  With --pause-ms the first request arrives a while after the first 200, as
+  when the instance started ahead of the traffic (minimum instances, scaling,
+  startup probes) and the warm-up has already finished.
+
+With --no-bytecode the app code runs from a copy without __pycache__ and
+without writing it, as in an image without compileall (on Cloud Run every
+cold start begins with the image's file system).
+
+Usage: python -m bench.startup [--runs 3] [--endpoints summary fill ocr email] [--pause-ms 0] [--no-bytecode]
+       python -m bench.startup --import-only    # just the import, no servers
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.load import BACKEND_DIR, HOST, TARGETS, backend_env, call, git_commit, start, wait_ready
+
+SDKS = ("anthropic", "supabase", "postgrest", "httpx", "aiosmtplib", "PIL", "dotenv")
+# Must not be loaded by `import main`
+DEFERRED = ("anthropic", "supabase", "httpx", "aiosmtplib", "PIL")
+WARMUPS = ("off", "clients", "connections")
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+print(json.dumps({{"s": time.perf_counter() - start, "sdks": [m for m in {SDKS!r} if m in sys.modules]}}))
+"""
+
+
+def app_copy() -> str:
+    """The app without bytecode, in a temporary directory."""
+    path = os.path.join(tempfile.mkdtemp(), "backend")
+    shutil.copytree(BACKEND_DIR, path, ignore=shutil.ignore_patterns("__pycache__", "bench", "jobs.sqlite3*"))
+    return path
+
+
+def spawn(args: list[str], env: dict, cwd: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=cwd, env=env)
+
+
+def measure_import(env: dict, cwd: str, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    loaded = [m for m in DEFERRED if m in samples[0]["sdks"]]
+    assert not loaded, f"import main loads {', '.join(loaded)}"
+    return {
+        "import_main_ms": round(statistics.median(s["s"] for s in samples) * 1000),
+        "sdks_loaded": samples[0]["sdks"],
+    }
+
+
+async def first_200(url: str, proc: subprocess.Popen, started: float, timeout_s: float = 60) -> float:
+    """Seconds from `started` (the spawn) until `url` answered 200, polling every 10ms."""
+    async with httpx.AsyncClient() as http:
+        while time.perf_counter() - started < timeout_s:
+            if proc.poll() is not None:
+                raise RuntimeError(f"the backend exited with code {proc.returncode}")
+            try:
+                if (await http.get(url)).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer within {timeout_s}s")
+
+
+async def cold_request(args, env: dict, cwd: str, endpoint: str, i: int) -> dict:
+    base_url = f"http://{HOST}:{args.port}"
+    started = time.perf_counter()
+    backend = spawn(["-m", "uvicorn", "main:app", "--host", HOST, "--port", str(args.port), "--log-level", "warning"], env, cwd)
+    try:
+        health = await first_200(f"{base_url}/health", backend, started)
+        await asyncio.sleep(args.pause_ms / 1000)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as http:
+            ok, first_ms, _ = await call(http, TARGETS[endpoint], i, args.pages)
+            ok2, second_ms, _ = await call(http, TARGETS[endpoint], i + 1, args.pages)
+    finally:
+        backend.terminate()
+        backend.wait()
+    if not (ok and ok2):
+        raise RuntimeError(f"{endpoint} failed on a cold start")
+    return {"health_ms": health * 1000, "first_ms": first_ms, "second_ms": second_ms}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per measurement (the median is reported)")
+    parser.add_argument("--endpoints", nargs="+", choices=list(TARGETS), default=["summary", "fill", "ocr", "email"])
+    parser.add_argument("--warmups", nargs="+", choices=WARMUPS, default=list(WARMUPS))
+    parser.add_argument("--pause-ms", type=float, default=0, help="wait between the first 200 from /health and the first request")
+    parser.add_argument("--no-bytecode", action="store_true", help="the app without compiled .pyc files")
+    parser.add_argument("--import-only", action="store_true", help="measure and check only the import of main")
+    parser.add_argument("--pages", type=int, default=2, help="pages per OCR request")
+    parser.add_argument("--db-ms", type=float, default=5)
+    parser.add_argument("--smtp-handshake-ms", type=float, default=50)
+    parser.add_argument("--port", type=int, default=8200, help="backend port")
+    parser.add_argument("--standins-port", type=int, default=8100)
+    parser.add_argument("--smtp-port", type=int, default=8125)
+    parser.add_argument("--out", help="save the JSON report to this file")
+    args = parser.parse_args()
+
+    cwd = app_copy() if args.no_bytecode else BACKEND_DIR
+    if args.import_only:
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"} if args.no_bytecode else dict(os.environ)
+        try:
+            print(json.dumps(measure_import(env, cwd, max(args.runs, 5))))
+        finally:
+            if args.no_bytecode:
+                shutil.rmtree(os.path.dirname(cwd), ignore_errors=True)
+        return
+    # Two requests per cold start, each on its own fixture so no cache hits
+    fixtures = 2 * args.runs * len(args.endpoints) * len(args.warmups)
+    standins = start([
+        "-m", "bench.standins",
+        "--port", str(args.standins_port), "--smtp-port", str(args.smtp_port),
+        "--fixtures", str(fixtures), "--pages", str(args.pages),
+        "--ttft-ms", "0", "--tokens-per-s", "1000000",
+        "--db-ms", str(args.db_ms), "--smtp-handshake-ms", str(args.smtp_handshake_ms),
+    ])
+    report = {"git": git_commit(), "python": sys.version.split()[0], "bytecode": not args.no_bytecode, "pause_ms": args.pause_ms}
+    try:
+        await wait_ready(f"http://{HOST}:{args.standins_port}/health", standins)
+        env = backend_env(args, os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+        if args.no_bytecode:
+            env["PYTHONDONTWRITEBYTECODE"] = "1"
+        report.update(measure_import(env, cwd, max(args.runs, 5)))
+        print(json.dumps(report), file=sys.stderr)
+
+        report["cold_starts"] = []
+        i = 0
+        for warmup in args.warmups:
+            for endpoint in args.endpoints:
+                samples = []
+                for _ in range(args.runs):
+                    samples.append(await cold_request(args, {**env, "STARTUP_WARMUP": warmup}, cwd, endpoint, i))
+                    i += 2
+                row = {"warmup": warmup, "endpoint": endpoint, **{
+                    key: round(statistics.median(s[key] for s in samples)) for key in samples[0]
+                }}
+                report["cold_starts"].append(row)
+                print(json.dumps(row), file=sys.stderr)
+    finally:
+        standins.terminate()
+        standins.wait()
+        if args.no_bytecode:
+            shutil.rmtree(os.path.dirname(cwd), ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
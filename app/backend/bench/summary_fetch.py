@@ -0,0 +1,182 @@
+"""Bytes and round trips of the /summary/sessions read: the original select("*") vs
+projected selects vs the summary_context RPC (a single round trip, digests
+instead of JSONB sections).
+
+Without --live it uses FakeSupabase with a long synthetic history; latency is
+estimated as round_trips * RTT + bytes / bandwidth. With --live it measures
+against the real Supabase (SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY) for --patient.
+
+Usage:
+  python -m bench.summary_fetch [--sessions 60] [--rtt-ms 40] [--mbps 50]
+  python -m bench.summary_fetch --live --patient <uuid>
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from bench.fakes import FakeSupabase
+from core.clinical_schema import SECTIONS
+from core.history import session_digest
+from endpoints.summary import SUMMARY_MAX_SESSIONS, load_context
+
+FIELD_TEXT = "Texto clínico de ejemplo con detalle de lo conversado en la sesión. " * 4
+
+
+def synthetic_history(n: int, drafts_only: bool = False) -> dict:
+    sessions = []
+    for i in range(n):
+        row = {
+            "id": f"s{i}", "patient_id": "p", "session_number": i + 1,
+            "session_date": f"2025-{1 + i // 28 % 12:02d}-{1 + i % 28:02d}",
+            "status": "draft" if drafts_only or i % 5 == 4 else "completed",
+            "updated_at": f"2026-01-01T00:00:{i % 60:02d}+00:00",
+        }
+        for s in SECTIONS:
+            row[s.key] = [FIELD_TEXT] * 3 if s.is_list else {f.key: FIELD_TEXT for f in s.fields}
+        sessions.append(row)
+    patient = {
+        "id": "p", "full_name": "Paciente Prueba", "preferred_name": None, "age": 34,
+        "email": "p@example.com", "notes": FIELD_TEXT * 5, "updated_at": "2026-01-01T00:00:00+00:00",
+    }
+    return {"patients": [patient], "clinical_sessions": sessions}
+
+
+def row_digest(row: dict) -> str:
+    """What the clinical_sessions_digest trigger stores for a full row."""
+    return session_digest({
+        "motivo": (row.get("motivo_consulta") or {}).get("texto_paciente"),
+        "objetivos": row.get("objetivos"),
+        "plan_semana": (row.get("plan") or {}).get("plan_semana"),
+        "tarea": (row.get("plan") or {}).get("tarea"),
+        "patrones": (row.get("formulacion_clinica") or {}).get("patrones"),
+        "intervenciones": (row.get("intervenciones") or {}).get("otros"),
+    })
+
+
+def summary_context(tables: dict, p_patient_id: str, p_limit: int = 10, p_block: int = 10) -> dict:
+    """Python stand-in for the summary_context SQL function."""
+    rows = [r for r in tables["clinical_sessions"] if r["patient_id"] == p_patient_id]
+    saved = [r for r in rows if r["status"] != "draft"]
+    picked = sorted(saved or rows, key=lambda r: r["session_date"] or "")
+    patient = next((p for p in tables["patients"] if p["id"] == p_patient_id), None)
+    sessions = []
+    for recency, r in zip(range(len(picked), 0, -1), picked):
+        digest = r.get("digest") or row_digest(r)
+        sessions.append({
+            "id": r["id"], "session_number": r["session_number"], "session_date": r["session_date"],
+            "updated_at": r["updated_at"], "digest_hash": hashlib.md5(digest.encode()).hexdigest(),
+            "digest": digest if recency < p_limit + p_block else None,
+        })
+    return {
+        "patient": patient and {k: patient.get(k) for k in ("full_name", "preferred_name", "age", "updated_at")},
+        "sessions": sessions,
+        "rollups": [r for r in tables.get("session_rollups", []) if r["patient_id"] == p_patient_id],
+    }
+
+
+class Metered:
+    """Wraps a (fake) client and adds up round trips and JSON bytes of every response."""
+
+    def __init__(self, sb):
+        self.sb = sb
+        self.round_trips = 0
+        self.bytes = 0
+
+    def _wrap(self, query):
+        execute = query.execute
+
+        async def metered():
+            res = await execute()
+            self.round_trips += 1
+            self.bytes += len(json.dumps(res.data, ensure_ascii=False).encode("utf-8"))
+            return res
+
+        query.execute = metered
+        return query
+
+    def table(self, name):
+        return self._wrap(self.sb.table(name))
+
+    def rpc(self, name, params=None):
+        return self._wrap(self.sb.rpc(name, params))
+
+
+async def select_star(sb, patient_id: str):
+    """The original fetch, for comparison."""
+    patient = (await sb.table("patients").select("*").eq("id", patient_id).single().execute()).data
+    sessions = (await sb.table("clinical_sessions").select("*").eq("patient_id", patient_id)
+                .neq("status", "draft").order("session_date", desc=True).limit(SUMMARY_MAX_SESSIONS).execute()).data
+    if not sessions:
+        sessions = (await sb.table("clinical_sessions").select("*").eq("patient_id", patient_id)
+                    .order("session_date", desc=True).limit(SUMMARY_MAX_SESSIONS).execute()).data
+    return patient, sessions
+
+
+async def offline(args) -> list[dict]:
+    rows = []
+    for drafts_only in (False, True):
+        tables = synthetic_history(args.sessions, drafts_only)
+        variants = (
+            ("select_star", FakeSupabase(tables, 0), select_star),
+            ("projected", FakeSupabase(tables, 0), load_context),
+            ("rpc", FakeSupabase(tables, 0, {"summary_context": summary_context}), load_context),
+        )
+        for name, sb, fetch in variants:
+            metered = Metered(sb)
+            _, sessions, *_ = await fetch(metered, "p")
+            est_ms = metered.round_trips * args.rtt_ms + metered.bytes * 8 / (args.mbps * 1000)
+            rows.append({
+                "history": "drafts_only" if drafts_only else "mixed",
+                "fetch": name,
+                "sessions": len(sessions),
+                "round_trips": metered.round_trips,
+                "bytes": metered.bytes,
+                "estimated_ms": round(est_ms, 1),
+            })
+    return rows
+
+
+async def live(args) -> list[dict]:
+    from supabase import acreate_client
+
+    sb = await acreate_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"])
+    totals = {"bytes": 0, "round_trips": 0}
+
+    async def count(response):
+        await response.aread()
+        totals["bytes"] += len(response.content)
+        totals["round_trips"] += 1
+
+    sb.postgrest.session.event_hooks["response"].append(count)
+    rows = []
+    for name, fetch in (("select_star", select_star), ("rpc_or_projected", load_context)):
+        samples = []
+        for _ in range(args.runs):
+            totals.update(bytes=0, round_trips=0)
+            start = time.perf_counter()
+            await fetch(sb, args.patient)
+            samples.append((time.perf_counter() - start) * 1000)
+        rows.append({"fetch": name, **totals, "median_ms": round(sorted(samples)[len(samples) // 2], 1)})
+    await sb.postgrest.aclose()
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=60)
+    parser.add_argument("--rtt-ms", type=float, default=40)
+    parser.add_argument("--mbps", type=float, default=50)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--patient")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for row in await (live(args) if args.live else offline(args)):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""Prompt size and latency of /summary/sessions as the patient's history grows.
+
+For each size it measures the first summary (which generates the missing
+roll-ups) and the next one after adding a new session (the stored roll-ups
+are reused). The simulated model takes TTFT + input tokens * PREFILL_S +
+output tokens / speed. Fails if the first summary doesn't generate and store
+its roll-ups (a failed roll-up is just left out of the prompt, so it doesn't
+show in the response).
+
+Usage: python -m bench.summary_history [--sessions 10 30 60 120 240]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from bench.fakes import FakeAnthropic, FakeSupabase, estimate_input_tokens
+from bench.summary_fetch import summary_context, synthetic_history
+from core.clients import get_anthropic, get_supabase
+from core.history import ROLLUP_BLOCK, ROLLUP_MODEL, plan_history
+from endpoints.summary import SUMMARY_MAX_SESSIONS
+from main import app
+
+TTFT_S = 0.8
+PREFILL_S = 0.0002
+TOKENS_PER_S = 80
+
+
+def fake_reply(kwargs: dict) -> str:
+    if kwargs["model"] == ROLLUP_MODEL:
+        return "Resumen del bloque: temas, patrones, objetivos y tareas. " * 10
+    return "Resumen de preparación para la próxima sesión. " * 40
+
+
+class Recorder:
+    """Records input tokens of summary calls and counts roll-up calls."""
+
+    def __init__(self, client):
+        self.client = client
+        self.messages = self
+        self.prompt_tokens = 0
+        self.rollup_calls = 0
+
+    async def create(self, **kwargs):
+        if kwargs["model"] == ROLLUP_MODEL:
+            self.rollup_calls += 1
+        else:
+            self.prompt_tokens = estimate_input_tokens(kwargs)
+        return await self.client.messages.create(**kwargs)
+
+
+def fake_latency(kwargs: dict, text: str) -> float:
+    return TTFT_S + estimate_input_tokens(kwargs) * PREFILL_S + (len(text) / 4) / TOKENS_PER_S
+
+
+async def run(n: int) -> dict:
+    tables = synthetic_history(n + 1)
+    new_session = tables["clinical_sessions"].pop()
+    sb = FakeSupabase(tables, 0.01, {"summary_context": summary_context})
+    client = Recorder(FakeAnthropic(fake_latency, fake_reply))
+    app.dependency_overrides.update({get_supabase: lambda: sb, get_anthropic: lambda: client})
+
+    result = {"sessions": n}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as http:
+        for phase in ("first", "after_new_session"):
+            if phase == "after_new_session":
+                tables["clinical_sessions"].append(new_session)
+            client.rollup_calls = 0
+            start = time.perf_counter()
+            resp = await http.post("/summary/sessions", json={"patient_id": "p"})
+            resp.raise_for_status()
+            result[phase] = {
+                "s": round(time.perf_counter() - start, 2),
+                "prompt_tokens": client.prompt_tokens,
+                "rollup_calls": client.rollup_calls,
+            }
+    app.dependency_overrides.clear()
+
+    # The roll-ups the first summary needed: the sessions it saw, without the new one
+    sessions = [s for s in summary_context(tables, "p", SUMMARY_MAX_SESSIONS, ROLLUP_BLOCK)["sessions"] if s["id"] != new_session["id"]]
+    rollups, _ = plan_history(sessions, SUMMARY_MAX_SESSIONS)
+    generated, stored = result["first"]["rollup_calls"], len(tables.get("session_rollups", []))
+    assert generated >= len(rollups), f"{n} sessions: {generated} roll-ups generated, expected at least {len(rollups)}"
+    assert stored >= generated, f"{n} sessions: {generated} roll-ups generated but {stored} stored"
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 30, 60, 120, 240])
+    args = parser.parse_args()
+    for n in args.sessions:
+        print(json.dumps(await run(n)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
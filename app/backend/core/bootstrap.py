@@ -0,0 +1,17 @@
+"""Process setup imported before anything else by main.py and prewarm.py.
+
+The core and endpoint modules read their settings from the environment at
+import time, so .env has to be loaded before they are imported. On Cloud
+Run (K_SERVICE set) the settings come from the service and there is no .env.
+"""
+import os
+import logging
+
+if not os.getenv("K_SERVICE"):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(levelname)s %(name)s %(message)s")
+# One line per outgoing request is too chatty at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import os
+import asyncio
+import logging
+import importlib
+from contextlib import asynccontextmanager, suppress
+from typing import TYPE_CHECKING
+
+from fastapi import FastAPI, HTTPException, Request
+
+from core.jobs import job_queue
+from core.metrics import instrument_postgrest
+from core.smtp_pool import SMTPPool
+
+if TYPE_CHECKING:
+    import anthropic
+    import httpx
+    from supabase import AsyncClient
+
+logger = logging.getLogger("agents.clients")
+
+# Warm-up started by the lifespan once the app is serving: "clients" imports
+# the SDKs and creates the clients, "connections" also opens one connection to
+# each service; "off" leaves it all to the first request that needs each one
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "clients")
+
+
+async def _import(module: str):
+    """Import an SDK off the event loop (anthropic and supabase take ~0.3s each)."""
+    return await asyncio.to_thread(importlib.import_module, module)
+
+
+class Clients:
+    """Clients shared by every endpoint for the lifetime of the app.
+
+    Each client, and the import of its SDK, is created on first use by `get`,
+    so the app starts serving without paying for the ones it doesn't need yet.
+    """
+
+    NAMES = ("supabase", "anthropic", "http", "smtp")
+
+    def __init__(self):
+        self.supabase: AsyncClient | None = None
+        self.anthropic: anthropic.AsyncAnthropic | None = None
+        self.http: httpx.AsyncClient | None = None
+        self.smtp: SMTPPool | None = None
+        self._opened: set[str] = set()
+        self._locks = {name: asyncio.Lock() for name in self.NAMES}
+
+    async def get(self, name: str):
+        """The named client, created on first use; None if it isn't configured."""
+        if name not in self._opened and getattr(self, name) is None:
+            async with self._locks[name]:
+                if name not in self._opened and getattr(self, name) is None:
+                    setattr(self, name, await getattr(self, f"_open_{name}")())
+                    self._opened.add(name)
+        return getattr(self, name)
+
+    async def _open_supabase(self) -> AsyncClient | None:
+        url = os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        if not (url and key):
+            return None
+        supabase = await _import("supabase")
+        client = await supabase.acreate_client(url, key)
+        instrument_postgrest(client.postgrest.session)
+        return client
+
+    async def _open_anthropic(self) -> anthropic.AsyncAnthropic | None:
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            return None
+        anthropic = await _import("anthropic")
+        # Retries (honouring retry-after) are done by core.model_scheduler,
+        # which also pauses every other call when the API pushes back
+        return anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
+
+    async def _open_http(self) -> httpx.AsyncClient:
+        httpx = await _import("httpx")
+        # Keep-alive connections for image downloads (Supabase Storage)
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=30.0,
+        )
+        return httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0), limits=limits)
+
+    async def _open_smtp(self) -> SMTPPool | None:
+        # Persistent SMTP connections, opened with the first send
+        return SMTPPool.from_env()
+
+    async def open(self):
+        """Create every configured client now instead of on first use."""
+        # One at a time: the SDKs share imports (httpx, pydantic)
+        for name in self.NAMES:
+            await self.get(name)
+
+    async def connect(self):
+        """Open one connection to each configured service, so the first
+        request doesn't pay for DNS, TCP, TLS (and the SMTP login)."""
+        warm = {}
+        if self.supabase is not None:
+            # Any response will do: what we want is the keep-alive connection
+            warm["supabase"] = self.supabase.postgrest.session.head("/")
+            if self.http is not None:
+                warm["storage"] = self.http.head(f"{os.getenv('SUPABASE_URL')}/storage/v1/")
+        if self.anthropic is not None:
+            warm["anthropic"] = self.anthropic.get("/v1/models", cast_to=object, options={"params": {"limit": 1}})
+        if self.smtp is not None:
+            warm["smtp"] = self.smtp.warm()
+        results = await asyncio.gather(*warm.values(), return_exceptions=True)
+        for name, result in zip(warm, results):
+            if isinstance(result, Exception):
+                logger.warning("Warm-up connection to %s failed: %s", name, result)
+
+    async def warm_up(self, connect: bool = False):
+        try:
+            await self.open()
+            if connect:
+                await self.connect()
+        except Exception:
+            # The first request that needs the client will try (and report) again
+            logger.exception("Client warm-up failed")
+
+    async def close(self):
+        if self.smtp is not None:
+            await self.smtp.close()
+        if self.http is not None:
+            await self.http.aclose()
+        if self.anthropic is not None:
+            await self.anthropic.close()
+        if self.supabase is not None:
+            await self.supabase.postgrest.aclose()
+        self.supabase = self.anthropic = self.http = self.smtp = None
+        self._opened.clear()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients = Clients()
+    app.state.clients = clients
+    await job_queue.start(clients)
+    warmup = None
+    if STARTUP_WARMUP in ("clients", "connections"):
+        warmup = asyncio.create_task(clients.warm_up(connect=STARTUP_WARMUP == "connections"))
+    try:
+        yield
+    finally:
+        if warmup is not None:
+            warmup.cancel()
+            with suppress(asyncio.CancelledError):
+                await warmup
+        await job_queue.stop()
+        await clients.close()
+
+
+_MISSING = {
+    "supabase": "Supabase no configurado",
+    "anthropic": "ANTHROPIC_API_KEY no configurado",
+    "smtp": "SMTP no configurado",
+}
+
+
+async def require(clients: Clients, name: str):
+    """The named client, or a 500 if its settings are missing (for endpoints and jobs alike)."""
+    client = await clients.get(name)
+    if client is None:
+        raise HTTPException(status_code=500, detail=_MISSING[name])
+    return client
+
+
+def _clients(request: Request) -> Clients:
+    return request.app.state.clients
+
+
+async def get_supabase(request: Request) -> AsyncClient:
+    return await require(_clients(request), "supabase")
+
+
+async def get_anthropic(request: Request) -> anthropic.AsyncAnthropic:
+    return await require(_clients(request), "anthropic")
+
+
+async def get_http(request: Request) -> httpx.AsyncClient:
+    return await _clients(request).get("http")
+
+
+async def get_smtp(request: Request) -> SMTPPool:
+    return await require(_clients(request), "smtp")
@@ -0,0 +1,277 @@
+"""Declarative spec of the clinical history (clinical_sessions JSONB columns).
+
+Single source for the JSON structure the model fills, the Pydantic models
+that validate it, the section groups used by parallel fills, and the labels
+used when rendering a session.
+"""
+import re
+import json
+from dataclasses import dataclass
+from typing import Literal
+
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+from pydantic import Field as ModelField
+
+
+@dataclass(frozen=True)
+class Field:
+    key: str
+    label: str
+    kind: Literal["text", "number", "list"] = "text"
+
+    @property
+    def is_list(self) -> bool:
+        return self.kind == "list"
+
+
+@dataclass(frozen=True)
+class Section:
+    key: str
+    letter: str
+    title: str
+    fields: tuple[Field, ...] = ()
+    # Sections stored as a plain list (objetivos TEXT[])
+    is_list: bool = False
+
+    @property
+    def heading(self) -> str:
+        return f"{self.letter}. {self.title}"
+
+
+SECTIONS: tuple[Section, ...] = (
+    Section("motivo_consulta", "A", "Motivo de Consulta", (
+        Field("texto_paciente", "Texto del paciente"),
+        Field("inicio_evolucion", "Inicio/evolución"),
+        Field("desencadenantes", "Desencadenantes"),
+    )),
+    Section("historia_problema", "B", "Historia del Problema", (
+        Field("sintomas", "Síntomas"),
+        Field("impacto_score", "Impacto (0-10)", kind="number"),
+        Field("areas", "Áreas afectadas", kind="list"),
+        Field("estrategias", "Estrategias previas"),
+        Field("factores", "Factores"),
+    )),
+    Section("tamizajes", "C", "Tamizajes", (
+        Field("phq_score", "Puntaje PHQ", kind="number"),
+        Field("phq_items", "Ítems PHQ"),
+        Field("otros", "Otros instrumentos"),
+    )),
+    Section("riesgo_seguridad", "D", "Riesgo y Seguridad", (
+        Field("ideacion", "Ideación"),
+        Field("frecuencia", "Frecuencia"),
+        Field("plan", "Plan"),
+        Field("medios", "Acceso a medios"),
+        Field("intencion", "Intención"),
+        Field("protectores", "Factores protectores"),
+        Field("acciones", "Acciones tomadas", kind="list"),
+    )),
+    Section("antecedentes", "E", "Antecedentes", (
+        Field("salud_mental", "Salud mental"),
+        Field("salud_medica", "Salud médica"),
+        Field("sustancias", "Sustancias"),
+        Field("eventos", "Eventos significativos"),
+    )),
+    Section("contexto_psicosocial", "F", "Contexto Psicosocial", (
+        Field("familia", "Familia"),
+        Field("relaciones", "Relaciones"),
+        Field("factores_contexto", "Factores contextuales"),
+        Field("recursos", "Recursos"),
+    )),
+    Section("observaciones_clinicas", "G", "Observaciones Clínicas", (
+        Field("apariencia", "Apariencia"),
+        Field("actitud", "Actitud"),
+        Field("afecto", "Afecto"),
+        Field("lenguaje", "Lenguaje"),
+        Field("pensamiento", "Pensamiento"),
+        Field("orientacion", "Orientación"),
+        Field("insight", "Insight"),
+    )),
+    Section("formulacion_clinica", "H", "Formulación Clínica", (
+        Field("patrones", "Patrones"),
+        Field("creencias", "Creencias"),
+        Field("ciclo", "Ciclo"),
+        Field("necesidades", "Necesidades"),
+    )),
+    Section("objetivos", "I", "Objetivos Terapéuticos", is_list=True),
+    Section("intervenciones", "J", "Intervenciones", (
+        Field("psicoeducacion", "Psicoeducación"),
+        Field("regulacion", "Regulación emocional"),
+        Field("patrones", "Trabajo con patrones"),
+        Field("limites", "Límites"),
+        Field("otros", "Otros"),
+    )),
+    Section("plan", "K", "Plan", (
+        Field("plan_semana", "Plan para la semana"),
+        Field("tarea", "Tarea asignada"),
+        Field("proxima_fecha", "Próxima sesión"),
+        Field("proxima_hora", "Hora"),
+        Field("proxima_foco", "Foco próxima sesión"),
+    )),
+    Section("cierre_administrativo", "L", "Cierre Administrativo", (
+        Field("pago_realizado", "Pago realizado"),
+        Field("pago_metodo", "Método de pago"),
+        Field("reserva", "Reserva"),
+        Field("consentimiento", "Consentimiento"),
+        Field("observaciones", "Observaciones"),
+    )),
+)
+
+SECTIONS_BY_KEY = {s.key: s for s in SECTIONS}
+
+# Rest of the data shown with a session (patients and clinical_sessions columns)
+PATIENT_DATA: tuple[Field, ...] = (
+    Field("full_name", "Nombre completo"),
+    Field("preferred_name", "Nombre preferido"),
+    Field("pronouns", "Pronombres"),
+    Field("document_id", "Documento"),
+    Field("age", "Edad", kind="number"),
+    Field("phone", "Teléfono"),
+    Field("email", "Email"),
+    Field("city", "Ciudad"),
+    Field("occupation", "Ocupación"),
+    Field("education", "Escolaridad"),
+    Field("referral_source", "Fuente de referencia"),
+)
+
+SESSION_DATA: tuple[Field, ...] = (
+    Field("session_number", "Sesión N°", kind="number"),
+    Field("session_date", "Fecha"),
+    Field("session_time", "Hora"),
+    Field("modality", "Modalidad"),
+    Field("status", "Estado"),
+)
+
+# Section groups filled concurrently by the parallel clinical fill
+SECTION_GROUPS: tuple[tuple[str, ...], ...] = (
+    ("motivo_consulta", "historia_problema", "tamizajes"),
+    ("riesgo_seguridad", "antecedentes", "contexto_psicosocial"),
+    ("observaciones_clinicas", "formulacion_clinica", "objetivos"),
+    ("intervenciones", "plan", "cierre_administrativo"),
+)
+
+
+def empty_template(keys: tuple[str, ...] | None = None) -> dict:
+    """The JSON structure with every field empty (null or [])."""
+    sections = SECTIONS if keys is None else [SECTIONS_BY_KEY[k] for k in keys]
+    return {
+        s.key: [] if s.is_list else {f.key: [] if f.is_list else None for f in s.fields}
+        for s in sections
+    }
+
+
+# ── Pydantic models ───────────────────────────────────────────────────────────
+
+_FIELD_TYPES = {"text": str | None, "number": int | float | None, "list": list[str]}
+
+
+class _Section(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+
+def _section_model(section: Section) -> type[BaseModel]:
+    fields = {
+        f.key: (_FIELD_TYPES[f.kind], ModelField([] if f.is_list else ..., description=f.label))
+        for f in section.fields
+    }
+    name = "".join(part.capitalize() for part in section.key.split("_"))
+    return create_model(name, __base__=_Section, **fields)
+
+
+SECTION_MODELS: dict[str, type[BaseModel]] = {
+    s.key: _section_model(s) for s in SECTIONS if not s.is_list
+}
+
+# Sections are optional so one tool schema serves full and partial fills
+ClinicalHistory: type[BaseModel] = create_model(
+    "ClinicalHistory",
+    __base__=_Section,
+    **{
+        s.key: ((list[str] if s.is_list else SECTION_MODELS[s.key]) | None, ModelField(None, description=s.heading))
+        for s in SECTIONS
+    },
+)
+
+
+def section_json(key: str, value) -> dict | list:
+    """Validate one section against its model and return it as plain JSON."""
+    if SECTIONS_BY_KEY[key].is_list:
+        if not isinstance(value, list):
+            raise ValueError(f"sección '{key}' debe ser una lista")
+        return [str(v) for v in value]
+    try:
+        return SECTION_MODELS[key].model_validate(value).model_dump()
+    except ValidationError as e:
+        raise ValueError(f"sección '{key}' inválida: {e.error_count()} errores") from e
+
+
+def _as_text(value) -> str | None:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _as_list(value) -> list[str]:
+    if value is None or value == "":
+        return []
+    if isinstance(value, list):
+        return [_as_text(v) for v in value if v is not None]
+    if isinstance(value, str):
+        return [line.strip(" -•\t") for line in value.splitlines() if line.strip(" -•\t")]
+    return [_as_text(value)]
+
+
+def _as_number(value) -> int | float | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    match = re.search(r"-?\d+(?:[.,]\d+)?", str(value or ""))
+    if not match:
+        return None
+    number = float(match.group().replace(",", "."))
+    return int(number) if number.is_integer() else number
+
+
+def repair_section(key: str, value) -> dict | list:
+    """Coerce a section that failed validation into its schema, field by field.
+
+    Raises ValueError when there is nothing salvageable (e.g. not an object).
+    """
+    section = SECTIONS_BY_KEY[key]
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            if section.is_list:
+                return _as_list(value)
+            raise ValueError(f"sección '{key}' no es un objeto JSON")
+    if section.is_list:
+        return _as_list(value)
+    if not isinstance(value, dict):
+        raise ValueError(f"sección '{key}' no es un objeto JSON")
+
+    coerce = {"text": _as_text, "number": _as_number, "list": _as_list}
+    return section_json(key, {f.key: coerce[f.kind](value.get(f.key)) for f in section.fields})
+
+
+def inline_refs(schema: dict) -> dict:
+    """Resolve $ref/$defs so the tool input schema is self-contained."""
+    defs = schema.get("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return resolve(defs[node["$ref"].split("/")[-1]])
+            return {k: resolve(v) for k, v in node.items() if k != "$defs"}
+        if isinstance(node, list):
+            return [resolve(v) for v in node]
+        return node
+
+    return resolve(schema)
+
+
+CLINICAL_TOOL_SCHEMA = inline_refs(ClinicalHistory.model_json_schema())
@@ -0,0 +1,191 @@
+"""Clinical history email, rendered from the spec in core/clinical_schema.
+
+The layout is compiled once, at import: page chrome, headings and labels
+are escaped and concatenated up front, so a render only parses each JSONB
+column once, escapes the values and joins strings. The HTML body and its
+plain-text alternative come from the same compiled blocks.
+"""
+import json
+from dataclasses import dataclass
+from html import escape
+
+from core.clinical_schema import PATIENT_DATA, SECTIONS, SESSION_DATA, Field
+
+TITLE = "Historia Clínica Psicológica"
+FOOTER = "Este documento es confidencial y ha sido generado desde Tu Lugar Seguro."
+EMPTY = "Sin información registrada"
+
+_STYLE = """
+    body { font-family: Georgia, serif; color: #2d2d2d; max-width: 800px; margin: 0 auto; padding: 20px; }
+    h1 { color: #5b3a8e; border-bottom: 2px solid #5b3a8e; padding-bottom: 8px; }
+    h2 { color: #5b3a8e; margin-top: 24px; font-size: 1.1em; }
+    .header-info { background: #f9f5ff; border-left: 4px solid #5b3a8e; padding: 12px 16px; margin-bottom: 24px; }
+    .section { margin-bottom: 20px; border: 1px solid #e5e0f0; border-radius: 6px; padding: 12px 16px; }
+    ul { padding-left: 20px; }
+    li { margin-bottom: 4px; }
+    .footer { margin-top: 32px; font-size: 0.85em; color: #777; border-top: 1px solid #ddd; padding-top: 12px; }
+  """
+
+_HTML_HEAD = f"""<!DOCTYPE html>
+<html lang="es">
+<head>
+  <meta charset="UTF-8">
+  <style>{_STYLE}</style>
+</head>
+<body>
+  <h1>{escape(TITLE)}</h1>
+"""
+
+_HTML_TAIL = f"""
+  <div class="footer">
+    {escape(FOOTER)}
+  </div>
+</body>
+</html>"""
+
+
+def load_jsonb(value):
+    """JSONB columns can arrive as JSON strings; unreadable ones count as empty."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
+
+def format_value(value) -> str | None:
+    """Display text of a field, or None when there's nothing to show."""
+    if value is None or value == "" or value == [] or value == {}:
+        return None
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+    return str(value)
+
+
+@dataclass(frozen=True)
+class _Block:
+    """One compiled section: static HTML/text around a list of fields."""
+    key: str | None  # clinical_sessions column; None for the patient row
+    is_list: bool
+    html_open: str
+    html_empty: str
+    text_heading: str
+    text_empty: str
+    # (field key, HTML prefix, text prefix)
+    fields: tuple[tuple[str, str, str], ...] = ()
+
+
+def _compile_fields(fields: tuple[Field, ...]) -> tuple[tuple[str, str, str], ...]:
+    return tuple((f.key, f"<li><strong>{escape(f.label)}:</strong> ", f"- {f.label}: ") for f in fields)
+
+
+def _compile_block(key: str | None, heading: str, fields: tuple[Field, ...] = (), is_list: bool = False) -> _Block:
+    empty = "Sin objetivos registrados" if is_list else EMPTY
+    return _Block(
+        key=key,
+        is_list=is_list,
+        html_open=f'\n  <div class="section">\n    <h2>{escape(heading)}</h2>\n    ',
+        html_empty=f"<p><em>{escape(empty)}</em></p>",
+        text_heading=f"\n{heading.upper()}\n",
+        text_empty=f"{empty}\n",
+        fields=_compile_fields(fields),
+    )
+
+
+class ClinicalHistoryRenderer:
+    def __init__(self):
+        self.header = tuple(
+            (f.key, f"<br>\n    <strong>{escape(f.label)}:</strong> ", f"{f.label}: ") for f in SESSION_DATA
+        )
+        self.blocks = (
+            _compile_block(None, "Datos del Paciente", PATIENT_DATA),
+            *(_compile_block(s.key, s.heading, s.fields, s.is_list) for s in SECTIONS),
+        )
+
+    @staticmethod
+    def _patient_name(patient: dict) -> str:
+        return patient.get("full_name") or patient.get("preferred_name") or "Paciente"
+
+    @staticmethod
+    def _entries(block: _Block, data) -> list[tuple[str, str, str]]:
+        """(HTML prefix, text prefix, value) of each non-empty field."""
+        if block.is_list:
+            if not isinstance(data, list):
+                return []
+            return [("<li>", "- ", str(v)) for v in data if v not in (None, "")]
+        if not isinstance(data, dict):
+            return []
+        entries = []
+        for key, html_prefix, text_prefix in block.fields:
+            value = format_value(data.get(key))
+            if value is not None:
+                entries.append((html_prefix, text_prefix, value))
+        return entries
+
+    def _resolve(self, session: dict, patient: dict) -> tuple[list[str], list[list[tuple[str, str, str]]]]:
+        """Header values and block entries, read from the rows once per render."""
+        header = [format_value(session.get(key)) or "-" for key, _, _ in self.header]
+        entries = [
+            self._entries(block, patient if block.key is None else load_jsonb(session.get(block.key)))
+            for block in self.blocks
+        ]
+        return header, entries
+
+    def _html(self, name: str, header: list[str], entries: list) -> str:
+        out = [_HTML_HEAD, '\n  <div class="header-info">\n    <strong>Paciente:</strong> ', escape(name, quote=False)]
+        for (_, html_prefix, _), value in zip(self.header, header):
+            out.append(html_prefix)
+            out.append(escape(value, quote=False))
+        out.append("\n  </div>\n")
+
+        for block, items in zip(self.blocks, entries):
+            out.append(block.html_open)
+            if items:
+                out.append("<ul>")
+                for html_prefix, _, value in items:
+                    out.append(html_prefix)
+                    out.append(escape(value, quote=False))
+                    out.append("</li>")
+                out.append("</ul>")
+            else:
+                out.append(block.html_empty)
+            out.append("\n  </div>\n")
+        out.append(_HTML_TAIL)
+        return "".join(out)
+
+    def _text(self, name: str, header: list[str], entries: list) -> str:
+        out = [TITLE.upper(), "\n\nPaciente: ", name, "\n"]
+        for (_, _, text_prefix), value in zip(self.header, header):
+            out.append(text_prefix)
+            out.append(value)
+            out.append("\n")
+
+        for block, items in zip(self.blocks, entries):
+            out.append(block.text_heading)
+            if items:
+                for _, text_prefix, value in items:
+                    out.append(text_prefix)
+                    out.append(value)
+                    out.append("\n")
+            else:
+                out.append(block.text_empty)
+        out.append("\n--\n")
+        out.append(FOOTER)
+        out.append("\n")
+        return "".join(out)
+
+    def html(self, session: dict, patient: dict) -> str:
+        return self._html(self._patient_name(patient), *self._resolve(session, patient))
+
+    def text(self, session: dict, patient: dict) -> str:
+        return self._text(self._patient_name(patient), *self._resolve(session, patient))
+
+    def render(self, session: dict, patient: dict) -> tuple[str, str]:
+        """(plain text, HTML) for a multipart/alternative message."""
+        name = self._patient_name(patient)
+        header, entries = self._resolve(session, patient)
+        return self._text(name, header, entries), self._html(name, header, entries)
+
+
+clinical_history_email = ClinicalHistoryRenderer()
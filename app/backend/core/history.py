@@ -0,0 +1,173 @@
+"""Long patient histories for the prep summary.
+
+Every clinical_sessions row carries a compact `digest`, written by a trigger
+on save (see session_digest() in the migrations). The summary shows the most
+recent digests verbatim; older sessions are folded, in fixed blocks of
+ROLLUP_BLOCK from the oldest, into stored roll-ups, and roll-ups into
+higher-level roll-ups, so the prompt grows with log(history), not history.
+"""
+from __future__ import annotations
+
+import os
+import asyncio
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from core.metrics import span
+from core.model_scheduler import INTERACTIVE, model_scheduler
+from core.single_flight import fingerprint, single_flight
+from core.usage import usage_tracker
+
+if TYPE_CHECKING:
+    import anthropic
+    from supabase import AsyncClient
+
+ROLLUP_MODEL = os.getenv("ROLLUP_MODEL", "claude-haiku-4-5")
+ROLLUP_BLOCK = int(os.getenv("ROLLUP_BLOCK", "10"))
+ROLLUP_CONCURRENCY = int(os.getenv("ROLLUP_CONCURRENCY", "4"))
+DIGEST_FIELD_CHARS = 400
+
+ROLLUP_PROMPT = """Eres un asistente de psicología clínica. Resume en un solo párrafo compacto
+(máximo 150 palabras) la evolución del paciente a lo largo de estos registros: temas y patrones
+recurrentes, objetivos logrados o pendientes, intervenciones relevantes, tareas y cualquier
+señal de riesgo. No inventes información.
+
+{items}"""
+
+
+def session_digest(row: dict) -> str:
+    """Python twin of the SQL session_digest(), for rows read without it."""
+    def cut(value) -> str:
+        return (value or "")[:DIGEST_FIELD_CHARS]
+
+    lines = []
+    if row.get("motivo"):
+        lines.append(f"Motivo: {cut(row['motivo'])}")
+    if row.get("objetivos"):
+        lines.append(f"Objetivos: {cut(', '.join(row['objetivos']))}")
+    if row.get("plan_semana") or row.get("tarea"):
+        lines.append(f"Plan: {cut(row.get('plan_semana'))} | Tarea: {cut(row.get('tarea'))}")
+    if row.get("patrones"):
+        lines.append(f"Patrones: {cut(row['patrones'])}")
+    if row.get("intervenciones"):
+        lines.append(f"Intervenciones: {cut(row['intervenciones'])}")
+    return "\n".join(lines)
+
+
+def session_heading(session: dict, position: int) -> str:
+    return f"--- SESIÓN {session.get('session_number') or position} ({session.get('session_date') or 'fecha desconocida'}) ---"
+
+
+@dataclass
+class Rollup:
+    level: int
+    idx: int
+    children: list  # session dicts (level 1) or Rollups
+    fingerprint: str = ""
+    sessions: list = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.level == 1:
+            self.sessions = self.children
+            parts = [(s["id"], s.get("digest_hash")) for s in self.children]
+        else:
+            self.sessions = [s for child in self.children for s in child.sessions]
+            parts = [child.fingerprint for child in self.children]
+        self.fingerprint = fingerprint(ROLLUP_MODEL, self.level, parts)
+
+    @property
+    def label(self) -> str:
+        first, last = self.sessions[0], self.sessions[-1]
+        return (
+            f"[Sesiones {first.get('session_number') or '?'}–{last.get('session_number') or '?'}, "
+            f"{first.get('session_date') or '?'} a {last.get('session_date') or '?'}]"
+        )
+
+
+def plan_history(sessions: list[dict], recent: int) -> tuple[list[Rollup], list[dict]]:
+    """Split chronological sessions into the roll-ups shown in the prompt
+    (oldest first, highest level first) and the sessions shown as digests."""
+    older, shown = sessions[:-recent] if len(sessions) > recent else [], sessions[-recent:]
+    rollups: list[Rollup] = []
+    items, level = older, 1
+    while len(items) >= ROLLUP_BLOCK:
+        full = len(items) - len(items) % ROLLUP_BLOCK
+        if level == 1:
+            # Sessions outside a complete block stay as digests
+            shown = items[full:] + shown
+        else:
+            rollups = items[full:] + rollups
+        items = [Rollup(level, i // ROLLUP_BLOCK, items[i:i + ROLLUP_BLOCK]) for i in range(0, full, ROLLUP_BLOCK)]
+        level += 1
+    if level == 1:
+        shown = items + shown
+    else:
+        rollups = items + rollups
+    return rollups, shown
+
+
+class HistoryBuilder:
+    """Resolves the roll-up texts for one patient, generating (and storing)
+    only those missing or whose fingerprint no longer matches."""
+
+    def __init__(self, sb: AsyncClient, client: anthropic.AsyncAnthropic, patient_id: str, stored: list[dict]):
+        self.sb = sb
+        self.client = client
+        self.patient_id = patient_id
+        self.stored = {(r["level"], r["idx"]): r for r in stored}
+        self.semaphore = asyncio.Semaphore(ROLLUP_CONCURRENCY)
+        self.generated = 0
+
+    async def text(self, rollup: Rollup) -> str:
+        stored = self.stored.get((rollup.level, rollup.idx))
+        if stored and stored["fingerprint"] == rollup.fingerprint:
+            return stored["summary"]
+        # Concurrent summaries of the same patient share the generation
+        key = ("session_rollup", self.patient_id, rollup.fingerprint)
+        return await single_flight.do(key, lambda: self._generate(rollup))
+
+    async def _generate(self, rollup: Rollup) -> str:
+        if rollup.level == 1:
+            digests = await self.digests(rollup.children)
+            items = "\n\n".join(
+                f"{session_heading(s, i)}\n{digests.get(s['id']) or '(sin datos)'}"
+                for i, s in enumerate(rollup.children, 1)
+            )
+        else:
+            texts = await asyncio.gather(*(self.text(child) for child in rollup.children))
+            items = "\n\n".join(f"{child.label}\n{text}" for child, text in zip(rollup.children, texts))
+
+        async with self.semaphore:
+            with span("llm", "session_rollup"):
+                message = await model_scheduler.create(
+                    self.client,
+                    INTERACTIVE,
+                    model=ROLLUP_MODEL,
+                    max_tokens=400,
+                    messages=[{"role": "user", "content": ROLLUP_PROMPT.format(items=items)}],
+                )
+        usage_tracker.record("session_rollup", ROLLUP_MODEL, message)
+        summary = message.content[0].text
+        self.generated += 1
+        try:
+            await self.sb.table("session_rollups").upsert({
+                "patient_id": self.patient_id,
+                "level": rollup.level,
+                "idx": rollup.idx,
+                "fingerprint": rollup.fingerprint,
+                "summary": summary,
+                "model": ROLLUP_MODEL,
+            }).execute()
+        except Exception:
+            # Regenerated next time; this summary still gets it
+            pass
+        return summary
+
+    async def digests(self, sessions: list[dict]) -> dict[str, str]:
+        """Digest by session id, reading from the DB only those not at hand."""
+        have = {s["id"]: s["digest"] for s in sessions if s.get("digest") is not None}
+        missing = [s["id"] for s in sessions if s["id"] not in have]
+        if missing:
+            res = await self.sb.table("clinical_sessions").select("id, digest").in_("id", missing).execute()
+            have.update({r["id"]: r["digest"] for r in res.data})
+        return have
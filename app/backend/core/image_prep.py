@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import os
+import io
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+# Reject downloads bigger than this before they are fully buffered
+OCR_MAX_DOWNLOAD_BYTES = int(os.getenv("OCR_MAX_DOWNLOAD_BYTES", str(25 * 1024 * 1024)))
+# Long edge sent to the model. Claude Vision downsizes anything above ~1568px
+# itself, so larger images only cost upload time, not OCR quality.
+OCR_MAX_EDGE = int(os.getenv("OCR_MAX_EDGE", "1568"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+
+# Part of the OCR cache key: bump when the preprocessing output changes
+PREPROCESS_VERSION = f"v1:{OCR_MAX_EDGE}:{OCR_JPEG_QUALITY}"
+
+# Guard against decompression bombs (~50 MP covers any phone camera)
+MAX_IMAGE_PIXELS = 50_000_000
+
+
+def _pil():
+    """Pillow, imported with the first image rather than at startup."""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    return Image, ImageOps
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+async def stream_download(http: httpx.AsyncClient, url: str, max_bytes: int = OCR_MAX_DOWNLOAD_BYTES) -> tuple[bytes, str]:
+    """Download `url` chunk by chunk, aborting once it exceeds `max_bytes`."""
+    async with http.stream("GET", url) as resp:
+        resp.raise_for_status()
+        declared = int(resp.headers.get("content-length") or 0)
+        if declared > max_bytes:
+            raise ImageTooLarge(f"Imagen demasiado grande ({declared} bytes, máximo {max_bytes})")
+
+        buf = bytearray()
+        async for chunk in resp.aiter_bytes():
+            buf += chunk
+            if len(buf) > max_bytes:
+                raise ImageTooLarge(f"Imagen demasiado grande (más de {max_bytes} bytes)")
+        return bytes(buf), resp.headers.get("content-type", "image/jpeg")
+
+
+def preprocess_image(data: bytes, content_type: str) -> tuple[bytes, str]:
+    """Auto-orient, downscale to OCR_MAX_EDGE and recompress as JPEG.
+
+    Formats Pillow can't decode (PDF, HEIC without plugin) are returned untouched.
+    Blocking: call through asyncio.to_thread.
+    """
+    if content_type == "application/pdf":
+        return data, content_type
+    Image, ImageOps = _pil()
+    try:
+        img = Image.open(io.BytesIO(data))
+        untouched = max(img.size) <= OCR_MAX_EDGE and img.getexif().get(0x0112, 1) == 1
+        # For JPEGs, decode directly at a reduced scale: peak memory stays
+        # near the output size instead of the full camera resolution
+        img.draft("RGB", (OCR_MAX_EDGE, OCR_MAX_EDGE))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((OCR_MAX_EDGE, OCR_MAX_EDGE), Image.Resampling.LANCZOS)
+
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=OCR_JPEG_QUALITY, optimize=True)
+    except (OSError, Image.DecompressionBombError):
+        return data, content_type
+
+    processed = out.getvalue()
+    # Already-small, upright images can grow when recompressed
+    if untouched and len(processed) >= len(data) and content_type in ("image/jpeg", "image/png", "image/webp"):
+        return data, content_type
+    return processed, "image/jpeg"
+
+
+def image_tokens(data: bytes) -> int:
+    """Estimated vision input tokens: (w*h)/750 after the API's own resize
+    to <=1568px / ~1.15 MP. Undecodable images count as a full-size page."""
+    Image, _ = _pil()
+    try:
+        w, h = Image.open(io.BytesIO(data)).size
+    except (OSError, Image.DecompressionBombError):
+        return 1600
+    scale = min(1.0, 1568 / max(w, h), (1_150_000 / (w * h)) ** 0.5)
+    return int((w * scale) * (h * scale) / 750)
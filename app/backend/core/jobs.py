@@ -0,0 +1,409 @@
+"""Background jobs for the long endpoints (OCR, clinical fill, email).
+
+Jobs are stored in a local SQLite file and run by a pool of workers in
+the API process. Submitting returns at once with a job id; the result is
+read later from /jobs. Transient failures (rate limits, overloaded or
+unreachable services) are retried with exponential backoff, and jobs that
+were queued or running when the process stopped are picked up again on
+the next start. JOBS_DB must live on a persistent volume for that to
+survive a redeploy: on Cloud Run the container file system is in memory
+and discarded with the instance, so there the queue refuses to start
+unless JOBS_DB is on a mounted volume (e.g. a Cloud Storage or NFS volume
+mount). Workers run between requests, so the service also needs CPU
+always allocated (--no-cpu-throttling) and a minimum instance.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import sqlite3
+import sys
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from fastapi import HTTPException
+
+from core.metrics import job_seconds, jobs_running
+from core.single_flight import fingerprint
+
+if TYPE_CHECKING:
+    from core.clients import Clients
+
+logger = logging.getLogger("agents.jobs")
+
+JOBS_DB = os.getenv("JOBS_DB", "jobs.sqlite3")
+# Set by Cloud Run, whose container file system does not outlive the instance
+ON_CLOUD_RUN = bool(os.getenv("K_SERVICE"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "4"))
+# Retry n waits JOBS_BACKOFF_S * 2^(n-1), up to JOBS_BACKOFF_MAX_S, with jitter
+JOBS_BACKOFF_S = float(os.getenv("JOBS_BACKOFF_S", "5"))
+JOBS_BACKOFF_MAX_S = float(os.getenv("JOBS_BACKOFF_MAX_S", "300"))
+# Finished jobs (and their results, which hold clinical text) are deleted after this
+JOBS_RETENTION_S = int(os.getenv("JOBS_RETENTION_S", str(24 * 3600)))
+# On shutdown, running jobs get this long to finish before being requeued
+JOBS_DRAIN_S = float(os.getenv("JOBS_DRAIN_S", "8"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id           TEXT PRIMARY KEY,
+  kind         TEXT NOT NULL,
+  dedupe_key   TEXT NOT NULL,
+  payload      TEXT NOT NULL,
+  status       TEXT NOT NULL,  -- queued | running | succeeded | failed
+  attempts     INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL,
+  run_after    REAL NOT NULL,
+  result       TEXT,
+  error        TEXT,
+  error_code   INTEGER,         -- HTTP status to answer the result request with
+  created_at   REAL NOT NULL,
+  updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status);
+"""
+
+
+class RetryJob(Exception):
+    """Raised by a handler to have the job retried (if attempts remain)."""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: dict
+    status: str
+    attempts: int
+    max_attempts: int
+    run_after: float
+    created_at: float
+    updated_at: float
+    result: dict | None = None
+    error: str | None = None
+    error_code: int | None = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        data = dict(row)
+        data.pop("dedupe_key")
+        data["payload"] = json.loads(data["payload"])
+        data["result"] = json.loads(data["result"]) if data["result"] is not None else None
+        return cls(**data)
+
+    @property
+    def final_attempt(self) -> bool:
+        return self.attempts >= self.max_attempts
+
+    def public(self) -> dict:
+        """Status as returned by the API (without payload or result)."""
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "retry_at": self.run_after if self.status == "queued" and self.attempts else None,
+        }
+
+
+Handler = Callable[[Job, "Clients"], Awaitable[dict]]
+
+
+def mount_of(path: str) -> tuple[str, str]:
+    """(mount point, file system type) holding `path`, from /proc/mounts."""
+    best = ("/", "")
+    with open("/proc/mounts") as f:
+        for line in f:
+            _, mount, fstype, *_ = line.split()
+            if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) >= len(best[0]):
+                best = (mount, fstype)
+    return best
+
+
+def check_persistent(path: str):
+    """Fail if `path` would be lost with the instance (Cloud Run only)."""
+    directory = os.path.dirname(os.path.realpath(path))
+    mount, fstype = mount_of(directory)
+    if mount == "/" or fstype == "tmpfs":
+        raise RuntimeError(
+            f"JOBS_DB={path} is not on a mounted volume ({mount}, {fstype or 'unknown'}): "
+            "queued jobs would be lost with the instance. Mount a volume and point JOBS_DB at it."
+        )
+    if not os.access(directory, os.W_OK):
+        raise RuntimeError(f"JOBS_DB={path}: {directory} is not writable")
+
+
+# Upstream unavailable or timing out
+TRANSIENT_STATUS = (502, 503, 504)
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether trying again later can succeed."""
+    if isinstance(exc, (RetryJob, asyncio.TimeoutError)):
+        return True
+    # The SDKs are imported with their clients: an error of one that isn't
+    # loaded can't have been raised, so there's no need to import it here
+    anthropic, httpx, aiosmtplib = (sys.modules.get(name) for name in ("anthropic", "httpx", "aiosmtplib"))
+    if anthropic is not None:
+        if isinstance(exc, anthropic.APIStatusError):
+            return exc.status_code == 429 or exc.status_code >= 500
+        if isinstance(exc, anthropic.APIConnectionError):
+            return True
+    if httpx is not None and isinstance(exc, httpx.TransportError):
+        return True
+    if aiosmtplib is not None:
+        if isinstance(exc, aiosmtplib.SMTPResponseException):
+            # 4xx replies are temporary by definition (greylisting, mailbox busy)
+            return 400 <= exc.code < 500
+        if isinstance(exc, (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, aiosmtplib.SMTPTimeoutError)):
+            return True
+    if isinstance(exc, HTTPException):
+        # Not 500: the endpoints use it for missing settings and bad model output
+        return exc.status_code in TRANSIENT_STATUS
+    return False
+
+
+class JobStore:
+    """SQLite persistence; every call runs in a thread, one at a time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        self._db = db
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], object]):
+        def call():
+            with self._lock:
+                if self._db is None:
+                    self._open()
+                return fn(self._db)
+        return await asyncio.to_thread(call)
+
+    async def recover(self, retention_s: float) -> int:
+        """Requeue jobs left running by a previous process; drop expired finished ones."""
+        def fn(db):
+            now = time.time()
+            db.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?", (now - retention_s,))
+            return db.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (now,)).rowcount
+        return await self._run(fn)
+
+    async def submit(self, kind: str, payload: dict, max_attempts: int) -> tuple[Job, bool]:
+        """(job, created). An identical queued or running job is returned instead of a new one."""
+        dedupe_key = fingerprint(kind, payload)
+
+        def fn(db):
+            row = db.execute(
+                "SELECT * FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running') LIMIT 1", (dedupe_key,)
+            ).fetchone()
+            if row is not None:
+                return Job.from_row(row), False
+            now = time.time()
+            db.execute(
+                "INSERT INTO jobs (id, kind, dedupe_key, payload, status, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (str(uuid.uuid4()), kind, dedupe_key, json.dumps(payload, ensure_ascii=False), max_attempts, now, now, now),
+            )
+            return Job.from_row(db.execute("SELECT * FROM jobs WHERE rowid = last_insert_rowid()").fetchone()), True
+        return await self._run(fn)
+
+    async def claim(self) -> Job | None:
+        """Mark the next due job as running (one more attempt) and return it."""
+        def fn(db):
+            rows = db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?1 "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ?1 ORDER BY run_after LIMIT 1) "
+                "RETURNING *",
+                (time.time(),),
+            ).fetchall()  # exhaust the cursor so the update completes
+            return Job.from_row(rows[0]) if rows else None
+        return await self._run(fn)
+
+    async def next_due(self) -> float | None:
+        def fn(db):
+            return db.execute("SELECT MIN(run_after) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        return await self._run(fn)
+
+    async def finish(self, job_id: str, status: str, result: dict | None = None, error: str | None = None, error_code: int | None = None):
+        def fn(db):
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, error_code = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, error_code, time.time(), job_id),
+            )
+        await self._run(fn)
+
+    async def retry(self, job_id: str, run_after: float, error: str):
+        def fn(db):
+            db.execute(
+                "UPDATE jobs SET status = 'queued', run_after = ?, error = ?, updated_at = ? WHERE id = ?",
+                (run_after, error, time.time(), job_id),
+            )
+        await self._run(fn)
+
+    async def requeue(self, job_ids: list[str]):
+        """Put interrupted jobs back without counting the interrupted attempt."""
+        def fn(db):
+            db.executemany(
+                "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), updated_at = ? "
+                "WHERE id = ? AND status = 'running'",
+                [(time.time(), job_id) for job_id in job_ids],
+            )
+        await self._run(fn)
+
+    async def get(self, job_id: str) -> Job | None:
+        def fn(db):
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return Job.from_row(row) if row is not None else None
+        return await self._run(fn)
+
+    async def counts(self) -> dict[str, int]:
+        def fn(db):
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return await self._run(fn)
+
+    async def close(self):
+        def fn(db):
+            db.close()
+        if self._db is not None:
+            await self._run(fn)
+            self._db = None
+
+
+class JobQueue:
+    def __init__(self, path: str = JOBS_DB, workers: int = JOBS_WORKERS, max_attempts: int = JOBS_MAX_ATTEMPTS):
+        self.store = JobStore(path)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.handlers: dict[str, Handler] = {}
+        self.clients: "Clients | None" = None
+        self._tasks: list[asyncio.Task] = []
+        self._running: dict[str, asyncio.Task] = {}
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self.counts = dict.fromkeys(("submitted", "deduplicated", "succeeded", "failed", "retried", "resumed"), 0)
+
+    def register(self, kind: str, handler: Handler):
+        self.handlers[kind] = handler
+
+    async def start(self, clients: "Clients"):
+        if ON_CLOUD_RUN:
+            check_persistent(self.store.path)
+        self.clients = clients
+        self._stopping = False
+        self._wake = asyncio.Event()
+        resumed = await self.store.recover(JOBS_RETENTION_S)
+        if resumed:
+            logger.info("Resuming %d job(s) interrupted by the last shutdown", resumed)
+            self.counts["resumed"] += resumed
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_s: float = JOBS_DRAIN_S):
+        self._stopping = True
+        self._wake.set()
+        if self._running:
+            await asyncio.wait(list(self._running.values()), timeout=drain_s)
+        interrupted = list(self._running)
+        # Cancelling a worker cancels the job it is waiting on
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if interrupted:
+            logger.info("Requeued %d running job(s) on shutdown", len(interrupted))
+            await self.store.requeue(interrupted)
+        await self.store.close()
+
+    async def submit(self, kind: str, payload: dict) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"tipo de trabajo desconocido: {kind}")
+        job, created = await self.store.submit(kind, payload, self.max_attempts)
+        self.counts["submitted" if created else "deduplicated"] += 1
+        self._wake.set()
+        return job
+
+    async def get(self, job_id: str) -> Job | None:
+        return await self.store.get(job_id)
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        delay = min(JOBS_BACKOFF_S * 2 ** (attempt - 1), JOBS_BACKOFF_MAX_S)
+        return delay * random.uniform(0.75, 1.25)
+
+    async def _worker(self):
+        while not self._stopping:
+            self._wake.clear()
+            job = await self.store.claim()
+            if job is None:
+                next_due = await self.store.next_due()
+                timeout = max(next_due - time.time(), 0.05) if next_due is not None else None
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Wake another worker in case more jobs are due
+            self._wake.set()
+            task = asyncio.create_task(self._run(job))
+            self._running[job.id] = task
+            try:
+                await task
+            finally:
+                self._running.pop(job.id, None)
+
+    async def _run(self, job: Job):
+        handler = self.handlers.get(job.kind)
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"tipo de trabajo desconocido: {job.kind}")
+            jobs_running.inc(job.kind)
+            try:
+                result = await handler(job, self.clients)
+            finally:
+                jobs_running.dec(job.kind)
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+            if is_transient(e) and not job.final_attempt:
+                delay = self.backoff(job.attempts)
+                logger.warning("Job %s (%s) attempt %d failed, retrying in %.0fs: %s", job.id, job.kind, job.attempts, delay, error)
+                self.counts["retried"] += 1
+                job_seconds.observe(time.perf_counter() - start, job.kind, "retried")
+                await self.store.retry(job.id, time.time() + delay, error)
+                self._wake.set()
+            else:
+                logger.warning("Job %s (%s) failed after %d attempt(s): %s", job.id, job.kind, job.attempts, error)
+                self.counts["failed"] += 1
+                job_seconds.observe(time.perf_counter() - start, job.kind, "failed")
+                code = e.status_code if isinstance(e, HTTPException) else 500
+                await self.store.finish(job.id, "failed", error=error, error_code=code)
+            return
+        job_seconds.observe(time.perf_counter() - start, job.kind, "succeeded")
+        self.counts["succeeded"] += 1
+        await self.store.finish(job.id, "succeeded", result=result)
+
+    async def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "by_status": await self.store.counts(),
+            **self.counts,
+        }
+
+
+job_queue = JobQueue()
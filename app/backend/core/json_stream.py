@@ -0,0 +1,88 @@
+import json
+
+
+class TopLevelJSONParser:
+    """Incremental parser that yields each top-level (key, value) of a JSON object
+    as soon as the value is complete, while the rest is still being generated.
+
+    Text before the opening brace (e.g. a markdown fence) is ignored. Values
+    that fail to parse are skipped; `done` tells whether the object closed.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_kind = None  # "key" | "value" | None (nested)
+        self.expect = "key"      # key -> colon -> value -> in_value -> comma
+        self.key = None
+        self.key_start = 0
+        self.value_start = 0
+        self.primitive = False
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        self.text += chunk
+        out = []
+        text = self.text
+        while self.pos < len(text) and not self.done:
+            i, c = self.pos, text[self.pos]
+            self.pos += 1
+
+            if not self.started:
+                if c == "{":
+                    self.started, self.depth, self.expect = True, 1, "key"
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.string_kind == "key":
+                        self.key = json.loads(text[self.key_start:i + 1])
+                        self.expect = "colon"
+                    elif self.string_kind == "value":
+                        self._emit(out, text[self.value_start:i + 1])
+                continue
+
+            if c == '"':
+                self.in_string = True
+                self.string_kind = None
+                if self.depth == 1 and self.expect == "key":
+                    self.string_kind, self.key_start = "key", i
+                elif self.depth == 1 and self.expect == "value":
+                    self.string_kind, self.value_start, self.expect = "value", i, "in_value"
+            elif self.depth == 1 and self.expect == "colon" and c == ":":
+                self.expect = "value"
+            elif c in "{[":
+                if self.depth == 1 and self.expect == "value":
+                    self.value_start, self.expect, self.primitive = i, "in_value", False
+                self.depth += 1
+            elif c in "}]":
+                if self.depth == 1 and self.expect == "in_value" and self.primitive:
+                    self._emit(out, text[self.value_start:i])
+                self.depth -= 1
+                if self.depth == 1 and self.expect == "in_value" and not self.primitive:
+                    self._emit(out, text[self.value_start:i + 1])
+                elif self.depth == 0:
+                    self.done = True
+            elif self.depth == 1 and c == ",":
+                if self.expect == "in_value" and self.primitive:
+                    self._emit(out, text[self.value_start:i])
+                self.expect = "key"
+            elif self.depth == 1 and self.expect == "value" and not c.isspace():
+                self.value_start, self.expect, self.primitive = i, "in_value", True
+        return out
+
+    def _emit(self, out: list, raw: str):
+        self.expect, self.primitive = "comma", False
+        try:
+            out.append((self.key, json.loads(raw)))
+        except json.JSONDecodeError:
+            pass
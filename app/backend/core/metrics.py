@@ -0,0 +1,231 @@
+"""Prometheus metrics and per-request timing logs, without extra dependencies.
+
+- agents_request_seconds / agents_requests_in_flight: per route, from MetricsMiddleware
+- agents_stage_seconds: time spent in each stage (`span()`, plus the
+  Supabase HTTP hooks), labelled with the operation (endpoint, table...)
+- agents_llm_*: read from core.usage.usage_tracker at scrape time
+- agents_job_seconds / agents_jobs_running: background jobs by kind
+- agents_model_*: the model call scheduler (queue depth and wait by
+  priority, calls in flight, adaptive concurrency limit, 429/529 responses)
+
+Each request also logs one JSON line with its duration and the time spent
+per stage (spans that ran concurrently add up, so stages can exceed the
+total).
+"""
+from __future__ import annotations
+
+import json
+import time
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+from starlette.routing import Match
+
+from core.usage import USAGE_FIELDS, usage_tracker
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger("agents.timing")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Stage totals (ms) of the request being served; subtasks share the dict
+_request_stages: ContextVar[dict | None] = ContextVar("request_stages", default=None)
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    def quote(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{quote(v)}"' for n, v in zip(names, values))
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (non-cumulative) + overflow, sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            base = _labels(self.labels, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] += amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] -= amount
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{self.name}{{{_labels(self.labels, k)}}} {v:g}" for k, v in sorted(self._values.items())]
+        return lines
+
+
+class Counter(Gauge):
+    type = "counter"
+
+
+request_seconds = Histogram("agents_request_seconds", "HTTP request latency by route", ("method", "route", "status"))
+requests_in_flight = Gauge("agents_requests_in_flight", "HTTP requests being served by route", ("method", "route"))
+stage_seconds = Histogram("agents_stage_seconds", "Time spent per stage of the hot paths", ("stage", "op"))
+job_seconds = Histogram("agents_job_seconds", "Background job run time by kind and outcome", ("kind", "outcome"))
+jobs_running = Gauge("agents_jobs_running", "Background jobs being run by kind", ("kind",))
+model_queue_depth = Gauge("agents_model_queue_depth", "Model calls waiting for the scheduler by priority", ("priority",))
+model_wait_seconds = Histogram("agents_model_wait_seconds", "Time model calls waited in the scheduler by priority", ("priority",))
+model_calls = Gauge("agents_model_calls", "Model calls in flight and the adaptive concurrency limit", ("state",))
+model_throttled = Counter("agents_model_throttled_total", "Rate-limited (429) and overloaded (529) API responses", ("status",))
+
+
+def record_stage(stage: str, op: str, seconds: float):
+    stage_seconds.observe(seconds, stage, op)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def span(stage: str, op: str = ""):
+    """Time a block as `stage` (llm, image_download, smtp_send...). Errors are timed too."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, op, time.perf_counter() - start)
+
+
+def instrument_postgrest(http: httpx.AsyncClient):
+    """Time every Supabase REST call as db_read / db_write, by table or RPC."""
+    async def on_request(request: httpx.Request):
+        request.extensions["metrics_start"] = time.perf_counter()
+
+    async def on_response(response: httpx.Response):
+        request = response.request
+        start = request.extensions.get("metrics_start")
+        if start is None:
+            return
+        path = request.url.path.split("/rest/v1/", 1)[-1]
+        read = request.method in ("GET", "HEAD") or path.startswith("rpc/")
+        record_stage("db_read" if read else "db_write", path, time.perf_counter() - start)
+
+    http.event_hooks["request"].append(on_request)
+    http.event_hooks["response"].append(on_response)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: latency (until the last body chunk, so streams count
+    whole), in-flight gauge and the timing log line, per route."""
+
+    SKIP = ("/metrics", "/health")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.SKIP:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        status = 500
+        stages: dict[str, float] = {}
+        token = _request_stages.set(stages)
+        requests_in_flight.inc(method, route)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec(method, route)
+            request_seconds.observe(elapsed, method, route, str(status))
+            _request_stages.reset(token)
+            logger.info(json.dumps({
+                "event": "request_timing",
+                "method": method,
+                "route": route,
+                "status": status,
+                "ms": round(elapsed * 1000, 1),
+                "stages_ms": {k: round(v, 1) for k, v in sorted(stages.items())},
+            }))
+
+    @staticmethod
+    def _route(scope) -> str:
+        """Route template (/jobs/{job_id}), so labels don't grow with ids."""
+        for route in scope["app"].router.routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route.path
+        return "unmatched"
+
+
+def _llm_lines() -> list[str]:
+    tokens = "agents_llm_tokens_total"
+    calls = "agents_llm_calls_total"
+    lines = [
+        f"# HELP {calls} Model calls by endpoint and model",
+        f"# TYPE {calls} counter",
+    ]
+    token_lines = [
+        f"# HELP {tokens} Model tokens by endpoint, model and type (input, output, cache_creation_input, cache_read_input)",
+        f"# TYPE {tokens} counter",
+    ]
+    for (endpoint, model), totals in sorted(usage_tracker.totals.items()):
+        lines.append(f"{calls}{{{_labels(('endpoint', 'model'), (endpoint, model))}}} {totals['calls']}")
+        for field in USAGE_FIELDS:
+            kind = field.removesuffix("_tokens")
+            token_lines.append(f"{tokens}{{{_labels(('endpoint', 'model', 'type'), (endpoint, model, kind))}}} {totals[field]}")
+    return lines + token_lines
+
+
+def render() -> str:
+    lines = []
+    metrics = (
+        request_seconds, requests_in_flight, stage_seconds, job_seconds, jobs_running,
+        model_queue_depth, model_wait_seconds, model_calls, model_throttled,
+    )
+    for metric in metrics:
+        lines += metric.render()
+    lines += _llm_lines()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING
+
+from core.metrics import model_calls, model_queue_depth, model_throttled, model_wait_seconds, record_stage
+
+if TYPE_CHECKING:
+    import anthropic
+
+logger = logging.getLogger("agents.scheduler")
+
+# Organisation limits per minute (0 = not enforced here); see the API console for your tier
+MODEL_RPM = int(os.getenv("MODEL_RPM", "0"))
+MODEL_ITPM = int(os.getenv("MODEL_ITPM", "0"))
+MODEL_OTPM = int(os.getenv("MODEL_OTPM", "0"))
+# Model calls in flight: starts at the max, halves on 429/529, grows back on success
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "16"))
+MODEL_MIN_CONCURRENCY = int(os.getenv("MODEL_MIN_CONCURRENCY", "1"))
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "3"))
+# Backoff when the API gives no retry-after: base * 2^(attempt-1), with jitter
+MODEL_BACKOFF_S = float(os.getenv("MODEL_BACKOFF_S", "1"))
+MODEL_BACKOFF_MAX_S = float(os.getenv("MODEL_BACKOFF_MAX_S", "60"))
+
+INTERACTIVE = 0  # a clinician is waiting: summaries, clinical fill
+BULK = 1         # OCR pages
+PRIORITY_LABELS = ("interactive", "bulk")
+
+# Images are downscaled to OCR_MAX_EDGE (1568px), ~1600 tokens at most
+IMAGE_TOKENS = 1600
+
+
+def estimate_input_tokens(params: dict) -> int:
+    """Rough input tokens of a request before sending it: ~4 chars per token."""
+    chars, images = 0, 0
+    system = params.get("system") or []
+    blocks = [{"type": "text", "text": system}] if isinstance(system, str) else list(system)
+    for message in params.get("messages", []):
+        content = message["content"]
+        blocks.extend([{"type": "text", "text": content}] if isinstance(content, str) else content)
+    for block in blocks:
+        if block.get("type") == "image":
+            images += 1
+        else:
+            chars += len(block.get("text", ""))
+    if params.get("tools"):
+        chars += len(json.dumps(params["tools"], ensure_ascii=False))
+    return chars // 4 + images * IMAGE_TOKENS
+
+
+def retry_after(exc: anthropic.APIStatusError) -> float | None:
+    """Seconds the API asked us to wait (retry-after-ms / retry-after), if any."""
+    headers = exc.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# An error event in the middle of a stream arrives on a 200 response; its
+# type says which status the API would have answered with
+ERROR_TYPE_STATUS = {"rate_limit_error": 429, "overloaded_error": 529, "api_error": 500}
+
+
+def status_of(exc: anthropic.APIStatusError) -> int:
+    error = exc.body.get("error") if isinstance(exc.body, dict) else None
+    if exc.status_code < 400 and isinstance(error, dict):
+        return ERROR_TYPE_STATUS.get(error.get("type"), exc.status_code)
+    return exc.status_code
+
+
+def classify(exc: BaseException) -> str | None:
+    """"throttled" for 429/529, "retry" for other transient failures, else None."""
+    import anthropic  # loaded with the client that made the call
+
+    if isinstance(exc, anthropic.APIStatusError):
+        status = status_of(exc)
+        if status in (429, 529):
+            return "throttled"
+        if status in (408, 409) or status >= 500:
+            return "retry"
+        return None
+    # Includes APITimeoutError
+    if isinstance(exc, anthropic.APIConnectionError):
+        return "retry"
+    return None
+
+
+class TokenBucket:
+    """Refills `per_minute` continuously up to one minute's worth. The level can
+    go negative when a call used more than was reserved for it."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, n: float) -> float:
+        """Seconds until `n` can be taken (a call bigger than the bucket waits for a full one)."""
+        self._refill()
+        need = min(n, self.capacity)
+        return 0.0 if self.level >= need else (need - self.level) / self.rate
+
+    def take(self, n: float):
+        self._refill()
+        self.level = min(self.capacity, self.level - n)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class ModelScheduler:
+    """Single gate for every Anthropic call of the process.
+
+    Calls wait in a priority queue (interactive before bulk, FIFO within a
+    priority) until there is a concurrency slot and, when MODEL_RPM/ITPM/OTPM
+    are set, room in the per-minute token buckets. Input tokens are reserved
+    from an estimate and corrected with the real usage; output tokens are
+    charged afterwards.
+
+    A 429/529 pauses all calls for the retry-after the API sent (or an
+    exponential backoff) and halves the concurrency limit, which then grows
+    back by ~1 per limit's worth of successful calls. The call that got it is
+    retried (keeping its place in line) up to MODEL_MAX_RETRIES times, as are
+    5xx and connection errors, so the SDK client is created with max_retries=0.
+    """
+
+    def __init__(
+        self,
+        rpm: int = MODEL_RPM,
+        itpm: int = MODEL_ITPM,
+        otpm: int = MODEL_OTPM,
+        max_concurrency: int = MODEL_MAX_CONCURRENCY,
+        min_concurrency: int = MODEL_MIN_CONCURRENCY,
+        max_retries: int = MODEL_MAX_RETRIES,
+    ):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.input_tokens = TokenBucket(itpm) if itpm else None
+        self.output_tokens = TokenBucket(otpm) if otpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.paused_until = 0.0
+        self._queue: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self.counts = dict.fromkeys(("calls", "retries", "throttled", "failed"), 0)
+        self._update_gauges()
+
+    def _buckets(self, tokens: int):
+        return ((self.requests, 1), (self.input_tokens, tokens), (self.output_tokens, 0))
+
+    def _delay(self, tokens: int) -> float:
+        now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        return max((bucket.wait(n) for bucket, n in self._buckets(tokens) if bucket is not None), default=0.0)
+
+    def _dispatch(self):
+        """Start queued calls in priority order while there is capacity."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            waiter = self._queue[0]
+            if waiter.future.done():
+                heapq.heappop(self._queue)  # cancelled while waiting
+                continue
+            if self.active >= int(self.limit):
+                break
+            delay = self._delay(waiter.tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                break
+            heapq.heappop(self._queue)
+            self.active += 1
+            for bucket, n in self._buckets(waiter.tokens):
+                if bucket is not None:
+                    bucket.take(n)
+            waiter.future.set_result(None)
+        self._update_gauges()
+
+    async def _acquire(self, priority: int, seq: int, tokens: int):
+        label = PRIORITY_LABELS[priority]
+        waiter = _Waiter(priority, seq, tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        model_queue_depth.inc(label)
+        start = time.monotonic()
+        try:
+            self._dispatch()
+            await waiter.future
+        except asyncio.CancelledError:
+            if not waiter.future.cancelled():
+                # Got the slot just as we were cancelled: hand it on
+                self._release(tokens)
+            raise
+        finally:
+            model_queue_depth.dec(label)
+        waited = time.monotonic() - start
+        model_wait_seconds.observe(waited, label)
+        record_stage("model_wait", label, waited)
+
+    def _release(self, tokens: int, message=None, pause: float | None = None):
+        self.active -= 1
+        if pause is not None:
+            now = time.monotonic()
+            # Responses already in flight when the first 429 arrived don't halve it again
+            if now >= self.paused_until:
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+            self.paused_until = max(self.paused_until, now + pause)
+        if message is not None:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            usage = message.usage
+            if self.input_tokens is not None:
+                # Cache reads don't count toward the input tokens limit
+                used = (usage.input_tokens or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+                self.input_tokens.take(used - tokens)
+            if self.output_tokens is not None:
+                self.output_tokens.take(usage.output_tokens or 0)
+        elif self.input_tokens is not None:
+            # Failed before using anything we can measure: give the reservation back
+            self.input_tokens.take(-tokens)
+        self._dispatch()
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(MODEL_BACKOFF_MAX_S, MODEL_BACKOFF_S * 2 ** (attempt - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _failed(self, exc: BaseException, attempt: int, tokens: int, retryable: bool = True) -> bool:
+        """Release the slot of a failed call; True if it should be tried again."""
+        kind = classify(exc)
+        retry = retryable and kind is not None and attempt <= self.max_retries
+        if kind == "throttled":
+            status = status_of(exc)
+            self.counts["throttled"] += 1
+            model_throttled.inc(str(status))
+            pause = retry_after(exc)
+            pause = self.backoff(attempt) if pause is None else pause
+            self._release(tokens, pause=pause)
+            logger.warning(
+                "Model API returned %s; pausing model calls %.1fs, concurrency limit %.1f",
+                status, pause, self.limit,
+            )
+        else:
+            self._release(tokens)
+            if retry:
+                await asyncio.sleep(self.backoff(attempt))
+        if retry:
+            self.counts["retries"] += 1
+        elif kind is not None:
+            self.counts["failed"] += 1
+        return retry
+
+    async def create(self, client: anthropic.AsyncAnthropic, priority: int, **params):
+        """`client.messages.create(**params)` through the scheduler."""
+        tokens = estimate_input_tokens(params)
+        # Retries keep their place in line
+        seq = next(self._seq)
+        attempt = 0
+        while True:
+            await self._acquire(priority, seq, tokens)
+            self.counts["calls"] += 1
+            try:
+                message = await client.messages.create(**params)
+            except BaseException as exc:
+                attempt += 1
+                if await self._failed(exc, attempt, tokens):
+                    continue
+                raise
+            self._release(tokens, message)
+            return message
+
+    @asynccontextmanager
+    async def stream(self, client: anthropic.AsyncAnthropic, priority: int, **params):
+        """`client.messages.stream(**params)` through the scheduler. Retries
+        happen only while opening the stream, never after events were read,
+        but a 429/529 in the middle of the stream still pauses and halves the
+        concurrency limit."""
+        tokens = estimate_input_tokens(params)
+        seq = next(self._seq)
+        attempt = 0
+        while True:
+            await self._acquire(priority, seq, tokens)
+            self.counts["calls"] += 1
+            manager = client.messages.stream(**params)
+            try:
+                stream = await manager.__aenter__()
+                break
+            except BaseException as exc:
+                attempt += 1
+                if await self._failed(exc, attempt, tokens):
+                    continue
+                raise
+        try:
+            try:
+                yield stream
+                message = await stream.get_final_message()
+            finally:
+                await manager.__aexit__(None, None, None)
+        except BaseException as exc:
+            await self._failed(exc, attempt + 1, tokens, retryable=False)
+            raise
+        self._release(tokens, message)
+
+    def _update_gauges(self):
+        model_calls.set(self.active, "in_flight")
+        model_calls.set(self.limit, "limit")
+
+    def stats(self) -> dict:
+        queued = [0] * len(PRIORITY_LABELS)
+        for waiter in self._queue:
+            if not waiter.future.done():
+                queued[waiter.priority] += 1
+        return {
+            "in_flight": self.active,
+            "limit": round(self.limit, 2),
+            "queued": dict(zip(PRIORITY_LABELS, queued)),
+            "paused_s": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            **self.counts,
+        }
+
+
+model_scheduler = ModelScheduler()
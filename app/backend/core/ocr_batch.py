@@ -0,0 +1,99 @@
+import os
+import re
+import base64
+from dataclasses import dataclass
+from functools import cached_property
+
+from core.image_prep import image_tokens
+
+# Adaptive batch limits: a batch closes when any of them would be exceeded
+OCR_BATCH_MAX_PAGES = int(os.getenv("OCR_BATCH_MAX_PAGES", "5"))
+OCR_BATCH_MAX_IMAGE_TOKENS = int(os.getenv("OCR_BATCH_MAX_IMAGE_TOKENS", "8000"))
+OCR_BATCH_MAX_BYTES = int(os.getenv("OCR_BATCH_MAX_BYTES", str(15 * 1024 * 1024)))
+# Output budget per page; the batch gets n times this, capped
+OCR_PAGE_MAX_TOKENS = 4096
+OCR_BATCH_MAX_OUTPUT_TOKENS = 16384
+
+PAGE_MARKER = "=== PÁGINA {n} ==="
+_MARKER_RE = re.compile(r"^=== PÁGINA (\d+) ===[ \t]*$", re.MULTILINE)
+
+BATCH_INSTRUCTIONS = (
+    "Recibiste {n} imágenes, cada una precedida por su marcador de página. "
+    "Para CADA imagen, en orden, escribe primero su marcador exactamente igual "
+    "(por ejemplo `=== PÁGINA 1 ===`) en una línea propia y luego el texto extraído de esa imagen."
+)
+
+
+@dataclass
+class Page:
+    """One upload on its way through the OCR pipeline."""
+    upload_id: str
+    key: str
+    image: bytes = b""
+    content_type: str = "image/jpeg"
+    # Set when the OCR text came from the cache
+    text: str | None = None
+
+    @cached_property
+    def tokens(self) -> int:
+        # Decodes the image header, so only once per page
+        return image_tokens(self.image)
+
+
+def plan_batches(pages: list[Page]) -> list[list[Page]]:
+    """Greedily pack pages, in order, into batches within the page/token/byte limits."""
+    batches: list[list[Page]] = []
+    current: list[Page] = []
+    tokens = size = 0
+    for page in pages:
+        page_tokens, page_size = page.tokens, len(page.image) * 4 // 3
+        if current and (
+            len(current) >= OCR_BATCH_MAX_PAGES
+            or tokens + page_tokens > OCR_BATCH_MAX_IMAGE_TOKENS
+            or size + page_size > OCR_BATCH_MAX_BYTES
+        ):
+            batches.append(current)
+            current, tokens, size = [], 0, 0
+        current.append(page)
+        tokens += page_tokens
+        size += page_size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def batch_max_tokens(batch: list[Page]) -> int:
+    return min(OCR_PAGE_MAX_TOKENS * len(batch), OCR_BATCH_MAX_OUTPUT_TOKENS)
+
+
+def build_batch_content(batch: list[Page], prompt: str) -> list[dict]:
+    """Message content: marker + image per page, then the shared instructions once."""
+    content = []
+    for n, page in enumerate(batch, 1):
+        content.append({"type": "text", "text": PAGE_MARKER.format(n=n)})
+        content.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": page.content_type,
+                "data": base64.standard_b64encode(page.image).decode("utf-8"),
+            },
+        })
+    content.append({"type": "text", "text": f"{prompt}\n\n{BATCH_INSTRUCTIONS.format(n=len(batch))}"})
+    return content
+
+
+def split_batch_response(text: str, batch: list[Page]) -> dict[str, str]:
+    """Map the model's delimited answer back to upload ids.
+
+    Pages whose marker is missing are left out so the caller can retry them alone.
+    """
+    matches = list(_MARKER_RE.finditer(text))
+    texts = {}
+    for i, match in enumerate(matches):
+        n = int(match.group(1))
+        if not 1 <= n <= len(batch):
+            continue
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        texts[batch[n - 1].upload_id] = text[match.end():end].strip()
+    return texts
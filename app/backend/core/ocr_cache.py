@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import os
+import hashlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
+
+
+# Max total characters of OCR text kept in memory
+OCR_CACHE_MAX_CHARS = int(os.getenv("OCR_CACHE_MAX_CHARS", str(20_000_000)))
+# Persist entries in the ocr_cache table so they survive restarts/instances
+OCR_CACHE_SUPABASE = os.getenv("OCR_CACHE_SUPABASE", "0") == "1"
+
+
+def cache_key(image: bytes, prompt: str, model: str, *variant: str) -> str:
+    """Content address of an OCR result: image bytes + prompt + model (+ variant tags)."""
+    h = hashlib.sha256()
+    for part in (model, prompt, *variant):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    h.update(image)
+    return h.hexdigest()
+
+
+class OCRCache:
+    """LRU cache of OCR texts, bounded by total characters, with optional Supabase backing."""
+
+    def __init__(self, max_chars: int = OCR_CACHE_MAX_CHARS, persist: bool = OCR_CACHE_SUPABASE):
+        self.max_chars = max_chars
+        self.persist = persist
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._chars = 0
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _store(self, key: str, text: str):
+        if key in self._entries:
+            self._chars -= len(self._entries.pop(key))
+        self._entries[key] = text
+        self._chars += len(text)
+        while self._chars > self.max_chars and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._chars -= len(evicted)
+            self.evictions += 1
+
+    async def get(self, key: str, sb: AsyncClient | None = None) -> str | None:
+        text = self._entries.get(key)
+        if text is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+        if self.persist and sb is not None:
+            try:
+                res = await sb.table("ocr_cache").select("ocr_text").eq("key", key).limit(1).execute()
+            except Exception:
+                res = None
+            if res and res.data:
+                text = res.data[0]["ocr_text"]
+                self._store(key, text)
+                self.persistent_hits += 1
+                return text
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, text: str, model: str, sb: AsyncClient | None = None):
+        self._store(key, text)
+        if self.persist and sb is not None:
+            try:
+                await sb.table("ocr_cache").upsert({"key": key, "ocr_text": text, "model": model}).execute()
+            except Exception:
+                # The in-memory entry is enough to serve this instance
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "chars": self._chars,
+            "max_chars": self.max_chars,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.persistent_hits) / lookups, 3) if lookups else 0.0,
+            "persistent": self.persist,
+        }
+
+
+ocr_cache = OCRCache()
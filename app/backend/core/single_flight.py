@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+from collections import defaultdict
+from typing import AsyncIterator, Awaitable, Callable
+
+
+def fingerprint(*parts) -> str:
+    """Short stable hash of the inputs that determine a result."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class _Replay:
+    """Items produced so far by a shared stream, replayed to every subscriber."""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Condition()
+        # The loop only keeps weak references to tasks: this one must outlive its subscribers
+        self.pump: asyncio.Task | None = None
+
+
+class SingleFlight:
+    """Collapse concurrent identical calls into one in-flight computation.
+
+    Keys are tuples whose first element names the endpoint, e.g.
+    ("summary_sessions", patient_id, fingerprint(prompt)). The computation runs
+    in its own task, so a caller that disconnects doesn't cancel it for the
+    others, and a retry arriving meanwhile joins it instead of starting over.
+    """
+
+    def __init__(self):
+        self._calls: dict[tuple, asyncio.Task] = {}
+        self._streams: dict[tuple, _Replay] = {}
+        self.counts = defaultdict(lambda: {"calls": 0, "collapsed": 0})
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable]):
+        counts = self.counts[key[0]]
+        counts["calls"] += 1
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            counts["collapsed"] += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: tuple, task: asyncio.Task):
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here even if every caller went away
+
+    async def stream(self, key: tuple, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Like `do` for async generators: late joiners first get the items
+        already produced, then follow the live stream."""
+        counts = self.counts[key[0]]
+        counts["calls"] += 1
+        replay = self._streams.get(key)
+        if replay is None:
+            replay = _Replay()
+            self._streams[key] = replay
+            replay.pump = asyncio.create_task(self._pump(key, factory(), replay))
+        else:
+            counts["collapsed"] += 1
+
+        i = 0
+        while True:
+            async with replay.changed:
+                await replay.changed.wait_for(lambda: replay.done or len(replay.items) > i)
+            while i < len(replay.items):
+                yield replay.items[i]
+                i += 1
+            if replay.done and i == len(replay.items):
+                if replay.error is not None:
+                    raise replay.error
+                return
+
+    async def _pump(self, key: tuple, source: AsyncIterator, replay: _Replay):
+        try:
+            async for item in source:
+                async with replay.changed:
+                    replay.items.append(item)
+                    replay.changed.notify_all()
+        except Exception as e:
+            replay.error = e
+        finally:
+            self._streams.pop(key, None)
+            async with replay.changed:
+                replay.done = True
+                replay.changed.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            name: {**c, "in_flight": sum(1 for k in (*self._calls, *self._streams) if k[0] == name)}
+            for name, c in self.counts.items()
+        }
+
+
+single_flight = SingleFlight()
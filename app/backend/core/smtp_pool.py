@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from email.message import Message
+from typing import TYPE_CHECKING
+
+from core.metrics import span
+
+if TYPE_CHECKING:
+    import aiosmtplib
+
+logger = logging.getLogger("agents.smtp")
+
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", "30"))
+# Idle connections older than this get a NOOP before being reused
+SMTP_CHECK_AFTER_S = float(os.getenv("SMTP_CHECK_AFTER_S", "10"))
+# Providers cap messages per connection (Gmail ~100); reconnect before that
+SMTP_MAX_MESSAGES = int(os.getenv("SMTP_MAX_MESSAGES", "90"))
+
+
+@dataclass
+class _Connection:
+    smtp: aiosmtplib.SMTP
+    messages: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class SMTPPool:
+    """Up to `size` persistent SMTP connections (STARTTLS + login done once each).
+
+    Connections open lazily and are reused LIFO, so a burst keeps the warm
+    ones warm. A connection idle for more than `check_after_s` is checked
+    with NOOP before reuse; a dead one is replaced, and a send that finds
+    the server gone is retried once on a fresh connection.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: str | None = None,
+        password: str | None = None,
+        start_tls: bool = True,
+        size: int = SMTP_POOL_SIZE,
+        timeout: float = SMTP_TIMEOUT_S,
+        check_after_s: float = SMTP_CHECK_AFTER_S,
+        max_messages: int = SMTP_MAX_MESSAGES,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.size = size
+        self.timeout = timeout
+        self.check_after_s = check_after_s
+        self.max_messages = max_messages
+        self._idle: list[_Connection] = []
+        self._slots = asyncio.Semaphore(size)
+        self.counts = dict.fromkeys(("connects", "reconnects", "health_checks", "failed_checks", "sent", "errors"), 0)
+
+    @classmethod
+    def from_env(cls) -> "SMTPPool | None":
+        """Pool for the SMTP_* settings, or None if there are no credentials."""
+        username = os.getenv("SMTP_USER", "")
+        password = os.getenv("SMTP_PASSWORD", "")
+        if not username or not password:
+            return None
+        return cls(
+            hostname=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+            port=int(os.getenv("SMTP_PORT", "587")),
+            username=username,
+            password=password,
+            start_tls=os.getenv("SMTP_START_TLS", "1") == "1",
+        )
+
+    async def _connect(self) -> _Connection:
+        # Imported with the first connection, not at startup
+        import aiosmtplib
+
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username or None,
+            password=self.password or None,
+            start_tls=self.start_tls,
+            timeout=self.timeout,
+        )
+        await smtp.connect()
+        self.counts["connects"] += 1
+        return _Connection(smtp)
+
+    @staticmethod
+    async def _discard(conn: _Connection):
+        try:
+            await conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    async def _healthy(self, conn: _Connection) -> bool:
+        import aiosmtplib
+
+        if not conn.smtp.is_connected or conn.messages >= self.max_messages:
+            return False
+        if time.monotonic() - conn.last_used < self.check_after_s:
+            return True
+        self.counts["health_checks"] += 1
+        try:
+            await conn.smtp.noop()
+            return True
+        except (aiosmtplib.SMTPException, OSError):
+            self.counts["failed_checks"] += 1
+            return False
+
+    async def _checkout(self) -> _Connection:
+        while self._idle:
+            conn = self._idle.pop()
+            if await self._healthy(conn):
+                return conn
+            await self._discard(conn)
+        return await self._connect()
+
+    async def send(self, message: Message):
+        with span("smtp_send", "email"):
+            await self._send(message)
+
+    async def _send(self, message: Message):
+        import aiosmtplib
+
+        async with self._slots:
+            try:
+                conn = await self._checkout()
+            except Exception:
+                self.counts["errors"] += 1
+                raise
+            try:
+                try:
+                    await conn.smtp.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # Dropped since the last check (server idle timeout): once more on a fresh one
+                    logger.info("SMTP connection lost, reconnecting")
+                    self.counts["reconnects"] += 1
+                    conn.smtp.close()
+                    conn = await self._connect()
+                    await conn.smtp.send_message(message)
+                self.counts["sent"] += 1
+            except Exception:
+                self.counts["errors"] += 1
+                raise
+            finally:
+                conn.messages += 1
+                conn.last_used = time.monotonic()
+                # aiosmtplib resets the envelope after a refused recipient: still usable
+                if conn.smtp.is_connected:
+                    self._idle.append(conn)
+
+    async def warm(self):
+        """Open (and log in) one connection ahead of the first send."""
+        async with self._slots:
+            self._idle.append(await self._connect())
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(self._discard(conn) for conn in idle))
+
+    def stats(self) -> dict:
+        return {"size": self.size, "idle": len(self._idle), **self.counts}
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
+
+
+# Max summaries kept in memory and how long one stays valid
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "500"))
+SUMMARY_CACHE_TTL_S = int(os.getenv("SUMMARY_CACHE_TTL_S", str(7 * 24 * 3600)))
+# Persist entries in the summary_cache table so they survive restarts and are
+# shared with other processes (e.g. the pre-warm worker)
+SUMMARY_CACHE_SUPABASE = os.getenv("SUMMARY_CACHE_SUPABASE", "0") == "1"
+
+
+class SummaryCache:
+    """LRU cache of prep summaries per (patient_id, next_session_date).
+
+    Each entry remembers the fingerprint of the rows it was generated from;
+    a lookup with a different fingerprint (a session was edited, added or
+    deleted) is a miss and drops the entry.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SUMMARY_CACHE_MAX_ENTRIES,
+        ttl_s: int = SUMMARY_CACHE_TTL_S,
+        persist: bool = SUMMARY_CACHE_SUPABASE,
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.persist = persist
+        # (patient_id, next_session_date) -> (fingerprint, summary, created_at epoch)
+        self._entries: OrderedDict[tuple[str, str], tuple[str, str, float]] = OrderedDict()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _store(self, key: tuple[str, str], fp: str, summary: str, created_at: float):
+        self._entries.pop(key, None)
+        self._entries[key] = (fp, summary, created_at)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl_s
+
+    async def get(self, patient_id: str, next_date: str | None, fp: str, sb: AsyncClient | None = None) -> str | None:
+        key = (patient_id, next_date or "")
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_fp, summary, created_at = entry
+            if stored_fp == fp and self._fresh(created_at):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return summary
+            del self._entries[key]
+            self.invalidations += 1
+
+        if self.persist and sb is not None:
+            try:
+                res = await (
+                    sb.table("summary_cache")
+                    .select("summary, created_at")
+                    .eq("patient_id", patient_id)
+                    .eq("next_session_date", key[1])
+                    .eq("fingerprint", fp)
+                    .limit(1)
+                    .execute()
+                )
+            except Exception:
+                res = None
+            if res and res.data:
+                row = res.data[0]
+                created_at = datetime.fromisoformat(row["created_at"]).timestamp()
+                if self._fresh(created_at):
+                    self._store(key, fp, row["summary"], created_at)
+                    self.persistent_hits += 1
+                    return row["summary"]
+
+        self.misses += 1
+        return None
+
+    async def put(self, patient_id: str, next_date: str | None, fp: str, summary: str, model: str, sb: AsyncClient | None = None):
+        key = (patient_id, next_date or "")
+        now = time.time()
+        self._store(key, fp, summary, now)
+        if self.persist and sb is not None:
+            try:
+                await sb.table("summary_cache").upsert({
+                    "patient_id": patient_id,
+                    "next_session_date": key[1],
+                    "fingerprint": fp,
+                    "summary": summary,
+                    "model": model,
+                    "created_at": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+                }).execute()
+            except Exception:
+                # The in-memory entry is enough to serve this instance
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.persistent_hits) / lookups, 3) if lookups else 0.0,
+            "persistent": self.persist,
+        }
+
+
+summary_cache = SummaryCache()
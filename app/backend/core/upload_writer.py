@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import os
+import asyncio
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
+
+
+# Rows per bulk write, and how long to wait for more pages before writing
+OCR_WRITE_BATCH = int(os.getenv("OCR_WRITE_BATCH", "10"))
+OCR_WRITE_DELAY = float(os.getenv("OCR_WRITE_DELAY", "0.5"))
+
+UPLOAD_NOT_FOUND = "Upload no encontrado"
+
+
+class UploadWriter:
+    """Write-behind buffer for OCR results.
+
+    Pages are added as soon as they are extracted and persisted to
+    session_uploads in bulk updates (the save_ocr_texts RPC) from a
+    background task, so database latency stays off the OCR path. Only rows
+    that still exist are updated: an upload deleted while its OCR ran stays
+    deleted and is reported as not found. `close()` flushes whatever is
+    left; call it in a `finally` so finished pages are saved even when a
+    later page fails or the request is cancelled.
+    """
+
+    def __init__(self, sb: AsyncClient, batch_size: int = OCR_WRITE_BATCH, delay: float = OCR_WRITE_DELAY):
+        self.sb = sb
+        self.batch_size = batch_size
+        self.delay = delay
+        # upload_id -> error for rows that could not be written
+        self.failed: dict[str, str] = {}
+        self.writes = 0
+        self._pending: dict[str, str] = {}
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def add(self, upload_id: str, ocr_text: str):
+        self._pending[upload_id] = ocr_text
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def _update(self, texts: dict[str, str]) -> set[str]:
+        """Write the texts; returns the ids of the rows that were updated."""
+        from postgrest.exceptions import APIError  # loaded with the Supabase client
+
+        try:
+            res = await self.sb.rpc("save_ocr_texts", {"p_ids": list(texts), "p_texts": list(texts.values())}).execute()
+            return set(res.data or [])
+        except APIError as e:
+            if e.code != "PGRST202":
+                raise
+        # RPC not deployed yet: one UPDATE per row, concurrently
+        results = await asyncio.gather(*(
+            self.sb.table("session_uploads").update({"ocr_text": text, "is_processed": True}).eq("id", upload_id).execute()
+            for upload_id, text in texts.items()
+        ))
+        return {upload_id for upload_id, res in zip(texts, results) if res.data}
+
+    async def flush(self):
+        async with self._lock:
+            texts = dict(self._pending)
+            self._pending.clear()
+            if not texts:
+                return
+            try:
+                updated = await self._update(texts)
+                self.writes += 1
+            except Exception as e:
+                for upload_id in texts:
+                    self.failed[upload_id] = f"Error al guardar texto: {e}"
+                return
+            for upload_id in texts.keys() - updated:
+                self.failed[upload_id] = UPLOAD_NOT_FOUND
+
+    async def close(self):
+        self._full.set()
+        if self._task is not None:
+            await asyncio.shield(self._task)
+        await self.flush()
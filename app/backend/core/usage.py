@@ -0,0 +1,33 @@
+import json
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger("agents.usage")
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+
+class UsageTracker:
+    """Running token totals per (endpoint, model)."""
+
+    def __init__(self):
+        self.totals: dict[tuple[str, str], dict[str, int]] = defaultdict(lambda: dict.fromkeys(("calls", *USAGE_FIELDS), 0))
+
+    def record(self, endpoint: str, model: str, message) -> dict[str, int]:
+        """Add the usage of an Anthropic response and log it as one JSON line."""
+        usage = {field: getattr(message.usage, field, None) or 0 for field in USAGE_FIELDS}
+        totals = self.totals[(endpoint, model)]
+        totals["calls"] += 1
+        for field, value in usage.items():
+            totals[field] += value
+        logger.info(json.dumps({"event": "llm_usage", "endpoint": endpoint, "model": model, **usage}))
+        return usage
+
+    def snapshot(self) -> list[dict]:
+        return [
+            {"endpoint": endpoint, "model": model, **totals}
+            for (endpoint, model), totals in sorted(self.totals.items())
+        ]
+
+
+usage_tracker = UsageTracker()
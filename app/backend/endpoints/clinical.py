@@ -1,133 +1,160 @@
+from __future__ import annotations
+
 import os
 import json
-import anthropic
-from fastapi import APIRouter, HTTPException
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Literal
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from supabase import create_client
 
-router = APIRouter()
+from core.clients import Clients, get_anthropic, get_supabase, require
+from core.clinical_schema import CLINICAL_TOOL_SCHEMA, SECTION_GROUPS, SECTIONS, SECTIONS_BY_KEY, repair_section, section_json
+from core.jobs import Job, job_queue
+from core.json_stream import TopLevelJSONParser
+from core.metrics import span
+from core.model_scheduler import INTERACTIVE, model_scheduler
+from core.single_flight import fingerprint, single_flight
+from core.usage import usage_tracker
 
+if TYPE_CHECKING:
+    import anthropic
+    from supabase import AsyncClient
 
-def get_supabase():
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    if not url or not key:
-        raise HTTPException(status_code=500, detail="Supabase no configurado")
-    return create_client(url, key)
+router = APIRouter()
+logger = logging.getLogger(__name__)
 
+CLINICAL_MODEL = "claude-sonnet-4-6"
 
-def get_anthropic():
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="ANTHROPIC_API_KEY no configurado")
-    return anthropic.Anthropic(api_key=api_key)
+# "single": one call fills every section. "parallel": section groups are
+# filled concurrently and merged (lower latency, notes are sent once per group).
+CLINICAL_FILL_MODE = os.getenv("CLINICAL_FILL_MODE", "single")
+CLINICAL_GROUP_RETRIES = int(os.getenv("CLINICAL_GROUP_RETRIES", "1"))
+CLINICAL_GROUP_MAX_TOKENS = 4096
+# Incremental: when the stored sections already cover some uploads, send only
+# the new/changed notes plus the current sections and merge what comes back.
+# Falls back to a full fill when that message would be the longer one.
+CLINICAL_FILL_INCREMENTAL = os.getenv("CLINICAL_FILL_INCREMENTAL", "1") == "1"
 
 
 class FillRequest(BaseModel):
     session_id: str
+    mode: Literal["single", "parallel"] = CLINICAL_FILL_MODE
+    incremental: bool = CLINICAL_FILL_INCREMENTAL
 
 
-CLINICAL_PROMPT = """Eres un asistente especializado en psicología clínica.
-A continuación encontrarás el texto extraído de notas escritas a mano durante una sesión terapéutica.
+TOOL_NAME = "guardar_historia_clinica"
 
-NOTAS DE SESIÓN:
-{ocr_text}
+# Static instructions + tool schema form a prefix the API caches across fills
+# (cache_control on the system block); only the session notes change per call.
+CLINICAL_PROMPT = """Eres un asistente especializado en psicología clínica.
+Recibirás el texto extraído de notas escritas a mano durante una sesión terapéutica.
 
-Basándote ÚNICAMENTE en la información presente en las notas, completa la siguiente estructura de historia clínica en formato JSON.
+Basándote ÚNICAMENTE en la información presente en las notas, completa la historia clínica.
 Si no hay información para un campo, usa null o array vacío según corresponda.
 NO inventes información que no esté en las notas.
 
-Devuelve ÚNICAMENTE el JSON válido, sin texto adicional:
-
-{{
-  "motivo_consulta": {{
-    "texto_paciente": null,
-    "inicio_evolucion": null,
-    "desencadenantes": null
-  }},
-  "historia_problema": {{
-    "sintomas": null,
-    "impacto_score": null,
-    "areas": [],
-    "estrategias": null,
-    "factores": null
-  }},
-  "tamizajes": {{
-    "phq_score": null,
-    "phq_items": null,
-    "otros": null
-  }},
-  "riesgo_seguridad": {{
-    "ideacion": null,
-    "frecuencia": null,
-    "plan": null,
-    "medios": null,
-    "intencion": null,
-    "protectores": null,
-    "acciones": []
-  }},
-  "antecedentes": {{
-    "salud_mental": null,
-    "salud_medica": null,
-    "sustancias": null,
-    "eventos": null
-  }},
-  "contexto_psicosocial": {{
-    "familia": null,
-    "relaciones": null,
-    "factores_contexto": null,
-    "recursos": null
-  }},
-  "observaciones_clinicas": {{
-    "apariencia": null,
-    "actitud": null,
-    "afecto": null,
-    "lenguaje": null,
-    "pensamiento": null,
-    "orientacion": null,
-    "insight": null
-  }},
-  "formulacion_clinica": {{
-    "patrones": null,
-    "creencias": null,
-    "ciclo": null,
-    "necesidades": null
-  }},
-  "objetivos": [],
-  "intervenciones": {{
-    "psicoeducacion": null,
-    "regulacion": null,
-    "patrones": null,
-    "limites": null,
-    "otros": null
-  }},
-  "plan": {{
-    "plan_semana": null,
-    "tarea": null,
-    "proxima_fecha": null,
-    "proxima_hora": null,
-    "proxima_foco": null
-  }},
-  "cierre_administrativo": {{
-    "pago_realizado": null,
-    "pago_metodo": null,
-    "reserva": null,
-    "consentimiento": null,
-    "observaciones": null
-  }}
-}}"""
+GUÍA DE CAMPOS:
+- motivo_consulta: el motivo con las palabras del paciente, cuándo inició y cómo ha evolucionado, y qué lo desencadena.
+- historia_problema: síntomas actuales; impacto_score es un número de 0 a 10 sobre cuánto afecta la vida diaria; areas es la lista de áreas afectadas (trabajo, pareja, familia, estudio, sueño...); estrategias que ya intentó; factores que lo agravan o alivian.
+- tamizajes: puntaje PHQ (número) y los ítems relevantes si aparecen; otros instrumentos aplicados en "otros".
+- riesgo_seguridad: ideación suicida o de autolesión, su frecuencia, si hay plan, acceso a medios e intención; factores protectores; acciones es la lista de acciones de seguridad acordadas. Registra solo lo que las notas digan explícitamente.
+- antecedentes: historia de salud mental (diagnósticos, terapias, medicación), salud médica, consumo de sustancias y eventos vitales significativos.
+- contexto_psicosocial: familia, relaciones significativas, factores del contexto (económicos, laborales, de identidad, discriminación) y recursos o redes de apoyo.
+- observaciones_clinicas: examen mental observado por la terapeuta (apariencia, actitud, afecto, lenguaje, pensamiento, orientación, insight).
+- formulacion_clinica: patrones relacionales o de pensamiento, creencias centrales, el ciclo que mantiene el problema y necesidades no satisfechas.
+- objetivos: lista de objetivos terapéuticos, uno por elemento.
+- intervenciones: lo que se trabajó en la sesión (psicoeducación, regulación emocional, trabajo con patrones, límites, otros).
+- plan: plan para la semana, tarea asignada, fecha (AAAA-MM-DD) y hora (HH:MM) de la próxima sesión y su foco.
+- cierre_administrativo: si se realizó el pago (sí/no), método de pago, reserva de la próxima cita, consentimiento informado y observaciones.
 
+Registra la historia clínica llamando a la herramienta `""" + TOOL_NAME + """`.
+Incluye SIEMPRE todas las secciones solicitadas, con null o [] donde no haya información.
+Si además recibes la HISTORIA CLÍNICA ACTUAL, las NOTAS NUEVAS la complementan: incluye solo
+las secciones que las notas nuevas modifican, cada una completa (lo que ya tenía más lo nuevo)."""
 
-@router.post("/fill")
-async def fill_clinical_history(request: FillRequest):
-    sb = get_supabase()
-    client = get_anthropic()
+CLINICAL_TOOL = {
+    "name": TOOL_NAME,
+    "description": "Guarda las secciones de la historia clínica extraídas de las notas de sesión.",
+    "input_schema": CLINICAL_TOOL_SCHEMA,
+}
+
+NOTES_TEMPLATE = """NOTAS DE SESIÓN:
+{ocr_text}"""
+
+INCREMENTAL_TEMPLATE = """HISTORIA CLÍNICA ACTUAL:
+{state}
+
+NOTAS NUEVAS:
+{ocr_text}"""
+
+GROUP_TEMPLATE = "Completa SOLO estas secciones: {keys}. Omite las demás."
+
+
+class FillStats:
+    """Counters to track how much model work each successful fill costs."""
 
-    # Get all OCR texts for the session
-    res = (
+    def __init__(self):
+        self.fills_ok = 0
+        self.fills_failed = 0
+        self.full_generations = 0
+        self.wasted_full_generations = 0
+        self.sections_repaired = 0
+        self.section_retries = 0
+        self.incremental_fills = 0
+        self.up_to_date_fills = 0
+        # Incremental fills sent as full fills because state + delta was larger
+        self.incremental_fallbacks = 0
+        # OCR chars actually sent vs. chars of every processed upload
+        self.notes_chars_sent = 0
+        self.notes_chars_total = 0
+
+    def snapshot(self) -> dict:
+        return {
+            **vars(self),
+            "wasted_full_generations_per_fill": round(self.wasted_full_generations / self.fills_ok, 3) if self.fills_ok else 0.0,
+            "section_retries_per_fill": round(self.section_retries / self.fills_ok, 3) if self.fills_ok else 0.0,
+        }
+
+
+fill_stats = FillStats()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def has_content(value) -> bool:
+    if isinstance(value, dict):
+        return any(v not in (None, "", []) for v in value.values())
+    return bool(value)
+
+
+@dataclass
+class FillInput:
+    notes: str             # user message sent to the model
+    sources: dict          # upload_id -> text hash covered once this fill is saved
+    state: dict | None     # stored sections the answer is merged into (incremental)
+    covered: dict | None = None  # fill_sources stored before this fill, if already read
+
+
+def join_notes(uploads: list[dict]) -> str:
+    return "\n\n---\n\n".join(
+        f"[Archivo: {u.get('file_name', 'sin nombre')}]\n{u['ocr_text']}"
+        for u in uploads
+    )
+
+
+async def load_fill_input(sb: AsyncClient, session_id: str, incremental: bool) -> FillInput:
+    """Notes to send: every processed upload, or in incremental mode only the
+    uploads not yet covered by the stored sections (`fill_sources`)."""
+    res = await (
         sb.table("session_uploads")
-        .select("ocr_text, file_name")
-        .eq("session_id", request.session_id)
+        .select("id, ocr_text, file_name")
+        .eq("session_id", session_id)
         .eq("is_processed", True)
         .execute()
     )
@@ -139,41 +166,358 @@ async def fill_clinical_history(request: FillRequest):
             detail="No hay texto extraído para esta sesión. Ejecuta primero el OCR."
         )
 
-    # Concatenate all OCR texts
-    combined_text = "\n\n---\n\n".join(
-        f"[Archivo: {u.get('file_name', 'sin nombre')}]\n{u['ocr_text']}"
-        for u in uploads
-        if u.get("ocr_text")
-    )
-
+    uploads = [u for u in uploads if u.get("ocr_text")]
+    combined_text = join_notes(uploads)
     if not combined_text.strip():
         raise HTTPException(status_code=400, detail="Los textos OCR están vacíos")
 
-    # Call Claude to fill the clinical history
-    message = client.messages.create(
-        model="claude-sonnet-4-6",
-        max_tokens=8192,
-        messages=[
-            {
-                "role": "user",
-                "content": CLINICAL_PROMPT.format(ocr_text=combined_text),
-            }
-        ],
-    )
+    sources = {u["id"]: text_hash(u["ocr_text"]) for u in uploads}
+    fill_stats.notes_chars_total += len(combined_text)
+    if incremental:
+        columns = ", ".join([s.key for s in SECTIONS] + ["fill_sources"])
+        row = (await sb.table("clinical_sessions").select(columns).eq("id", session_id).single().execute()).data or {}
+        covered = row.get("fill_sources") or {}
+        # A deleted or re-OCR'd upload may have left content behind in the
+        # stored sections, so only a pure addition of uploads is incremental
+        if covered and all(sources.get(upload_id) == h for upload_id, h in covered.items()):
+            state = {s.key: row[s.key] for s in SECTIONS if has_content(row.get(s.key))}
+            delta = join_notes([u for u in uploads if u["id"] not in covered])
+            notes = INCREMENTAL_TEMPLATE.format(
+                state=json.dumps(state, ensure_ascii=False, separators=(",", ":")),
+                ocr_text=delta,
+            ) if delta else ""
+            # The stored sections are resent with every delta: with few or short
+            # pages they outweigh the notes themselves, and a full fill is cheaper
+            if len(notes) < len(NOTES_TEMPLATE.format(ocr_text=combined_text)):
+                fill_stats.notes_chars_sent += len(delta)
+                return FillInput(notes, sources, state, covered)
+            fill_stats.incremental_fallbacks += 1
+
+    fill_stats.notes_chars_sent += len(combined_text)
+    return FillInput(NOTES_TEMPLATE.format(ocr_text=combined_text), sources, None, covered if incremental else None)
+
+
+async def stored_sources(sb: AsyncClient, session_id: str, fill: FillInput) -> dict:
+    """The fill_sources already saved: what an incomplete fill sends back, so
+    uploads whose sections never arrived are not marked as covered."""
+    if fill.covered is None:
+        row = (await sb.table("clinical_sessions").select("fill_sources").eq("id", session_id).single().execute()).data or {}
+        fill.covered = row.get("fill_sources") or {}
+    return fill.covered
 
-    response_text = message.content[0].text.strip()
 
-    # Strip markdown code block if present
+def parse_json_response(text: str) -> dict:
+    """json.loads a plain-text answer, tolerating a markdown code fence."""
+    response_text = text.strip()
     if response_text.startswith("```"):
         lines = response_text.split("\n")
         response_text = "\n".join(lines[1:-1])
+    return json.loads(response_text)
 
+
+def model_params(notes: str, max_tokens: int, keys: tuple[str, ...] | None = None) -> dict:
+    # The notes go last so everything before them is a stable, cacheable prefix
+    content = notes
+    if keys:
+        content = f"{content}\n\n{GROUP_TEMPLATE.format(keys=', '.join(keys))}"
+    return dict(
+        model=CLINICAL_MODEL,
+        max_tokens=max_tokens,
+        system=[{"type": "text", "text": CLINICAL_PROMPT, "cache_control": {"type": "ephemeral"}}],
+        tools=[CLINICAL_TOOL],
+        tool_choice={"type": "tool", "name": TOOL_NAME},
+        messages=[{"role": "user", "content": content}],
+    )
+
+
+def tool_input(message) -> dict:
+    for block in message.content:
+        if block.type == "tool_use":
+            return block.input if isinstance(block.input, dict) else {}
+    # Forced tool_choice should make this unreachable; accept a JSON answer anyway
     try:
-        clinical_data = json.loads(response_text)
-    except json.JSONDecodeError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Claude devolvió JSON inválido: {e}\nRespuesta: {response_text[:500]}"
-        )
+        data = parse_json_response(message.content[0].text)
+    except (IndexError, AttributeError, json.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def call_model(client: anthropic.AsyncAnthropic, notes: str, max_tokens: int, keys: tuple[str, ...] | None = None) -> dict:
+    with span("llm", "clinical_fill"):
+        message = await model_scheduler.create(client, INTERACTIVE, **model_params(notes, max_tokens, keys))
+    usage_tracker.record("clinical_fill", CLINICAL_MODEL, message)
+    with span("parse", "clinical_fill"):
+        return tool_input(message)
+
+
+def check_section(key: str, value) -> dict | list | None:
+    """Validated section, repaired locally if needed; None if unusable."""
+    if value is None:
+        return None
+    try:
+        return section_json(key, value)
+    except ValueError:
+        pass
+    try:
+        repaired = repair_section(key, value)
+    except ValueError:
+        return None
+    fill_stats.sections_repaired += 1
+    return repaired
+
+
+def validate_sections(data: dict, keys: tuple[str, ...], partial: bool = False) -> tuple[dict, tuple[str, ...]]:
+    """Split a tool answer into valid sections and the keys that need a retry.
+
+    With `partial` (incremental fills) an absent section means "unchanged".
+    """
+    if partial:
+        keys = tuple(k for k in keys if k in data)
+    valid = {}
+    with span("parse", "clinical_fill"):
+        for key in keys:
+            section = check_section(key, data.get(key))
+            if section is not None:
+                valid[key] = section
+    return valid, tuple(k for k in keys if k not in valid)
+
+
+async def fill_group(client: anthropic.AsyncAnthropic, notes: str, keys: tuple[str, ...]) -> dict:
+    """Fill only `keys`, retrying just the sections that come back invalid."""
+    import anthropic  # loaded with the client
+
+    fragment = {}
+    last_error = None
+    for attempt in range(1 + CLINICAL_GROUP_RETRIES):
+        if attempt:
+            fill_stats.section_retries += len(keys)
+        try:
+            data = await call_model(client, notes, CLINICAL_GROUP_MAX_TOKENS, keys)
+        except anthropic.APIError as e:
+            last_error = e
+            continue
+        valid, keys = validate_sections(data, keys)
+        fragment.update(valid)
+        if not keys:
+            return fragment
+        last_error = f"secciones inválidas: {', '.join(keys)}"
+    if not fragment:
+        raise ValueError(f"grupo sin secciones válidas: {last_error}")
+    logger.warning("Clinical fill dropped %s", last_error)
+    return fragment
+
+
+def ordered(sections: dict) -> dict:
+    # Same key order as the schema; sections that never validated are left out
+    # so the editor keeps whatever it already had for them
+    return {s.key: sections[s.key] for s in SECTIONS if s.key in sections}
+
+
+async def retry_sections(client: anthropic.AsyncAnthropic, notes: str, keys: tuple[str, ...]) -> dict:
+    """Targeted one-section calls for what a full generation got wrong."""
+    fill_stats.section_retries += len(keys)
+    fragments = await asyncio.gather(
+        *(fill_group(client, notes, (key,)) for key in keys),
+        return_exceptions=True,
+    )
+    merged = {}
+    for fragment in fragments:
+        if isinstance(fragment, BaseException):
+            logger.warning("Clinical fill dropped %s", fragment)
+        else:
+            merged.update(fragment)
+    return merged
+
+
+async def generate_sections(client: anthropic.AsyncAnthropic, notes: str, partial: bool) -> tuple[dict, tuple[str, ...]]:
+    """One full generation plus targeted retries: the valid sections and the
+    keys dropped after retrying."""
+    all_keys = tuple(s.key for s in SECTIONS)
+    fill_stats.full_generations += 1
+    sections, invalid = validate_sections(await call_model(client, notes, 8192), all_keys, partial)
+    if not sections and not partial:
+        fill_stats.wasted_full_generations += 1
+    if invalid:
+        sections.update(await retry_sections(client, notes, invalid))
+    return sections, tuple(k for k in invalid if k not in sections)
+
+
+async def fill_single(client: anthropic.AsyncAnthropic, notes: str) -> dict:
+    sections, _ = await generate_sections(client, notes, partial=False)
+    return sections
+
+
+async def fill_parallel(client: anthropic.AsyncAnthropic, notes: str) -> dict:
+    """Fill each section group concurrently and merge into the single-call shape."""
+    fragments = await asyncio.gather(
+        *(fill_group(client, notes, keys) for keys in SECTION_GROUPS),
+        return_exceptions=True,
+    )
+    merged = {}
+    for fragment in fragments:
+        if isinstance(fragment, BaseException):
+            logger.warning("Parallel clinical fill dropped %s", fragment)
+        else:
+            merged.update(fragment)
+    return merged
+
+
+@router.post("/fill")
+async def fill_clinical_history(
+    request: FillRequest,
+    sb: AsyncClient = Depends(get_supabase),
+    client: anthropic.AsyncAnthropic = Depends(get_anthropic),
+):
+    fill = await load_fill_input(sb, request.session_id, request.incremental)
+    if fill.state is not None:
+        # The delta is small: one call, whatever the mode
+        sections, dropped = await single_flight.do(
+            flight_key("clinical_fill", request, fill),
+            lambda: generate_sections(client, fill.notes, partial=True),
+        ) if fill.notes else ({}, ())
+        count_incremental(fill)
+        fill_stats.fills_ok += 1
+        sources = await stored_sources(sb, request.session_id, fill) if dropped else fill.sources
+        return {**ordered({**fill.state, **sections}), "fill_sources": sources}
+
+    fill_all = fill_parallel if request.mode == "parallel" else fill_single
+    sections = await single_flight.do(flight_key("clinical_fill", request, fill), lambda: fill_all(client, fill.notes))
+
+    if not sections:
+        fill_stats.fills_failed += 1
+        raise HTTPException(status_code=500, detail="Claude no devolvió ninguna sección válida")
+    fill_stats.fills_ok += 1
+    # Uploads only count as covered once every section came back
+    complete = all(s.key in sections for s in SECTIONS)
+    sources = fill.sources if complete else await stored_sources(sb, request.session_id, fill)
+    return {**ordered(sections), "fill_sources": sources}
+
+
+@router.post("/fill/jobs", status_code=202, dependencies=[Depends(get_supabase), Depends(get_anthropic)])
+async def fill_clinical_history_job(request: FillRequest):
+    """Like /fill, run in the background: returns the job to poll at /jobs/{job_id}."""
+    job = await job_queue.submit("clinical_fill", request.model_dump())
+    return job.public()
+
+
+async def run_fill_job(job: Job, clients: Clients) -> dict:
+    return await fill_clinical_history(FillRequest(**job.payload), await require(clients, "supabase"), await require(clients, "anthropic"))
+
+
+job_queue.register("clinical_fill", run_fill_job)
+
+
+def flight_key(endpoint: str, request: FillRequest, fill: FillInput) -> tuple:
+    # Double-clicks and retries on an unchanged session share one generation
+    mode = "incremental" if fill.state is not None else request.mode
+    return endpoint, request.session_id, fingerprint(mode, fill.notes)
+
+
+def count_incremental(fill: FillInput):
+    fill_stats.incremental_fills += 1
+    if not fill.notes:
+        fill_stats.up_to_date_fills += 1
+
+
+async def stream_single(client: anthropic.AsyncAnthropic, notes: str, partial: bool = False):
+    """Yield (key, value) for each top-level section as soon as its JSON closes,
+    then the targeted retries of sections that came back invalid or missing
+    (only invalid ones when `partial`)."""
+    parser = TopLevelJSONParser()
+    sent, seen = set(), set()
+    fill_stats.full_generations += 1
+    with span("llm", "clinical_fill"):
+        async with model_scheduler.stream(client, INTERACTIVE, **model_params(notes, 8192)) as stream:
+            async for event in stream:
+                if event.type != "content_block_delta":
+                    continue
+                delta = event.delta
+                chunk = delta.partial_json if delta.type == "input_json_delta" else getattr(delta, "text", "")
+                for key, value in parser.feed(chunk):
+                    seen.add(key)
+                    section = check_section(key, value) if key in SECTIONS_BY_KEY else None
+                    if section is not None:
+                        sent.add(key)
+                        yield key, section
+            message = await stream.get_final_message()
+    usage_tracker.record("clinical_fill", CLINICAL_MODEL, message)
+
+    if not sent and not partial:
+        fill_stats.wasted_full_generations += 1
+    missing = tuple(s.key for s in SECTIONS if s.key not in sent and (s.key in seen or not partial))
+    if missing:
+        for key, value in (await retry_sections(client, notes, missing)).items():
+            yield key, value
+
+
+async def stream_parallel(client: anthropic.AsyncAnthropic, notes: str):
+    """Yield the sections of each group as that group finishes."""
+    for task in asyncio.as_completed([fill_group(client, notes, keys) for keys in SECTION_GROUPS]):
+        try:
+            fragment = await task
+        except ValueError as e:
+            logger.warning("Parallel clinical fill dropped %s", e)
+            continue
+        for key, value in fragment.items():
+            yield key, value
+
+
+@router.post("/fill/stream")
+async def fill_clinical_history_stream(
+    request: FillRequest,
+    sb: AsyncClient = Depends(get_supabase),
+    client: anthropic.AsyncAnthropic = Depends(get_anthropic),
+):
+    """NDJSON stream: one `section` line per completed top-level section, then
+    `done` with the sections that never arrived (e.g. a cut-off generation)
+    and the `fill_sources` to save alongside them: the new coverage if the
+    fill is complete, the stored one otherwise.
+
+    Incremental fills only stream the sections the new notes changed.
+    """
+    fill = await load_fill_input(sb, request.session_id, request.incremental)
+    key = flight_key("clinical_fill_stream", request, fill)
+    if fill.state is not None:
+        count_incremental(fill)
+        sections = single_flight.stream(key, lambda: stream_single(client, fill.notes, partial=True)) if fill.notes else None
+    elif request.mode == "parallel":
+        sections = single_flight.stream(key, lambda: stream_parallel(client, fill.notes))
+    else:
+        sections = single_flight.stream(key, lambda: stream_single(client, fill.notes))
+
+    async def events():
+        import anthropic  # loaded with the client
+
+        # Incremental: sections the new notes leave out keep their stored value
+        received = set(SECTIONS_BY_KEY) if fill.state is not None else set()
+        errored = False
+        try:
+            if sections is not None:
+                async for key, value in sections:
+                    received.add(key)
+                    yield json.dumps({"type": "section", "key": key, "value": value}, ensure_ascii=False) + "\n"
+        except anthropic.APIError as e:
+            # Sections already sent stay usable; report why the rest is missing
+            errored = True
+            yield json.dumps({"type": "error", "detail": f"Error del modelo: {e}"}, ensure_ascii=False) + "\n"
+        if received:
+            fill_stats.fills_ok += 1
+        else:
+            fill_stats.fills_failed += 1
+        missing = [s.key for s in SECTIONS if s.key not in received]
+        complete = not errored and not missing
+        yield json.dumps({
+            "type": "done",
+            "complete": complete,
+            "missing": missing,
+            "incremental": fill.state is not None,
+            "up_to_date": fill.state is not None and not fill.notes,
+            "fill_sources": fill.sources if complete else await stored_sources(sb, request.session_id, fill),
+        }) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 
-    return clinical_data
+@router.get("/stats")
+def clinical_stats():
+    return fill_stats.snapshot()
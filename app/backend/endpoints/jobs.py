@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+
+from core.jobs import Job, job_queue
+
+router = APIRouter()
+
+
+async def get_job(job_id: str) -> Job:
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@router.get("/stats")
+async def jobs_stats():
+    return await job_queue.stats()
+
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    return (await get_job(job_id)).public()
+
+
+@router.get("/{job_id}/result")
+async def job_result(job_id: str):
+    """The endpoint's response once the job succeeded; 202 with the status
+    while it is pending, or the job's error once it has failed for good."""
+    job = await get_job(job_id)
+    if job.status == "succeeded":
+        return job.result
+    if job.status == "failed":
+        raise HTTPException(status_code=job.error_code or 500, detail=job.error)
+    return JSONResponse(job.public(), status_code=202)
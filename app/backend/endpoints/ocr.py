@@ -1,106 +1,359 @@
+from __future__ import annotations
+
 import os
+import json
+import asyncio
 import base64
-import httpx
-import anthropic
-from fastapi import APIRouter, HTTPException
+import logging
+from typing import TYPE_CHECKING, Awaitable, Callable
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from supabase import create_client
 
-router = APIRouter()
+from core.clients import Clients, get_anthropic, get_http, get_supabase, require
+from core.image_prep import PREPROCESS_VERSION, preprocess_image, stream_download
+from core.ocr_batch import Page, batch_max_tokens, build_batch_content, plan_batches, split_batch_response
+from core.jobs import Job, RetryJob, job_queue
+from core.metrics import span
+from core.model_scheduler import BULK, model_scheduler
+from core.ocr_cache import cache_key, ocr_cache
+from core.upload_writer import UPLOAD_NOT_FOUND, UploadWriter
+from core.usage import usage_tracker
 
+if TYPE_CHECKING:
+    import httpx
+    import anthropic
+    from supabase import AsyncClient
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
 
-def get_supabase():
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    if not url or not key:
-        raise HTTPException(status_code=500, detail="Supabase no configurado")
-    return create_client(url, key)
+OCR_MODEL = "claude-sonnet-4-6"
 
+# Max uploads downloaded + OCR'd at the same time per request
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "4"))
+# Default for OCRRequest.batched: pack several pages into one vision call
+OCR_BATCHED = os.getenv("OCR_BATCHED", "0") == "1"
 
-def get_anthropic():
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="ANTHROPIC_API_KEY no configurado")
-    return anthropic.Anthropic(api_key=api_key)
+OCR_PROMPT = (
+    "Extrae todo el texto escrito en esta imagen de notas clínicas psicológicas. "
+    "Preserva la estructura, listas, puntuación y saltos de línea tal como aparecen. "
+    "Si hay palabras ilegibles, indícalo con [ilegible]. "
+    "Devuelve únicamente el texto extraído, sin comentarios adicionales."
+)
 
 
 class OCRRequest(BaseModel):
     session_id: str
     upload_ids: list[str]
+    batched: bool = OCR_BATCHED
+
+
+class OCRStreamRequest(OCRRequest):
+    # Also emit the text of each page as the model generates it
+    stream_tokens: bool = False
 
 
 class OCRResult(BaseModel):
     upload_id: str
     ocr_text: str
+    error: str | None = None
 
 
 class OCRResponse(BaseModel):
     results: list[OCRResult]
 
 
-@router.post("/extract", response_model=OCRResponse)
-async def extract_text(request: OCRRequest):
-    sb = get_supabase()
-    client = get_anthropic()
+async def download_image(http: httpx.AsyncClient, file_url: str) -> tuple[bytes, str]:
+    """Download an image and return (raw bytes, media type)."""
+    try:
+        with span("image_download", "ocr_extract"):
+            return await stream_download(http, file_url)
+    except Exception as e:
+        raise ValueError(f"Error al descargar imagen: {e}") from e
+
+
+OnDelta = Callable[[str], Awaitable[None]]
+
+
+async def ocr_image(
+    client: anthropic.AsyncAnthropic,
+    image: bytes,
+    content_type: str,
+    on_delta: OnDelta | None = None,
+) -> str:
+    with span("base64", "ocr_extract"):
+        image_data = base64.standard_b64encode(image).decode("utf-8")
+    params = dict(
+        model=OCR_MODEL,
+        max_tokens=4096,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": content_type,
+                            "data": image_data,
+                        },
+                    },
+                    {"type": "text", "text": OCR_PROMPT},
+                ],
+            }
+        ],
+    )
+    with span("llm", "ocr_extract"):
+        if on_delta is None:
+            message = await model_scheduler.create(client, BULK, **params)
+        else:
+            async with model_scheduler.stream(client, BULK, **params) as stream:
+                async for text in stream.text_stream:
+                    await on_delta(text)
+                message = await stream.get_final_message()
+    usage_tracker.record("ocr_extract", OCR_MODEL, message)
+    return message.content[0].text
+
+
+async def ocr_batch(client: anthropic.AsyncAnthropic, batch: list[Page]) -> dict[str, str]:
+    """OCR several pages in one vision call; returns the texts it could split back."""
+    with span("base64", "ocr_extract"):
+        content = build_batch_content(batch, OCR_PROMPT)
+    with span("llm", "ocr_extract"):
+        message = await model_scheduler.create(
+            client,
+            BULK,
+            model=OCR_MODEL,
+            max_tokens=batch_max_tokens(batch),
+            messages=[{"role": "user", "content": content}],
+        )
+    usage_tracker.record("ocr_extract", OCR_MODEL, message)
+    return split_batch_response(message.content[0].text, batch)
+
+
+async def load_page(upload_id: str, upload: dict, sb: AsyncClient, http: httpx.AsyncClient) -> Page:
+    """Download an upload and resolve it from the cache, or preprocess it for OCR."""
+    image, content_type = await download_image(http, upload["file_url"])
+    key = cache_key(image, OCR_PROMPT, OCR_MODEL, PREPROCESS_VERSION)
+    text = await ocr_cache.get(key, sb)
+    if text is not None:
+        return Page(upload_id, key, text=text)
+    with span("image_preprocess", "ocr_extract"):
+        image, content_type = await asyncio.to_thread(preprocess_image, image, content_type)
+    return Page(upload_id, key, image, content_type)
+
+
+async def save_page(page: Page, ocr_text: str, sb: AsyncClient, writer: UploadWriter) -> OCRResult:
+    """Queue the text for the bulk write-back and remember it in the cache."""
+    writer.add(page.upload_id, ocr_text)
+    if page.text is None:
+        await ocr_cache.put(page.key, ocr_text, OCR_MODEL, sb)
+    return OCRResult(upload_id=page.upload_id, ocr_text=ocr_text)
+
+
+def mark_unsaved(results: list[OCRResult], writer: UploadWriter) -> list[OCRResult]:
+    return [
+        r.model_copy(update={"error": writer.failed[r.upload_id]}) if r.upload_id in writer.failed else r
+        for r in results
+    ]
+
+
+async def process_upload(
+    upload: dict | None,
+    upload_id: str,
+    sb: AsyncClient,
+    client: anthropic.AsyncAnthropic,
+    http: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    writer: UploadWriter,
+    on_delta: OnDelta | None = None,
+) -> OCRResult:
+    """Download, OCR and queue one upload for saving. Errors are reported per upload."""
+    if upload is None:
+        return OCRResult(upload_id=upload_id, ocr_text="", error=UPLOAD_NOT_FOUND)
+
+    try:
+        async with semaphore:
+            page = await load_page(upload_id, upload, sb, http)
+            ocr_text = page.text
+            if ocr_text is None:
+                ocr_text = await ocr_image(client, page.image, page.content_type, on_delta)
+        return await save_page(page, ocr_text, sb, writer)
+    except Exception as e:
+        return OCRResult(upload_id=upload_id, ocr_text="", error=str(e))
 
-    # Fetch uploads
-    res = sb.table("session_uploads").select("*").in_("id", request.upload_ids).execute()
-    uploads = res.data
-    if not uploads:
-        raise HTTPException(status_code=404, detail="No se encontraron uploads")
 
-    results = []
+async def process_batched(
+    uploads: dict[str, dict],
+    upload_ids: list[str],
+    sb: AsyncClient,
+    client: anthropic.AsyncAnthropic,
+    http: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    writer: UploadWriter,
+) -> list[OCRResult]:
+    """Like process_upload for every id, but uncached pages share vision calls."""
+    results: dict[str, OCRResult] = {}
 
-    async with httpx.AsyncClient(timeout=60.0) as http:
-        for upload in uploads:
-            file_url = upload["file_url"]
+    async def load(upload_id: str) -> Page | None:
+        if upload_id not in uploads:
+            results[upload_id] = OCRResult(upload_id=upload_id, ocr_text="", error=UPLOAD_NOT_FOUND)
+            return None
+        try:
+            async with semaphore:
+                return await load_page(upload_id, uploads[upload_id], sb, http)
+        except Exception as e:
+            results[upload_id] = OCRResult(upload_id=upload_id, ocr_text="", error=str(e))
+            return None
 
-            # Download image
+    pages = [p for p in await asyncio.gather(*(load(u) for u in upload_ids)) if p is not None]
+    texts = {p.upload_id: p.text for p in pages if p.text is not None}
+
+    async def run_batch(batch: list[Page]):
+        try:
+            async with semaphore:
+                texts.update(await ocr_batch(client, batch))
+        except Exception:
+            logger.warning("OCR batch call failed, retrying its %d pages one by one", len(batch), exc_info=True)
+        # Pages the batch call lost (error or missing marker) are retried alone
+        for page in batch:
+            if page.upload_id in texts:
+                continue
             try:
-                resp = await http.get(file_url)
-                resp.raise_for_status()
-                image_data = base64.standard_b64encode(resp.content).decode("utf-8")
-                content_type = resp.headers.get("content-type", "image/jpeg")
+                async with semaphore:
+                    texts[page.upload_id] = await ocr_image(client, page.image, page.content_type)
             except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Error al descargar imagen: {e}")
+                results[page.upload_id] = OCRResult(upload_id=page.upload_id, ocr_text="", error=str(e))
 
-            # OCR via Claude Vision
-            message = client.messages.create(
-                model="claude-sonnet-4-6",
-                max_tokens=4096,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": content_type,
-                                    "data": image_data,
-                                },
-                            },
-                            {
-                                "type": "text",
-                                "text": (
-                                    "Extrae todo el texto escrito en esta imagen de notas clínicas psicológicas. "
-                                    "Preserva la estructura, listas, puntuación y saltos de línea tal como aparecen. "
-                                    "Si hay palabras ilegibles, indícalo con [ilegible]. "
-                                    "Devuelve únicamente el texto extraído, sin comentarios adicionales."
-                                ),
-                            },
-                        ],
-                    }
-                ],
-            )
+    await asyncio.gather(*(run_batch(b) for b in plan_batches([p for p in pages if p.text is None])))
+
+    async def save(page: Page):
+        try:
+            results[page.upload_id] = await save_page(page, texts[page.upload_id], sb, writer)
+        except Exception as e:
+            results[page.upload_id] = OCRResult(upload_id=page.upload_id, ocr_text="", error=str(e))
 
-            ocr_text = message.content[0].text
+    await asyncio.gather(*(save(p) for p in pages if p.upload_id in texts))
+    return [results[u] for u in upload_ids]
 
-            # Update in DB
-            sb.table("session_uploads").update(
-                {"ocr_text": ocr_text, "is_processed": True}
-            ).eq("id", upload["id"]).execute()
 
-            results.append(OCRResult(upload_id=upload["id"], ocr_text=ocr_text))
+async def fetch_uploads(sb: AsyncClient, upload_ids: list[str]) -> dict[str, dict]:
+    res = await sb.table("session_uploads").select("*").in_("id", upload_ids).execute()
+    uploads = {u["id"]: u for u in res.data}
+    if not uploads:
+        raise HTTPException(status_code=404, detail="No se encontraron uploads")
+    return uploads
+
+
+@router.post("/extract", response_model=OCRResponse)
+async def extract_text(
+    request: OCRRequest,
+    sb: AsyncClient = Depends(get_supabase),
+    client: anthropic.AsyncAnthropic = Depends(get_anthropic),
+    http: httpx.AsyncClient = Depends(get_http),
+):
+    uploads = await fetch_uploads(sb, request.upload_ids)
+
+    # Download + OCR concurrently; results keep the request order.
+    # Texts are written back in bulk while the remaining pages are processed.
+    semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+    writer = UploadWriter(sb)
+    try:
+        if request.batched:
+            results = await process_batched(uploads, request.upload_ids, sb, client, http, semaphore, writer)
+        else:
+            results = await asyncio.gather(*(
+                process_upload(uploads.get(upload_id), upload_id, sb, client, http, semaphore, writer)
+                for upload_id in request.upload_ids
+            ))
+    finally:
+        await writer.close()
+    results = mark_unsaved(results, writer)
+
+    # Nothing succeeded: surface the first error like a single-image failure
+    if all(r.error for r in results):
+        raise HTTPException(status_code=400, detail=results[0].error)
 
     return OCRResponse(results=results)
+
+
+@router.post("/extract/stream")
+async def extract_text_stream(
+    request: OCRStreamRequest,
+    sb: AsyncClient = Depends(get_supabase),
+    client: anthropic.AsyncAnthropic = Depends(get_anthropic),
+    http: httpx.AsyncClient = Depends(get_http),
+):
+    """NDJSON stream: one `result` line per upload as soon as it finishes,
+    optional `delta` lines with partial text, and a final `done` line."""
+    uploads = await fetch_uploads(sb, request.upload_ids)
+    semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+    writer = UploadWriter(sb)
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+
+    async def run(index: int, upload_id: str):
+        on_delta = None
+        if request.stream_tokens:
+            async def on_delta(text: str):
+                await queue.put({"type": "delta", "index": index, "upload_id": upload_id, "text": text})
+
+        result = await process_upload(uploads.get(upload_id), upload_id, sb, client, http, semaphore, writer, on_delta)
+        await queue.put({"type": "result", "index": index, **result.model_dump()})
+
+    async def events():
+        tasks = [asyncio.create_task(run(i, upload_id)) for i, upload_id in enumerate(request.upload_ids)]
+        pending, failed = len(tasks), 0
+        try:
+            while pending:
+                event = await queue.get()
+                if event["type"] == "result":
+                    pending -= 1
+                    failed += bool(event["error"])
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            await writer.close()
+            yield json.dumps({
+                "type": "done",
+                "total": len(tasks),
+                "failed": failed,
+                "unsaved": [{"upload_id": k, "error": v} for k, v in writer.failed.items()],
+            }, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away: stop pages that are still in flight, keep the finished ones
+            for task in tasks:
+                task.cancel()
+            await writer.close()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@router.post("/extract/jobs", status_code=202, dependencies=[Depends(get_supabase), Depends(get_anthropic)])
+async def extract_text_job(request: OCRRequest):
+    """Like /extract, run in the background: returns the job to poll at /jobs/{job_id}."""
+    job = await job_queue.submit("ocr_extract", request.model_dump())
+    return job.public()
+
+
+async def run_extract_job(job: Job, clients: Clients) -> dict:
+    try:
+        response = await extract_text(
+            OCRRequest(**job.payload), await require(clients, "supabase"), await require(clients, "anthropic"), await clients.get("http"),
+        )
+    except HTTPException as e:
+        # 400: every page failed, possibly for a passing reason (rate limit, download)
+        if e.status_code == 400 and not job.final_attempt:
+            raise RetryJob(e.detail) from e
+        raise
+    failed = [r for r in response.results if r.error and r.error != UPLOAD_NOT_FOUND]
+    if failed and not job.final_attempt:
+        # Pages that worked are saved and cached, so the next attempt only redoes these
+        raise RetryJob(f"{len(failed)} página(s) con error: {failed[0].error}")
+    return response.model_dump()
+
+
+job_queue.register("ocr_extract", run_extract_job)
+
+
+@router.get("/cache/stats")
+def cache_stats():
+    return ocr_cache.stats()
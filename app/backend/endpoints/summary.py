@@ -1,71 +1,112 @@
-import os
-import json
-import anthropic
-from fastapi import APIRouter, HTTPException
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from supabase import create_client
 
-router = APIRouter()
+from core.clients import get_anthropic, get_supabase
+from core.history import ROLLUP_BLOCK, HistoryBuilder, plan_history, session_digest, session_heading
+from core.metrics import span
+from core.model_scheduler import INTERACTIVE, model_scheduler
+from core.single_flight import fingerprint, single_flight
+from core.summary_cache import summary_cache
+from core.usage import usage_tracker
 
+if TYPE_CHECKING:
+    import anthropic
+    from supabase import AsyncClient
 
-def get_supabase():
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    if not url or not key:
-        raise HTTPException(status_code=500, detail="Supabase no configurado")
-    return create_client(url, key)
+router = APIRouter()
+logger = logging.getLogger(__name__)
 
+SUMMARY_MODEL = "claude-sonnet-4-6"
+# Most recent sessions shown as digests; older ones go through roll-ups
+SUMMARY_MAX_SESSIONS = 10
 
-def get_anthropic():
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="ANTHROPIC_API_KEY no configurado")
-    return anthropic.Anthropic(api_key=api_key)
+# Fallback projection when summary_context isn't deployed: only the fields the
+# digest uses, JSONB sections cut down to one key each
+PATIENT_FIELDS = "full_name, preferred_name, age, updated_at"
+SESSION_FIELDS = (
+    "id, session_number, session_date, updated_at, objetivos, "
+    "motivo:motivo_consulta->>texto_paciente, plan_semana:plan->>plan_semana, tarea:plan->>tarea, "
+    "patrones:formulacion_clinica->>patrones, intervenciones:intervenciones->>otros"
+)
 
 
 class SummaryRequest(BaseModel):
     patient_id: str
     next_session_date: str | None = None
+    # Skip the cache and regenerate
+    refresh: bool = False
 
 
 class SummaryResponse(BaseModel):
     summary: str
-
-
-@router.post("/sessions", response_model=SummaryResponse)
-async def generate_session_summary(request: SummaryRequest):
-    sb = get_supabase()
-    client = get_anthropic()
-
-    # Get patient info
-    patient_res = sb.table("patients").select("*").eq("id", request.patient_id).single().execute()
-    if not patient_res.data:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    patient = patient_res.data
-
-    # Get last 10 sessions (completed or saved)
-    sessions_res = (
+    cached: bool = False
+
+
+async def load_context(sb: AsyncClient, patient_id: str) -> tuple[dict | None, list[dict], list[dict]]:
+    """Patient, the sessions that count (saved ones, or any status if none is
+    saved) in chronological order with their digests, and the stored roll-ups.
+
+    One round trip through the summary_context RPC; falls back to projected
+    table selects of the last sessions (no roll-ups) if it isn't deployed yet.
+    """
+    from postgrest.exceptions import APIError  # loaded with the Supabase client
+
+    try:
+        res = await sb.rpc("summary_context", {
+            "p_patient_id": patient_id,
+            "p_limit": SUMMARY_MAX_SESSIONS,
+            "p_block": ROLLUP_BLOCK,
+        }).execute()
+        context = res.data or {}
+        return context.get("patient"), context.get("sessions") or [], context.get("rollups") or []
+    except APIError as e:
+        logger.warning("summary_context RPC unavailable, using table selects: %s", e)
+
+    patient_res = await sb.table("patients").select(PATIENT_FIELDS).eq("id", patient_id).single().execute()
+    sessions_res = await (
         sb.table("clinical_sessions")
-        .select("*")
-        .eq("patient_id", request.patient_id)
+        .select(SESSION_FIELDS)
+        .eq("patient_id", patient_id)
         .neq("status", "draft")
         .order("session_date", desc=True)
-        .limit(10)
+        .limit(SUMMARY_MAX_SESSIONS)
         .execute()
     )
     sessions = sessions_res.data
-
     if not sessions:
         # Try with any status
-        sessions_res = (
+        sessions_res = await (
             sb.table("clinical_sessions")
-            .select("*")
-            .eq("patient_id", request.patient_id)
+            .select(SESSION_FIELDS)
+            .eq("patient_id", patient_id)
             .order("session_date", desc=True)
-            .limit(10)
+            .limit(SUMMARY_MAX_SESSIONS)
             .execute()
         )
         sessions = sessions_res.data
+    sessions = [{**s, "digest": session_digest(s)} for s in reversed(sessions)]
+    return patient_res.data, sessions, []
+
+
+@router.post("/sessions", response_model=SummaryResponse)
+async def generate_session_summary(
+    request: SummaryRequest,
+    sb: AsyncClient = Depends(get_supabase),
+    client: anthropic.AsyncAnthropic = Depends(get_anthropic),
+):
+    return await build_summary(sb, client, request)
+
+
+async def build_summary(sb: AsyncClient, client: anthropic.AsyncAnthropic, request: SummaryRequest) -> SummaryResponse:
+    """Cached or freshly generated prep summary; shared by the endpoint and prewarm.py."""
+    patient, sessions, stored_rollups = await load_context(sb, request.patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
     if not sessions:
         raise HTTPException(
@@ -73,42 +114,40 @@ async def generate_session_summary(request: SummaryRequest):
             detail="No hay sesiones previas para este paciente"
         )
 
-    # Build sessions summary for the prompt
+    # Any edit bumps updated_at (trigger), so the cached summary no longer matches
+    fp = fingerprint(
+        SUMMARY_MODEL,
+        patient.get("updated_at"),
+        [(s["id"], s.get("updated_at")) for s in sessions],
+    )
+    if not request.refresh:
+        cached = await summary_cache.get(request.patient_id, request.next_session_date, fp, sb)
+        if cached is not None:
+            return SummaryResponse(summary=cached, cached=True)
+
+    # Older history: stored roll-ups, (re)generated only where sessions changed
+    rollups, recent = plan_history(sessions, SUMMARY_MAX_SESSIONS)
+    history = HistoryBuilder(sb, client, request.patient_id, stored_rollups)
+    texts = await asyncio.gather(*(history.text(r) for r in rollups), return_exceptions=True)
+    earlier_text = ""
+    for rollup, text in zip(rollups, texts):
+        if isinstance(text, BaseException):
+            logger.warning("Roll-up %s omitted: %s", rollup.label, text)
+            continue
+        earlier_text += f"\n{rollup.label}\n{text}\n"
+
+    # Recent sessions: their stored digests
+    digests = await history.digests(recent)
+    offset = len(sessions) - len(recent)
     sessions_text = ""
-    for i, session in enumerate(reversed(sessions), 1):
-        sessions_text += f"\n--- SESIÓN {session.get('session_number', i)} ({session.get('session_date', 'fecha desconocida')}) ---\n"
-
-        if session.get("motivo_consulta"):
-            mc = session["motivo_consulta"]
-            if isinstance(mc, str):
-                mc = json.loads(mc)
-            sessions_text += f"Motivo: {mc.get('texto_paciente', '')}\n"
-
-        if session.get("objetivos"):
-            objetivos = session["objetivos"]
-            if objetivos:
-                sessions_text += f"Objetivos: {', '.join(objetivos)}\n"
-
-        if session.get("plan"):
-            plan = session["plan"]
-            if isinstance(plan, str):
-                plan = json.loads(plan)
-            sessions_text += f"Plan: {plan.get('plan_semana', '')} | Tarea: {plan.get('tarea', '')}\n"
-
-        if session.get("formulacion_clinica"):
-            fc = session["formulacion_clinica"]
-            if isinstance(fc, str):
-                fc = json.loads(fc)
-            sessions_text += f"Patrones: {fc.get('patrones', '')}\n"
-
-        if session.get("intervenciones"):
-            interv = session["intervenciones"]
-            if isinstance(interv, str):
-                interv = json.loads(interv)
-            otros = interv.get("otros", "")
-            if otros:
-                sessions_text += f"Intervenciones: {otros}\n"
+    for i, session in enumerate(recent, offset + 1):
+        sessions_text += f"\n{session_heading(session, i)}\n"
+        if digests.get(session["id"]):
+            sessions_text += f"{digests[session['id']]}\n"
 
+    earlier_block = (
+        f"RESUMEN DE SESIONES ANTERIORES (de más antiguas a más recientes):\n{earlier_text}\n" if earlier_text else ""
+    )
     next_date_text = f"La próxima sesión está programada para: {request.next_session_date}" if request.next_session_date else ""
 
     prompt = f"""Eres un asistente de preparación para sesiones de psicología clínica.
@@ -116,7 +155,7 @@ async def generate_session_summary(request: SummaryRequest):
 PACIENTE: {patient.get('preferred_name') or patient.get('full_name')} ({patient.get('age', '')} años)
 {next_date_text}
 
-HISTORIAL DE SESIONES (de más antigua a más reciente):
+{earlier_block}HISTORIAL DE SESIONES (de más antigua a más reciente):
 {sessions_text}
 
 Genera un resumen de preparación para la próxima sesión que incluya:
@@ -129,10 +168,25 @@ Genera un resumen de preparación para la próxima sesión que incluya:
 
 Sé específico y basado en la información proporcionada. Usa un tono clínico pero accesible."""
 
-    message = client.messages.create(
-        model="claude-sonnet-4-6",
-        max_tokens=2048,
-        messages=[{"role": "user", "content": prompt}],
-    )
-
-    return SummaryResponse(summary=message.content[0].text)
+    async def summarize() -> str:
+        with span("llm", "summary_sessions"):
+            message = await model_scheduler.create(
+                client,
+                INTERACTIVE,
+                model=SUMMARY_MODEL,
+                max_tokens=2048,
+                messages=[{"role": "user", "content": prompt}],
+            )
+        usage_tracker.record("summary_sessions", SUMMARY_MODEL, message)
+        summary = message.content[0].text
+        await summary_cache.put(request.patient_id, request.next_session_date, fp, summary, SUMMARY_MODEL, sb)
+        return summary
+
+    # Identical concurrent requests (same patient, same history) share one generation
+    key = ("summary_sessions", request.patient_id, fingerprint(prompt))
+    return SummaryResponse(summary=await single_flight.do(key, summarize))
+
+
+@router.get("/cache/stats")
+def summary_cache_stats():
+    return summary_cache.stats()
@@ -1,12 +1,18 @@
 import os
-from dotenv import load_dotenv
+
+# First: loads .env and sets up logging before the modules below read their settings
+import core.bootstrap  # noqa: F401
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from endpoints import ocr, clinical, summary, email
-
-load_dotenv()
+from fastapi.responses import PlainTextResponse
+from core import metrics
+from core.clients import lifespan
+from core.model_scheduler import model_scheduler
+from core.single_flight import single_flight
+from core.usage import usage_tracker
+from endpoints import ocr, clinical, summary, email, jobs
 
-app = FastAPI(title="Tu Lugar Seguro - Agentes IA")
+app = FastAPI(title="Tu Lugar Seguro - Agentes IA", lifespan=lifespan)
 
 frontend_url = os.getenv("FRONTEND_URL", "http://localhost:8081")
 
@@ -17,13 +23,34 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(ocr.router, prefix="/ocr", tags=["OCR"])
 app.include_router(clinical.router, prefix="/clinical", tags=["Clinical"])
 app.include_router(summary.router, prefix="/summary", tags=["Summary"])
 app.include_router(email.router, prefix="/email", tags=["Email"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
 
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+
+@app.get("/usage")
+def usage():
+    """Token totals (incl. prompt-cache reads/writes) per endpoint and model since startup,
+    how many calls were collapsed into an identical in-flight one, and the model
+    call scheduler's queue, concurrency limit and 429/529 counts."""
+    return {
+        "usage": usage_tracker.snapshot(),
+        "single_flight": single_flight.stats(),
+        "scheduler": model_scheduler.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text format: request latency and in-flight gauges per route,
+    time per stage (model, DB, image download, SMTP...), tokens and jobs."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
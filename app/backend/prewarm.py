@@ -0,0 +1,132 @@
+"""Pre-generates the preparation summaries of patients with an appointment in the coming days.
+
+Reads the (pending/confirmed) appointments from `appointments`, matches the patient by
+email and stores each summary in summary_cache, so /summary/sessions serves it at once.
+The API must run with SUMMARY_CACHE_SUPABASE=1 to read what this process leaves.
+
+Usage (e.g. from cron, every afternoon):
+  python prewarm.py                       # tomorrow's appointments
+  python prewarm.py --date 2026-10-20 --days 3 --concurrency 2
+  python prewarm.py --dry-run             # only list who it would generate for
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from datetime import date, timedelta
+
+# First, as in main.py: loads .env and sets up logging
+import core.bootstrap  # noqa: F401
+from fastapi import HTTPException
+from supabase import AsyncClient
+from core.clients import Clients
+from core.summary_cache import summary_cache
+from endpoints.summary import SummaryRequest, build_summary
+
+logger = logging.getLogger("prewarm")
+
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "3"))
+
+
+async def upcoming_patients(sb: AsyncClient, start: date, days: int) -> tuple[list[dict], list[dict]]:
+    """(patients with an appointment in [start, start + days), appointments with no matching patient)."""
+    res = await (
+        sb.table("appointments")
+        .select("appointment_date, start_time, client_name, client_email")
+        .gte("appointment_date", start.isoformat())
+        .lt("appointment_date", (start + timedelta(days=days)).isoformat())
+        .in_("status", ["pending", "confirmed"])
+        .order("appointment_date")
+        .order("start_time")
+        .execute()
+    )
+    appointments = res.data
+    if not appointments:
+        return [], []
+
+    # Emails are typed by hand on both sides: match case-insensitively in Python
+    # (one small query; PostgREST `in` is case-sensitive)
+    res = await (
+        sb.table("patients")
+        .select("id, full_name, email")
+        .eq("is_active", True)
+        .execute()
+    )
+    by_email = {p["email"].strip().lower(): p for p in res.data if p.get("email")}
+
+    patients, unmatched, seen = [], [], set()
+    for a in appointments:
+        patient = by_email.get((a.get("client_email") or "").strip().lower())
+        if patient is None:
+            unmatched.append(a)
+        elif patient["id"] not in seen:
+            # First upcoming appointment only: one summary per patient
+            seen.add(patient["id"])
+            patients.append({**patient, "appointment": a})
+    return patients, unmatched
+
+
+async def prewarm(sb, client, patients: list[dict], concurrency: int, refresh: bool) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    report = {"generated": 0, "cached": 0, "skipped": [], "failed": []}
+    done = 0
+
+    async def one(patient: dict):
+        nonlocal done
+        a = patient["appointment"]
+        label = f"{patient['full_name']} ({a['appointment_date']} {a['start_time'][:5]})"
+        async with semaphore:
+            try:
+                # Same cache key as the patient page, which doesn't send a date
+                result = await build_summary(sb, client, SummaryRequest(patient_id=patient["id"], refresh=refresh))
+                outcome = "cached" if result.cached else "generated"
+                report["cached" if result.cached else "generated"] += 1
+            except HTTPException as e:
+                outcome = f"skipped: {e.detail}"
+                report["skipped"].append({"patient_id": patient["id"], "reason": e.detail})
+            except Exception as e:
+                outcome = f"ERROR: {e}"
+                report["failed"].append({"patient_id": patient["id"], "error": str(e)})
+        done += 1
+        logger.info("[%d/%d] %s: %s", done, len(patients), label, outcome)
+
+    await asyncio.gather(*(one(p) for p in patients))
+    return report
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Pre-generate summaries for the upcoming appointments")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today() + timedelta(days=1))
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    parser.add_argument("--refresh", action="store_true", help="regenerate even if there is a current summary")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    clients = Clients()
+    await clients.open()
+    try:
+        if clients.supabase is None or (clients.anthropic is None and not args.dry_run):
+            logger.error("Missing SUPABASE_URL/SUPABASE_SERVICE_ROLE_KEY or ANTHROPIC_API_KEY")
+            return 2
+        # Persisting is the whole point: the API process reads from summary_cache
+        summary_cache.persist = True
+
+        patients, unmatched = await upcoming_patients(clients.supabase, args.date, args.days)
+        for a in unmatched:
+            logger.warning("Appointment without a registered patient: %s <%s> %s", a["client_name"], a["client_email"], a["appointment_date"])
+        logger.info("%d patient(s) with an appointment from %s (%d day(s))", len(patients), args.date, args.days)
+
+        report = {"from": args.date.isoformat(), "days": args.days, "patients": len(patients), "unmatched": len(unmatched)}
+        if not args.dry_run:
+            report.update(await prewarm(clients.supabase, clients.anthropic, patients, args.concurrency, args.refresh))
+        print(json.dumps(report, ensure_ascii=False))
+        return 1 if report.get("failed") else 0
+    finally:
+        await clients.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
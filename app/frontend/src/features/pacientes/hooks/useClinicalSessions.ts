@@ -24,6 +24,7 @@ export interface ClinicalSession {
   intervenciones: Record<string, unknown> | null;
   plan: Record<string, unknown> | null;
   cierre_administrativo: Record<string, unknown> | null;
+  fill_sources: Record<string, string> | null;
   created_at: string;
   updated_at: string;
 }
@@ -93,13 +93,14 @@ export default function AdminPacienteDetalle() {
     navigate(`/admin/sesiones/${newSession.id}`);
   }
 
-  async function handleSummary() {
+  async function handleSummary(refresh = false) {
     if (!id) return;
     setLoadingSummary(true);
     setSummaryOpen(true);
     setSummaryText("");
     try {
-      const data = await backendPost(`${BACKEND_URL}/summary/sessions`, { patient_id: id }, 90_000) as { summary: string };
+      // With no session changes the backend returns the stored summary at once
+      const data = await backendPost(`${BACKEND_URL}/summary/sessions`, { patient_id: id, refresh }, 90_000) as { summary: string };
       setSummaryText(data.summary);
     } catch (e: unknown) {
       toast.error(e instanceof Error ? e.message : "Error al generar resumen");
@@ -161,7 +162,7 @@ export default function AdminPacienteDetalle() {
             <p className="text-sm text-muted-foreground">Conocido/a como: {patient.preferred_name}</p>
           )}
         </div>
-        <Button variant="outline" onClick={handleSummary}>
+        <Button variant="outline" onClick={() => handleSummary()}>
           <Sparkles className="mr-2 h-4 w-4" />
           Resumen preparación
         </Button>
@@ -386,6 +387,10 @@ export default function AdminPacienteDetalle() {
             )}
           </div>
           <DialogFooter>
+            <Button variant="outline" disabled={loadingSummary} onClick={() => handleSummary(true)}>
+              <Sparkles className="h-4 w-4 mr-1.5" />
+              Regenerar
+            </Button>
             <Button variant="outline" onClick={() => setSummaryOpen(false)}>Cerrar</Button>
           </DialogFooter>
         </DialogContent>
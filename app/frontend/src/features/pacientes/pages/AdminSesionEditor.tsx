@@ -1,5 +1,6 @@
 import { useState, useCallback, useRef } from "react";
 import { useParams, useNavigate } from "react-router-dom";
+import { useQueryClient } from "@tanstack/react-query";
 import {
   ArrowLeft, Upload, Sparkles, Send, Save, X, Image, ChevronDown, ChevronRight,
 } from "lucide-react";
@@ -16,7 +17,7 @@ import {
   Dialog, DialogContent, DialogHeader, DialogTitle, DialogFooter,
 } from "@/shared/components/ui/dialog";
 import { useSession, useUpdateSession, useSessionUploads, useUploadSessionFile, useDeleteUpload } from "@/features/pacientes/hooks/useClinicalSessions";
-import { backendPost } from "@/shared/lib/backendFetch";
+import { backendPost, backendStream } from "@/shared/lib/backendFetch";
 import { usePatient } from "@/features/pacientes/hooks/usePatients";
 import { toast } from "sonner";
 
@@ -60,6 +61,7 @@ export default function AdminSesionEditor() {
   const updateSession = useUpdateSession();
   const uploadFile = useUploadSessionFile();
   const deleteUpload = useDeleteUpload();
+  const queryClient = useQueryClient();
 
   const { data: patient } = usePatient(session?.patient_id);
 
@@ -68,6 +70,7 @@ export default function AdminSesionEditor() {
   const [emailAddr, setEmailAddr] = useState("");
   const [sendingEmail, setSendingEmail] = useState(false);
   const [extractingOcr, setExtractingOcr] = useState(false);
+  const [ocrProgress, setOcrProgress] = useState<{ done: number; total: number } | null>(null);
   const [fillingAI, setFillingAI] = useState(false);
 
   // Local editable form — initialized from session when loaded
@@ -93,6 +96,7 @@ export default function AdminSesionEditor() {
       intervenciones: session.intervenciones || {},
       plan: session.plan || {},
       cierre_administrativo: session.cierre_administrativo || {},
+      fill_sources: session.fill_sources || {},
     });
     if (session.patient_id) {
       // Pre-fill email if patient has email
@@ -148,39 +152,73 @@ export default function AdminSesionEditor() {
       return;
     }
     setExtractingOcr(true);
+    setOcrProgress({ done: 0, total: uploads.length });
+    const errors: string[] = [];
     try {
-      await backendPost(`${BACKEND_URL}/ocr/extract`, {
+      // Each page arrives as soon as it's done; refetch the uploads to show the OCR badge
+      await backendStream(`${BACKEND_URL}/ocr/extract/stream`, {
         session_id: id,
         upload_ids: uploads.map((u) => u.id),
+      }, (event) => {
+        if (event.type !== "result") return;
+        if (event.error) errors.push(event.error as string);
+        setOcrProgress((p) => p && { ...p, done: p.done + 1 });
+        queryClient.invalidateQueries({ queryKey: ["uploads", id] });
       }, 120_000); // OCR puede tomar hasta 2 min con varias imágenes
-      toast.success("Texto extraído correctamente");
+      if (errors.length === uploads.length) {
+        toast.error(errors[0]);
+      } else if (errors.length > 0) {
+        toast.warning(`Texto extraído con ${errors.length} archivo(s) fallido(s): ${errors[0]}`);
+      } else {
+        toast.success("Texto extraído correctamente");
+      }
     } catch (e: unknown) {
       toast.error(e instanceof Error ? e.message : "Error al extraer texto");
     } finally {
       setExtractingOcr(false);
+      setOcrProgress(null);
     }
   }
 
   async function handleFillAI() {
     setFillingAI(true);
+    let received = 0;
+    let streamError: string | null = null;
+    let done: { incremental?: boolean; up_to_date?: boolean } = {};
     try {
-      const data = await backendPost(`${BACKEND_URL}/clinical/fill`, { session_id: id }, 90_000) as Record<string, unknown>;
-      setForm((prev) => ({
-        ...prev,
-        motivo_consulta: data.motivo_consulta || prev.motivo_consulta,
-        historia_problema: data.historia_problema || prev.historia_problema,
-        tamizajes: data.tamizajes || prev.tamizajes,
-        riesgo_seguridad: data.riesgo_seguridad || prev.riesgo_seguridad,
-        antecedentes: data.antecedentes || prev.antecedentes,
-        contexto_psicosocial: data.contexto_psicosocial || prev.contexto_psicosocial,
-        observaciones_clinicas: data.observaciones_clinicas || prev.observaciones_clinicas,
-        formulacion_clinica: data.formulacion_clinica || prev.formulacion_clinica,
-        objetivos: (data.objetivos as string[])?.length ? data.objetivos : prev.objetivos,
-        intervenciones: data.intervenciones || prev.intervenciones,
-        plan: data.plan || prev.plan,
-        cierre_administrativo: data.cierre_administrativo || prev.cierre_administrativo,
-      }));
-      toast.success("Historia clínica pre-llenada con IA. Revisa y guarda.");
+      // Each section is applied to the form as soon as the model finishes it
+      await backendStream(`${BACKEND_URL}/clinical/fill/stream`, { session_id: id }, (event) => {
+        if (event.type === "error") {
+          streamError = event.detail as string;
+          return;
+        }
+        if (event.type === "done") {
+          // Saved with the sections so the next fill only sends the new notes.
+          // Only when every section arrived; otherwise the missed notes are sent again next time
+          done = event as typeof done;
+          if (event.complete) setForm((prev) => ({ ...prev, fill_sources: event.fill_sources }));
+          return;
+        }
+        if (event.type !== "section") return;
+        const key = event.key as string;
+        const value = event.value;
+        const empty = Array.isArray(value) ? value.length === 0 : !value;
+        received += 1;
+        setForm((prev) => (empty ? prev : { ...prev, [key]: value }));
+      }, 90_000);
+      if (done.incremental && !streamError) {
+        toast.success(
+          done.up_to_date
+            ? "No hay notas nuevas desde el último llenado."
+            : `Historia clínica actualizada con las notas nuevas (${received} sección(es)). Revisa y guarda.`,
+        );
+      } else if (received === 0) {
+        toast.error(streamError || "Claude no devolvió ninguna sección");
+      } else if (received < 12) {
+        toast.warning(`Se llenaron ${received} de 12 secciones. Revisa y guarda.`);
+      } else {
+        toast.success("Historia clínica pre-llenada con IA. Revisa y guarda.");
+      }
     } catch (e: unknown) {
       toast.error(e instanceof Error ? e.message : "Error al llenar con IA");
     } finally {
@@ -389,7 +427,7 @@ export default function AdminSesionEditor() {
             disabled={extractingOcr || !uploads?.length}
           >
             {extractingOcr ? (
-              <><Sparkles className="mr-1.5 h-3.5 w-3.5 animate-spin" />Extrayendo...</>
+              <><Sparkles className="mr-1.5 h-3.5 w-3.5 animate-spin" />Extrayendo{ocrProgress ? ` ${ocrProgress.done}/${ocrProgress.total}` : ""}...</>
             ) : (
               <><Sparkles className="mr-1.5 h-3.5 w-3.5" />Extraer texto (OCR)</>
             )}
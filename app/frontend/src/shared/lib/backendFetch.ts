@@ -46,3 +46,72 @@ export async function backendPost(
     throw e;
   }
 }
+
+/**
+ * POST al backend leyendo una respuesta NDJSON línea por línea.
+ * Llama `onEvent` con cada objeto apenas llega, con los mismos mensajes
+ * de error que `backendPost`. El timeout es de inactividad: se reinicia con
+ * cada fragmento recibido, así un stream largo que sigue avanzando no se corta.
+ */
+export async function backendStream(
+  url: string,
+  body: unknown,
+  onEvent: (event: Record<string, unknown>) => void,
+  timeoutMs = 120_000
+): Promise<void> {
+  const controller = new AbortController();
+  let tid = setTimeout(() => controller.abort(), timeoutMs);
+  const resetTimeout = () => {
+    clearTimeout(tid);
+    tid = setTimeout(() => controller.abort(), timeoutMs);
+  };
+
+  try {
+    const resp = await fetch(url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(body),
+      signal: controller.signal,
+    });
+
+    if (!resp.ok || !resp.body) {
+      let detail = `Error ${resp.status}`;
+      try {
+        const err = await resp.json();
+        detail = err.detail || detail;
+      } catch {
+        // ignore JSON parse error
+      }
+      throw new Error(detail);
+    }
+
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      resetTimeout();
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split("\n");
+      buffer = lines.pop() ?? "";
+      for (const line of lines) {
+        if (line.trim()) onEvent(JSON.parse(line));
+      }
+    }
+    if (buffer.trim()) onEvent(JSON.parse(buffer));
+
+    clearTimeout(tid);
+  } catch (e) {
+    clearTimeout(tid);
+
+    if (e instanceof DOMException && e.name === "AbortError") {
+      throw new Error("La petición tardó demasiado. Verifica que el backend esté activo e intenta de nuevo.");
+    }
+    if (e instanceof TypeError && (e.message === "Failed to fetch" || e.message.includes("fetch"))) {
+      throw new Error("No se pudo conectar al backend. Verifica que esté activo e intenta de nuevo.");
+    }
+
+    throw e;
+  }
+}
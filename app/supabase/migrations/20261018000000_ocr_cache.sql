@@ -0,0 +1,10 @@
+-- ocr_cache: resultados OCR direccionados por contenido (sha256 imagen + prompt + modelo)
+CREATE TABLE IF NOT EXISTS public.ocr_cache (
+  key          TEXT PRIMARY KEY,
+  ocr_text     TEXT NOT NULL,
+  model        TEXT NOT NULL,
+  created_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- RLS: sin políticas, solo accesible con la service role key del backend
+ALTER TABLE public.ocr_cache ENABLE ROW LEVEL SECURITY;
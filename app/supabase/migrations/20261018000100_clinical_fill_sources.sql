@@ -0,0 +1,4 @@
+-- fill_sources: uploads (id -> hash del texto OCR) ya incorporados en las secciones
+-- guardadas; permite que /clinical/fill envíe solo las notas nuevas
+ALTER TABLE public.clinical_sessions
+  ADD COLUMN IF NOT EXISTS fill_sources JSONB NOT NULL DEFAULT '{}';
@@ -0,0 +1,14 @@
+-- summary_cache: resúmenes de preparación por paciente y fecha de próxima sesión.
+-- fingerprint = hash de ids + updated_at de las sesiones usadas; si no coincide, se regenera
+CREATE TABLE IF NOT EXISTS public.summary_cache (
+  patient_id         UUID NOT NULL REFERENCES public.patients(id) ON DELETE CASCADE,
+  next_session_date  TEXT NOT NULL DEFAULT '',
+  fingerprint        TEXT NOT NULL,
+  summary            TEXT NOT NULL,
+  model              TEXT NOT NULL,
+  created_at         TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (patient_id, next_session_date)
+);
+
+-- RLS: sin políticas, solo accesible con la service role key del backend
+ALTER TABLE public.summary_cache ENABLE ROW LEVEL SECURITY;
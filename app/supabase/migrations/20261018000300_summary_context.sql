@@ -0,0 +1,57 @@
+-- summary_context: datos del paciente y de sus últimas sesiones para /summary/sessions
+-- en un solo round trip, proyectando solo los campos que usa el prompt.
+-- Usa las sesiones guardadas (status <> 'draft'); si no hay ninguna, las de cualquier estado.
+CREATE OR REPLACE FUNCTION public.summary_context(p_patient_id UUID, p_limit INTEGER DEFAULT 10)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH candidates AS (
+    SELECT
+      id, session_number, session_date, updated_at, objetivos,
+      status <> 'draft'                         AS saved,
+      motivo_consulta->>'texto_paciente'        AS motivo,
+      plan->>'plan_semana'                      AS plan_semana,
+      plan->>'tarea'                            AS tarea,
+      formulacion_clinica->>'patrones'          AS patrones,
+      intervenciones->>'otros'                  AS intervenciones
+    FROM public.clinical_sessions
+    WHERE patient_id = p_patient_id
+  ),
+  picked AS (
+    SELECT * FROM candidates
+    WHERE saved OR NOT EXISTS (SELECT 1 FROM candidates WHERE saved)
+    ORDER BY session_date DESC
+    LIMIT p_limit
+  )
+  SELECT jsonb_build_object(
+    'patient', (
+      SELECT jsonb_build_object(
+        'full_name', p.full_name,
+        'preferred_name', p.preferred_name,
+        'age', p.age,
+        'updated_at', p.updated_at
+      )
+      FROM public.patients p
+      WHERE p.id = p_patient_id
+    ),
+    'sessions', COALESCE((
+      SELECT jsonb_agg(
+        jsonb_build_object(
+          'id', id,
+          'session_number', session_number,
+          'session_date', session_date,
+          'updated_at', updated_at,
+          'objetivos', objetivos,
+          'motivo', motivo,
+          'plan_semana', plan_semana,
+          'tarea', tarea,
+          'patrones', patrones,
+          'intervenciones', intervenciones
+        )
+        ORDER BY session_date DESC
+      )
+      FROM picked
+    ), '[]'::jsonb)
+  );
+$$;
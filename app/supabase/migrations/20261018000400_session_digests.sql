@@ -0,0 +1,110 @@
+-- Digest compacto por sesión, escrito al guardar; el resumen de preparación lee
+-- los digests de las sesiones recientes y roll-ups almacenados de las anteriores.
+ALTER TABLE public.clinical_sessions
+  ADD COLUMN IF NOT EXISTS digest TEXT;
+
+-- Misma forma que core/history.session_digest (campos recortados a 400 caracteres)
+CREATE OR REPLACE FUNCTION public.session_digest(s public.clinical_sessions)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT concat_ws(E'\n',
+    'Motivo: ' || left(NULLIF(s.motivo_consulta->>'texto_paciente', ''), 400),
+    'Objetivos: ' || left(NULLIF(array_to_string(s.objetivos, ', '), ''), 400),
+    CASE WHEN coalesce(s.plan->>'plan_semana', '') <> '' OR coalesce(s.plan->>'tarea', '') <> '' THEN
+      'Plan: ' || left(coalesce(s.plan->>'plan_semana', ''), 400)
+        || ' | Tarea: ' || left(coalesce(s.plan->>'tarea', ''), 400)
+    END,
+    'Patrones: ' || left(NULLIF(s.formulacion_clinica->>'patrones', ''), 400),
+    'Intervenciones: ' || left(NULLIF(s.intervenciones->>'otros', ''), 400)
+  );
+$$;
+
+CREATE OR REPLACE FUNCTION public.set_session_digest()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.digest := public.session_digest(NEW);
+  RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER clinical_sessions_digest
+  BEFORE INSERT OR UPDATE ON public.clinical_sessions
+  FOR EACH ROW EXECUTE FUNCTION public.set_session_digest();
+
+-- Backfill sin tocar updated_at (no invalida resúmenes en caché)
+ALTER TABLE public.clinical_sessions DISABLE TRIGGER clinical_sessions_updated_at;
+UPDATE public.clinical_sessions SET digest = public.session_digest(clinical_sessions);
+ALTER TABLE public.clinical_sessions ENABLE TRIGGER clinical_sessions_updated_at;
+
+-- session_rollups: resúmenes de bloques de sesiones antiguas (nivel 1) y de bloques
+-- de roll-ups (nivel 2+); fingerprint = hash de lo resumido, si cambia se regenera
+CREATE TABLE IF NOT EXISTS public.session_rollups (
+  patient_id   UUID NOT NULL REFERENCES public.patients(id) ON DELETE CASCADE,
+  level        INTEGER NOT NULL,
+  idx          INTEGER NOT NULL,
+  fingerprint  TEXT NOT NULL,
+  summary      TEXT NOT NULL,
+  model        TEXT NOT NULL,
+  created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (patient_id, level, idx)
+);
+
+-- RLS: sin políticas, solo accesible con la service role key del backend
+ALTER TABLE public.session_rollups ENABLE ROW LEVEL SECURITY;
+
+-- summary_context v2: todas las sesiones que cuentan (guardadas, o de cualquier estado si
+-- no hay guardadas) en orden cronológico con el hash de su digest; el digest completo solo
+-- para las p_limit + p_block - 1 más recientes (las que pueden ir tal cual al prompt).
+DROP FUNCTION IF EXISTS public.summary_context(UUID, INTEGER);
+
+CREATE OR REPLACE FUNCTION public.summary_context(p_patient_id UUID, p_limit INTEGER DEFAULT 10, p_block INTEGER DEFAULT 10)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+  WITH candidates AS (
+    SELECT id, session_number, session_date, created_at, updated_at, digest, status <> 'draft' AS saved
+    FROM public.clinical_sessions
+    WHERE patient_id = p_patient_id
+  ),
+  picked AS (
+    SELECT *, row_number() OVER (ORDER BY session_date DESC, created_at DESC) AS recency
+    FROM candidates
+    WHERE saved OR NOT EXISTS (SELECT 1 FROM candidates WHERE saved)
+  )
+  SELECT jsonb_build_object(
+    'patient', (
+      SELECT jsonb_build_object(
+        'full_name', p.full_name,
+        'preferred_name', p.preferred_name,
+        'age', p.age,
+        'updated_at', p.updated_at
+      )
+      FROM public.patients p
+      WHERE p.id = p_patient_id
+    ),
+    'sessions', COALESCE((
+      SELECT jsonb_agg(
+        jsonb_build_object(
+          'id', id,
+          'session_number', session_number,
+          'session_date', session_date,
+          'updated_at', updated_at,
+          'digest_hash', md5(coalesce(digest, '')),
+          'digest', CASE WHEN recency < p_limit + p_block THEN digest END
+        )
+        ORDER BY recency DESC
+      )
+      FROM picked
+    ), '[]'::jsonb),
+    'rollups', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('level', level, 'idx', idx, 'fingerprint', fingerprint, 'summary', summary))
+      FROM public.session_rollups r
+      WHERE r.patient_id = p_patient_id
+    ), '[]'::jsonb)
+  );
+$$;
@@ -0,0 +1,15 @@
+-- save_ocr_texts: guarda el texto de OCR de varias páginas en un solo UPDATE.
+-- Solo toca filas que existen: una página borrada mientras se procesaba sigue
+-- borrada (un upsert la volvería a insertar). Devuelve los ids actualizados.
+CREATE OR REPLACE FUNCTION public.save_ocr_texts(p_ids UUID[], p_texts TEXT[])
+RETURNS SETOF UUID
+LANGUAGE sql
+VOLATILE
+AS $$
+  UPDATE public.session_uploads AS u
+  SET ocr_text = t.ocr_text,
+      is_processed = TRUE
+  FROM unnest(p_ids, p_texts) AS t(id, ocr_text)
+  WHERE u.id = t.id
+  RETURNING u.id;
+$$;
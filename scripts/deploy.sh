@@ -79,6 +79,7 @@ DeployBackend() {
 
   # sed 's|=|: |g' conn/$SERVICE.env > conn/$SERVICE.yaml
   # echo "DEPLOYMENT_VERSION: $(date +%Y.%m.%d.%H.%M)" >> conn/$SERVICE.yaml
+  # echo "JOBS_DB: /data/jobs.sqlite3" >> conn/$SERVICE.yaml
 
   # # Update Cloud run service
   # gcloud run deploy \
@@ -91,7 +92,12 @@ DeployBackend() {
   #   --timeout 3600 \
   #   --env-vars-file conn/$SERVICE.yaml \
   #   --allow-unauthenticated \
-  #   --service-account $BASE_NAME-$SERVICE@$PROJECT.iam.gserviceaccount.com
+  #   --service-account $BASE_NAME-$SERVICE@$PROJECT.iam.gserviceaccount.com \
+  #   --execution-environment gen2 \
+  #   --no-cpu-throttling \
+  #   --min-instances 1 \
+  #   --add-volume name=jobs,type=nfs,location=$JOBS_NFS \
+  #   --add-volume-mount volume=jobs,mount-path=/data
 
   # rm conn/$SERVICE.yaml
 }